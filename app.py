@@ -1,19 +1,51 @@
 # app.py
 from flask import Flask, render_template
-from tasks.icd_recommend import icd_bp
-from tasks.generate_summary import summary_bp  
-
-app = Flask(__name__)
 from config import Config
-app.secret_key = Config.SECRET_KEY
 
-# 註冊所有 blueprint
-app.register_blueprint(icd_bp)           # ICD 任務
-app.register_blueprint(summary_bp)       # <-- 關鍵：加這行註冊 Summary 任務
+# 載入 ICD 對照表與 CAD 規則（gunicorn --preload 時在 fork 前執行，worker 共用）
+def init_data():
+    from common.icd_db import load_icd_db
+    from common.cad_rules import load_cad_rules
+    load_icd_db()
+    load_cad_rules()
+
+def create_app(preload=None):
+    from tasks.icd_recommend import icd_bp
+    from tasks.generate_summary import summary_bp  
+    from tasks.batch_icd import batch_icd_bp
+    from tasks.batch_summary import batch_summary_bp
+    from tasks.icd_search import icd_search_bp
+    from tasks.drg_rules import drg_rules_bp
+    from common import metrics, compression
+    
+    app = Flask(__name__)
+    app.secret_key = Config.SECRET_KEY
+    
+    # 註冊所有 blueprint
+    app.register_blueprint(icd_bp)           # ICD 任務
+    app.register_blueprint(summary_bp)       # <-- 關鍵：加這行註冊 Summary 任務
+    app.register_blueprint(batch_icd_bp)     # 批次 ICD / DRG 稽核
+    app.register_blueprint(batch_summary_bp) # 批次 Word 摘要
+    app.register_blueprint(icd_search_bp)    # ICD 搜尋 / 批次查詢
+    app.register_blueprint(drg_rules_bp)     # CAD / DRG 規則引擎
+    metrics.init_app(app)                    # 各階段耗時 / token / 快取指標（/metrics）
+    compression.init_app(app)                # 回應 br / gzip 壓縮、壓縮的請求內容
+    
+    @app.route('/')
+    def index():
+        return render_template('index_integrate.html')
+    
+    # 不預先載入時，資料會在第一次用到時才讀取
+    if preload is None:
+        preload = Config.PRELOAD_DATA
+    if preload:
+        init_data()
+    
+    return app
 
-@app.route('/')
-def index():
-    return render_template('index_integrate.html')
+# import app 只建立 app、不載入資料（工具、測試 import 不會卡在讀 ICD 表）；
+# 伺服器用 create_app() 依 PRELOAD_DATA 預先載入：gunicorn 'app:create_app()'、serve.py、python app.py
+app = create_app(preload=False)
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    create_app().run(debug=True, host='0.0.0.0', port=5001)
@@ -1,12 +1,361 @@
 # common/azure_client.py
-from openai import AzureOpenAI
+# Azure OpenAI 呼叫層：
+#   - 多個部署（AZURE_DEPLOYMENTS，可跨區域）依權重與負載分配，記錄各自的延遲與錯誤
+#   - 共用 httpx 連線池（keep-alive）與逾時設定
+#   - 每個部署各自的權杖桶限流（RPM / TPM），遇到 429 時該部署暫停 Retry-After 秒
+#   - 429 / 5xx / 逾時 / 連線錯誤：先換其他部署重送，全部都失敗才指數退避（優先採用 Retry-After）
+#   - 同時進行中的請求上限
+#   - 每次送出的結果、限流等待、整次呼叫耗時與上游 usage token 數記到 common.metrics
+# 呼叫端用法不變：client.chat.completions.create(...)
+import random
+import re
+import threading
+import time
 from config import Config
+from . import metrics
 
-client = AzureOpenAI(
-    api_key=Config.AZURE_API_KEY,
-    azure_endpoint=Config.AZURE_ENDPOINT,
-    api_version=Config.API_VERSION
-)
+client = None
+_client_lock = threading.Lock()
 
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,          # 呼叫次數（不含重試）
+    "attempts": 0,          # 實際送出次數（含重試）
+    "retries": 0,
+    "throttled": 0,         # 收到 429 次數
+    "server_errors": 0,     # 5xx / 逾時 / 連線錯誤
+    "failures": 0,          # 重試用盡仍失敗
+    "failovers": 0,         # 失敗後改送其他部署
+    "limiter_wait_seconds": 0.0,
+    "in_flight": 0
+}
+
+def _count(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["limiter_wait_seconds"] = round(stats["limiter_wait_seconds"], 3)
+    stats["deployments"] = [d.get_stats() for d in client.deployments] if client is not None else []
+    return stats
+
+class TokenBucket:
+    # 每分鐘 per_minute 單位，容量一分鐘份；per_minute <= 0 表示不限制
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        
+    # 取得 amount 單位，不足就等；回傳等待秒數
+    def acquire(self, amount):
+        if self.capacity <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = max(self.paused_until - now, (amount - self.tokens) / self.rate)
+            delay = min(delay, 5.0)
+            time.sleep(delay)
+            waited += delay
+            
+    # 不等待，只看目前是否足夠（挑選部署用）
+    def available(self, amount):
+        if self.capacity <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            return now >= self.paused_until and self.tokens >= min(amount, self.capacity)
+            
+    # 上游回 429：所有人一起暫停，避免整批同時重試
+    def pause(self, seconds):
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+_concurrency = threading.BoundedSemaphore(Config.AZURE_MAX_CONCURRENCY)
+
+# 估算 TPM 用量（Azure 以 prompt + max_tokens 計）：中文約 1 字 1 token，其餘約 4 字元 1 token
+CJK_RE = re.compile(r"[\u3400-\u9fff]")
+
+def estimate_tokens(messages, max_tokens=0):
+    cjk = other = 0
+    for message in messages:
+        content = message.get("content") or ""
+        count = len(CJK_RE.findall(content))
+        cjk += count
+        other += len(content) - count
+    return cjk + other // 4 + len(messages) * 4 + (max_tokens or 0)
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+def _backoff(attempt):
+    delay = min(Config.AZURE_BACKOFF_MAX, Config.AZURE_BACKOFF_BASE * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+# 單一部署（endpoint + deployment）：各自的限流、健康狀態與延遲統計
+class Deployment:
+    def __init__(self, spec, http_client):
+        from openai import AzureOpenAI
+        self.deployment = spec["deployment"]
+        self.name = spec.get("name") or self.deployment
+        self.weight = float(spec.get("weight", 1.0)) or 1.0
+        self.raw = AzureOpenAI(
+            api_key=spec.get("api_key", Config.AZURE_API_KEY),
+            azure_endpoint=spec.get("endpoint", Config.AZURE_ENDPOINT),
+            api_version=spec.get("api_version", Config.API_VERSION),
+            http_client=http_client,
+            timeout=http_client.timeout,
+            max_retries=0   # 重試 / 換部署由 _Completions 處理（才能計數、配合限流）
+        )
+        self.request_bucket = TokenBucket(spec.get("rpm_limit", Config.AZURE_RPM_LIMIT))
+        self.token_bucket = TokenBucket(spec.get("tpm_limit", Config.AZURE_TPM_LIMIT))
+        
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.latency = None             # 成功呼叫的延遲（指數移動平均，秒）
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0       # 429 或連續失敗後暫停使用到這個時間
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        
+    def available(self, now, tokens):
+        return (now >= self.cooldown_until
+                and self.request_bucket.available(1)
+                and self.token_bucket.available(tokens))
+                
+    # 越小越優先：進行中的請求越少、延遲越短、權重越高
+    def load_score(self):
+        latency = self.latency if self.latency is not None else 1.0
+        return (self.in_flight + 1) * latency / self.weight
+        
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+            self.requests += 1
+            
+    def finish(self):
+        with self.lock:
+            self.in_flight -= 1
+            
+    def record_success(self, seconds):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+            
+    def record_throttled(self, seconds):
+        with self.lock:
+            self.throttled += 1
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+        self.request_bucket.pause(seconds)
+        self.token_bucket.pause(seconds)
+        
+    # 連續失敗達門檻：暫停一段時間，請求改送其他部署
+    def record_failure(self):
+        with self.lock:
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= Config.AZURE_FAILURE_THRESHOLD:
+                self.cooldown_until = time.monotonic() + Config.AZURE_FAILURE_COOLDOWN
+                
+    def get_stats(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "deployment": self.deployment,
+                "weight": self.weight,
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "errors": self.errors,
+                "throttled": self.throttled,
+                "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+                "healthy": time.monotonic() >= self.cooldown_until,
+                "cooldown_seconds": round(max(0.0, self.cooldown_until - time.monotonic()), 1)
+            }
+
+# 沒有設定 AZURE_DEPLOYMENTS 時，以單一部署（AZURE_ENDPOINT + DEPLOYMENT）運作
+def deployment_specs():
+    if Config.AZURE_DEPLOYMENTS:
+        return Config.AZURE_DEPLOYMENTS
+    return [{
+        "name": Config.DEPLOYMENT,
+        "endpoint": Config.AZURE_ENDPOINT,
+        "api_key": Config.AZURE_API_KEY,
+        "api_version": Config.API_VERSION,
+        "deployment": Config.DEPLOYMENT
+    }]
+
+# 挑選部署：先排除冷卻中 / 配額用完 / 這次已失敗過的，再取負載分數最低者
+# 全部不可用時，挑最快恢復的那個
+def _choose(deployments, tried, tokens):
+    now = time.monotonic()
+    candidates = [d for d in deployments if d.name not in tried and d.available(now, tokens)]
+    if candidates:
+        return min(candidates, key=Deployment.load_score)
+    candidates = [d for d in deployments if d.name not in tried] or deployments
+    return min(candidates, key=lambda d: (d.cooldown_until, d.load_score()))
+
+# 串流：整個串流讀完（或被放棄）才釋放名額；耗時算到串流結束
+def _guarded_stream(stream, deployment, started):
+    try:
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                metrics.record_usage(deployment.name, usage)
+            yield chunk
+    except Exception as e:
+        metrics.count_error("llm", e)
+        raise
+    finally:
+        deployment.finish()
+        _count("in_flight", -1)
+        _concurrency.release()
+        metrics.observe_stage("llm", time.perf_counter() - started)
+
+class _Completions:
+    def __init__(self, deployments):
+        self._deployments = deployments
+        
+    def create(self, **kwargs):
+        import openai
+        
+        _count("requests")
+        tokens = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+        if kwargs.get("stream") and Config.METRICS_STREAM_USAGE:
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        
+        call_started = time.perf_counter()
+        _concurrency.acquire()
+        _count("in_flight")
+        stream_owner = None
+        try:
+            attempt = 0
+            tried = set()
+            while True:
+                deployment = _choose(self._deployments, tried, tokens)
+                waited = deployment.request_bucket.acquire(1)
+                waited += deployment.token_bucket.acquire(tokens)
+                if waited:
+                    _count("limiter_wait_seconds", waited)
+                    metrics.count_wait(deployment.name, waited)
+                    
+                _count("attempts")
+                deployment.start()
+                started = time.monotonic()
+                handed_over = False
+                try:
+                    # model 以實際選到的部署為準（呼叫端傳的是邏輯名稱）
+                    result = deployment.raw.chat.completions.create(**dict(kwargs, model=deployment.deployment))
+                    deployment.record_success(time.monotonic() - started)
+                    metrics.count_attempt(deployment.name, "ok")
+                    if kwargs.get("stream"):
+                        handed_over = True
+                        stream_owner = deployment
+                        return _guarded_stream(result, deployment, call_started)
+                    metrics.record_usage(deployment.name, getattr(result, "usage", None))
+                    return result
+                except openai.RateLimitError as e:
+                    error = e
+                    _count("throttled")
+                    metrics.count_attempt(deployment.name, "throttled")
+                    delay = _retry_after(e) or _backoff(attempt)
+                    deployment.record_throttled(delay)
+                except openai.APIStatusError as e:
+                    if e.status_code < 500:
+                        metrics.count_attempt(deployment.name, "client_error")
+                        raise
+                    error = e
+                    _count("server_errors")
+                    metrics.count_attempt(deployment.name, "server_error")
+                    deployment.record_failure()
+                    delay = _retry_after(e) or _backoff(attempt)
+                except (openai.APITimeoutError, openai.APIConnectionError) as e:
+                    error = e
+                    _count("server_errors")
+                    metrics.count_attempt(deployment.name, "connection_error")
+                    deployment.record_failure()
+                    delay = _backoff(attempt)
+                finally:
+                    if not handed_over:
+                        deployment.finish()
+                    
+                if attempt >= Config.AZURE_MAX_RETRIES:
+                    _count("failures")
+                    raise error
+                attempt += 1
+                _count("retries")
+                
+                # 還有沒試過的部署就立刻換過去；都試過了才等待退避時間
+                tried.add(deployment.name)
+                if len(tried) >= len(self._deployments):
+                    tried.clear()
+                    time.sleep(min(delay, Config.AZURE_BACKOFF_MAX))
+                else:
+                    _count("failovers")
+        except Exception as e:
+            metrics.count_error("llm", e)
+            raise
+        finally:
+            if stream_owner is None:
+                _count("in_flight", -1)
+                _concurrency.release()
+                metrics.observe_stage("llm", time.perf_counter() - call_started)
+
+class _Chat:
+    def __init__(self, deployments):
+        self.completions = _Completions(deployments)
+
+class ResilientClient:
+    def __init__(self, deployments):
+        self.deployments = deployments
+        self.chat = _Chat(deployments)
+
+# 第一次呼叫才建立 client（openai SDK 載入較慢，不放在 import 時）
+# 回傳的 deployment 是邏輯名稱（快取 key 用）；實際送到哪個部署由 client 決定
 def get_client_and_deployment():
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from openai import DefaultHttpxClient, Timeout, DEFAULT_CONNECTION_LIMITS
+                # 用 SDK 匯出的類別建連線池（不同版本的 openai 底層 http 套件不同）；所有部署共用
+                Limits = type(DEFAULT_CONNECTION_LIMITS)
+                http_client = DefaultHttpxClient(
+                    limits=Limits(
+                        max_connections=Config.AZURE_POOL_CONNECTIONS,
+                        max_keepalive_connections=Config.AZURE_POOL_KEEPALIVE,
+                        keepalive_expiry=Config.AZURE_KEEPALIVE_EXPIRY
+                    ),
+                    timeout=Timeout(Config.AZURE_TIMEOUT, connect=Config.AZURE_CONNECT_TIMEOUT)
+                )
+                client = ResilientClient([Deployment(spec, http_client) for spec in deployment_specs()])
     return client, Config.DEPLOYMENT
\ No newline at end of file
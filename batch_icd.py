@@ -0,0 +1,206 @@
+# tasks/batch_icd.py
+from flask import Blueprint, request, jsonify, send_file
+from concurrent.futures import ThreadPoolExecutor
+from common.utils import read_word_file, read_pdf_file, parse_icd_result
+from common.cad_rules import check_icd_result
+from common.icd_candidates import extract_candidates
+from tasks.icd_recommend import build_icd_messages, run_icd_completion, condense_case_text, find_near_duplicate, should_reuse, remember_analysis
+from common.batch_store import get_batch_store
+from common import metrics
+from config import Config
+import io
+import os
+import time
+import uuid
+import zipfile
+
+batch_icd_bp = Blueprint('batch_icd', __name__)
+
+# 全部批次共用同一個 pool → 同時打到 Azure 的請求數不超過 BATCH_MAX_WORKERS
+executor = ThreadPoolExecutor(max_workers=Config.BATCH_MAX_WORKERS, thread_name_prefix='batch_icd')
+
+RESULT_COLUMNS = ["case_id", "status", "cad", "complex", "drg", "rw", "rule_drg", "rule_rw", "drg_consistent", "codes", "cad_candidate", "cached",
+                  "near_dup_similarity", "near_dup_case", "reused", "error"]
+
+# 讀取 CSV / XLSX：需要 case_text 欄位，discharge、case_id 可選
+def read_case_table(file_bytes, filename):
+    import pandas as pd
+    
+    if filename.lower().endswith('.csv'):
+        df = pd.read_csv(io.BytesIO(file_bytes), encoding='utf-8-sig', dtype=str)
+    else:
+        df = pd.read_excel(io.BytesIO(file_bytes), dtype=str)
+        
+    if 'case_text' not in df.columns:
+        raise ValueError("表格缺少 case_text 欄位")
+        
+    df = df.fillna('')
+    cases = []
+    for i, row in enumerate(df.to_dict('records'), start=1):
+        cases.append({
+            "case_id": str(row.get('case_id', '')).strip() or str(i),
+            "case_text": str(row['case_text']).strip(),
+            "discharge": str(row.get('discharge', '')).strip()
+        })
+    return cases
+
+# 讀取 zip 內的 .docx / .pdf，每個檔案一個病例（直接從記憶體讀，不解壓到暫存目錄）
+def read_case_zip(file_bytes):
+    cases = []
+    with zipfile.ZipFile(io.BytesIO(file_bytes)) as zf:
+        for info in zf.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith('__MACOSX/'):
+                continue
+            ext = os.path.splitext(name)[1].lower()
+            if ext not in ('.docx', '.pdf'):
+                continue
+                
+            data = zf.read(info)
+            text = read_word_file(io.BytesIO(data)) if ext == '.docx' else read_pdf_file(data)
+            cases.append({"case_id": os.path.basename(name), "case_text": text.strip(), "discharge": ""})
+    return cases
+
+def run_case(job_id, index, case):
+    metrics.reset(route="batch_icd", template="default")
+    row = {"case_id": case["case_id"], "status": "done", "cad": "", "complex": "", "drg": "",
+           "rw": "", "rule_drg": "", "rule_rw": "", "drg_consistent": "", "codes": "", "cad_candidate": "", "cached": False,
+           "near_dup_similarity": "", "near_dup_case": "", "reused": False, "error": ""}
+    try:
+        if not case["case_text"]:
+            raise ValueError("病例文字為空")
+            
+        with metrics.stage("prefilter"):
+            prefilter = extract_candidates(case["case_text"], case["discharge"])
+        row["cad_candidate"] = prefilter["has_cad_candidate"]
+        
+        # 病歷完全沒有缺血性心臟病的字眼 / 代碼：直接判定非 CAD，不花上游呼叫
+        if Config.BATCH_SKIP_NON_CAD and not prefilter["has_cad_candidate"]:
+            row["status"] = "skipped"
+            row["cad"] = "否"
+            row["codes"] = ", ".join(c["code"] for c in prefilter["candidates"])
+        else:
+            # 同批或先前分析過的近似病例：記下相似度；開啟 NEAR_DUP_REUSE 且夠相似就不呼叫上游
+            probe, match = find_near_duplicate(case["case_text"], case["discharge"])
+            if match:
+                row["near_dup_similarity"] = match["similarity"]
+                row["near_dup_case"] = match["value"]["case_id"]
+            if should_reuse(match):
+                llm_output, cached = match["value"]["llm_output"], True
+                row["reused"] = True
+            else:
+                condensed_text, _ = condense_case_text(case["case_text"])
+                messages = build_icd_messages(condensed_text, case["discharge"], prefilter=prefilter)
+                llm_output, cached = run_icd_completion(messages)
+                remember_analysis(probe, match, llm_output, case["case_id"])
+            
+            with metrics.stage("postprocess"):
+                parsed = parse_icd_result(llm_output)
+                check = check_icd_result(parsed)
+            row["rule_drg"] = check["drg"]
+            row["rule_rw"] = check["rw"]
+            row["drg_consistent"] = check["consistent"]
+            parsed["codes"] = ", ".join(parsed["codes"])
+            row.update(parsed)
+            row["cached"] = cached
+    except Exception as e:
+        metrics.count_error("request", e)
+        row["status"] = "failed"
+        row["error"] = str(e)
+        
+    save_result(job_id, index, row)
+
+# 狀態與結果存在 SQLite，其他 worker 也查得到；寫入失敗（例：鎖定逾時）重試，最後仍失敗就記錄下來
+# （在 executor 內拋出的例外沒有人會看到，該病例也永遠不會算進進度）
+def save_result(job_id, index, row):
+    for attempt in range(1, Config.BATCH_SAVE_RETRIES + 1):
+        try:
+            get_batch_store().save_result(job_id, index, row, failed=row["status"] == "failed")
+            return True
+        except Exception as e:
+            metrics.count_error("batch_store", e)
+            print(f"批次結果寫入錯誤（工作 {job_id} 第 {index + 1} 筆，第 {attempt} 次）: {e}")
+            if attempt < Config.BATCH_SAVE_RETRIES:
+                time.sleep(attempt)
+    return False
+
+def job_status(job):
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "total": job["total"],
+        "completed": job["completed"],
+        "failed": job["failed"],
+        "progress": round(job["completed"] / job["total"], 4) if job["total"] else 1.0,
+        "elapsed": round((job["finished_at"] or time.time()) - job["created_at"], 2),
+        "result_url": f"/batch_icd/{job['job_id']}/result"
+    }
+
+# 上傳 CSV / XLSX / zip，建立批次工作
+@batch_icd_bp.route('/batch_icd', methods=['POST'])
+def create_batch_icd():
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({"error": "請上傳 CSV、XLSX 或 zip 檔"}), 400
+        
+    filename = file.filename.lower()
+    file_bytes = file.read()
+    
+    try:
+        if filename.endswith(('.csv', '.xlsx')):
+            cases = read_case_table(file_bytes, filename)
+        elif filename.endswith('.zip'):
+            cases = read_case_zip(file_bytes)
+        else:
+            return jsonify({"error": "只接受 .csv、.xlsx 或 .zip"}), 400
+    except Exception as e:
+        return jsonify({"error": f"讀取檔案失敗：{str(e)}"}), 400
+        
+    if not cases:
+        return jsonify({"error": "檔案中沒有病例"}), 400
+    if len(cases) > Config.BATCH_MAX_CASES:
+        return jsonify({"error": f"單一批次最多 {Config.BATCH_MAX_CASES} 筆"}), 400
+        
+    job_id = uuid.uuid4().hex
+    store = get_batch_store()
+    store.create(job_id, len(cases))
+    
+    for index, case in enumerate(cases):
+        executor.submit(run_case, job_id, index, case)
+        
+    return jsonify(job_status(store.get(job_id))), 202
+
+# 查詢進度
+@batch_icd_bp.route('/batch_icd/<job_id>')
+def get_batch_icd(job_id):
+    job = get_batch_store().get(job_id)
+    if job is None:
+        return jsonify({"error": "找不到批次工作"}), 404
+    return jsonify(job_status(job))
+
+# 下載結果表（未完成的病例狀態為 pending）
+@batch_icd_bp.route('/batch_icd/<job_id>/result')
+def get_batch_icd_result(job_id):
+    store = get_batch_store()
+    job = store.get(job_id)
+    if job is None:
+        return jsonify({"error": "找不到批次工作"}), 404
+    rows = [row or {"status": "pending"} for row in store.get_results(job_id, job["total"])]
+        
+    import pandas as pd
+    
+    df = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    output = io.BytesIO()
+    
+    if request.args.get('format') == 'xlsx':
+        df.to_excel(output, index=False)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        download_name = f"batch_icd_{job_id}.xlsx"
+    else:
+        # utf-8-sig：Excel 直接開啟中文不會亂碼
+        output.write(df.to_csv(index=False).encode('utf-8-sig'))
+        mimetype = 'text/csv'
+        download_name = f"batch_icd_{job_id}.csv"
+        
+    output.seek(0)
+    return send_file(output, as_attachment=True, download_name=download_name, mimetype=mimetype)
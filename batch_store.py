@@ -0,0 +1,158 @@
+# common/batch_store.py
+# 批次 ICD 工作的狀態與結果：SQLite（WAL），gunicorn 多個 worker 共用同一個檔案
+#   - 工作在建立它的 worker 執行；進度查詢、結果下載可以落在任何一個 worker
+#   - 每完成一個病例在單一交易內寫入結果並更新計數，全部完成時標記 finished
+#   - 只保留最近 max_jobs 個工作（只丟掉已結束的，連同結果一起刪除）
+#   - 執行中的工作記下 owner（主機:pid）與最後進度時間：owner 行程已不存在（worker 重啟）或超過 stale_seconds
+#     沒有進度，查詢時標記為 failed，不會永遠停在 running
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from config import Config
+
+class BatchJobStore:
+    def __init__(self, db_path, max_jobs=20, stale_seconds=1800):
+        self.db_path = db_path
+        self.max_jobs = max_jobs
+        self.stale_seconds = stale_seconds
+        
+        self._local = threading.local()
+        
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS batch_jobs ("
+            "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, total INTEGER NOT NULL, "
+            "completed INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, finished_at REAL, owner TEXT, updated_at REAL)"
+        )
+        # 舊版資料表沒有 owner / updated_at
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(batch_jobs)")}
+        for column, kind in (("owner", "TEXT"), ("updated_at", "REAL")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE batch_jobs ADD COLUMN {column} {kind}")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS batch_results ("
+            "job_id TEXT NOT NULL, idx INTEGER NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (job_id, idx))"
+        )
+        
+    # 每個執行緒各自一條 SQLite 連線
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+        
+    # 執行工作的行程：同一台主機上以 pid 判斷是否還活著
+    @staticmethod
+    def _owner():
+        return f"{socket.gethostname()}:{os.getpid()}"
+        
+    @staticmethod
+    def _owner_alive(owner):
+        host, _, pid = (owner or "").rpartition(":")
+        if host != socket.gethostname() or not pid.isdigit():
+            return True   # 其他主機的行程無從判斷，只靠 stale_seconds
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            return True
+        return True
+        
+    def create(self, job_id, total):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO batch_jobs (job_id, status, total, created_at, owner, updated_at) VALUES (?, 'running', ?, ?, ?, ?)",
+                (job_id, total, now, self._owner(), now)
+            )
+            # 超過上限時依建立時間刪掉最舊的已結束工作
+            count = conn.execute("SELECT COUNT(*) FROM batch_jobs").fetchone()[0]
+            if count > self.max_jobs:
+                stale = [row[0] for row in conn.execute(
+                    "SELECT job_id FROM batch_jobs WHERE status != 'running' ORDER BY created_at LIMIT ?",
+                    (count - self.max_jobs,)
+                )]
+                for stale_id in stale:
+                    conn.execute("DELETE FROM batch_results WHERE job_id = ?", (stale_id,))
+                    conn.execute("DELETE FROM batch_jobs WHERE job_id = ?", (stale_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+            
+    # 寫入第 index 個病例的結果並更新進度
+    def save_result(self, job_id, index, row, failed=False):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO batch_results (job_id, idx, data) VALUES (?, ?, ?)",
+                (job_id, index, json.dumps(row, ensure_ascii=False))
+            )
+            conn.execute(
+                "UPDATE batch_jobs SET completed = completed + 1, failed = failed + ?, updated_at = ? WHERE job_id = ?",
+                (1 if failed else 0, time.time(), job_id)
+            )
+            conn.execute(
+                "UPDATE batch_jobs SET status = 'finished', finished_at = ? WHERE job_id = ? AND completed >= total",
+                (time.time(), job_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+            
+    # 不存在回傳 None；執行中但 owner 已不存在或太久沒有進度的工作改標記為 failed
+    def get(self, job_id):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT job_id, status, total, completed, failed, created_at, finished_at, owner, updated_at FROM batch_jobs WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("job_id", "status", "total", "completed", "failed", "created_at", "finished_at", "owner", "updated_at"), row))
+        
+        now = time.time()
+        last_progress = job["updated_at"] or job["created_at"]
+        if job["status"] == "running" and (
+                not self._owner_alive(job["owner"]) or (self.stale_seconds and now - last_progress > self.stale_seconds)):
+            conn.execute(
+                "UPDATE batch_jobs SET status = 'failed', finished_at = ? WHERE job_id = ? AND status = 'running'",
+                (now, job_id)
+            )
+            job["status"] = "failed"
+            job["finished_at"] = now
+        return job
+        
+    # 依病例順序回傳結果，尚未完成的為 None
+    def get_results(self, job_id, total):
+        results = [None] * total
+        for index, data in self._conn().execute("SELECT idx, data FROM batch_results WHERE job_id = ?", (job_id,)):
+            results[index] = json.loads(data)
+        return results
+
+_store = None
+_store_lock = threading.Lock()
+
+# 第一次使用才建立
+def get_batch_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BatchJobStore(Config.BATCH_DB_PATH, Config.BATCH_MAX_JOBS, Config.BATCH_STALE_SECONDS)
+    return _store
@@ -0,0 +1,137 @@
+# tasks/batch_summary.py
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from common.utils import read_word_file
+from tasks.generate_summary import summarize_text, insert_summary_at_bookmark, bind_summary_template
+from common.doc_buffers import spool_uploaded_word, new_buffer
+from common import metrics
+from config import Config
+import io
+import os
+import csv
+import time
+import shutil
+import zipfile
+from urllib.parse import quote
+
+batch_summary_bp = Blueprint('batch_summary', __name__)
+
+# 每個檔案：讀取 → 摘要 → 插入書籤；同時進行的檔案數（= 同時打到 Azure 的請求數）不超過 BATCH_MAX_WORKERS
+executor = ThreadPoolExecutor(max_workers=Config.BATCH_MAX_WORKERS, thread_name_prefix='batch_summary')
+
+# 上傳檔與輸出檔都是記憶體緩衝區（超過 DOC_SPOOL_MAX_BYTES 才寫到匿名暫存檔）
+def summarize_one(uploaded_word, original_name, template_type, custom_prompt):
+    metrics.reset(route="batch_summary")
+    bind_summary_template(template_type)
+    started = time.time()
+    item = {"filename": original_name, "output": "", "status": "done", "summary_chars": 0, "error": "", "elapsed": 0}
+    output = None
+    try:
+        full_content = read_word_file(uploaded_word)
+        if not full_content.strip():
+            raise ValueError("Word 檔案沒有文字內容")
+            
+        summary = summarize_text(full_content, template_type, custom_prompt)
+        
+        output = new_buffer()
+        with metrics.stage("word_insert"):
+            insert_summary_at_bookmark(uploaded_word, summary, "AI_SUMMARY_HERE", output)
+        output.seek(0)
+        
+        item["output"] = f"AI摘要_{original_name}"
+        item["summary_chars"] = len(summary)
+    except Exception as e:
+        metrics.count_error("request", e)
+        item["status"] = "failed"
+        item["error"] = str(e)
+        if output:
+            output.close()
+        output = None
+    finally:
+        uploaded_word.close()
+        
+    item["elapsed"] = round(time.time() - started, 2)
+    return item, output
+
+# 只能寫入、不能 seek 的輸出：zipfile 改用 data descriptor，寫進來的位元組由 drain() 取走後送出
+class ZipChunks(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+        
+    def writable(self):
+        return True
+        
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+        
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+# 哪個檔案先完成就先寫進 zip 送出，最後附上 manifest.csv（依上傳順序）
+def stream_zip(futures):
+    manifest = [None] * len(futures)
+    sink = ZipChunks()
+    try:
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for future in as_completed(futures):
+                item, output = future.result()
+                manifest[futures[future]] = item
+                if output:
+                    with output, zf.open(item["output"], 'w') as entry:
+                        shutil.copyfileobj(output, entry)
+                    yield sink.drain()
+                    
+            manifest_csv = io.StringIO()
+            writer = csv.DictWriter(manifest_csv, fieldnames=["filename", "output", "status", "summary_chars", "error", "elapsed"])
+            writer.writeheader()
+            writer.writerows(manifest)
+            # utf-8-sig：Excel 直接開啟中文不會亂碼
+            zf.writestr("manifest.csv", manifest_csv.getvalue().encode('utf-8-sig'))
+        yield sink.drain()
+    finally:
+        # 用戶端中途斷線：還沒送出的輸出檔在完成後關閉
+        for future in futures:
+            future.add_done_callback(close_output)
+
+def close_output(future):
+    if not future.cancelled() and future.exception() is None:
+        _, output = future.result()
+        if output and not output.closed:
+            output.close()
+
+# 一次上傳多個 .docx，以串流回傳 zip：每完成一份摘要 Word 就送出，最後附 manifest.csv（失敗的檔案記在 manifest）
+@batch_summary_bp.route('/batch_summary', methods=['POST'])
+def batch_summary():
+    custom_prompt = request.form.get('custom_prompt', '').strip()
+    template_type = request.form.get('template_type', 'general')
+    
+    files = [f for f in request.files.getlist('files') if f and f.filename.lower().endswith('.docx')]
+    if not files:
+        return jsonify({"error": "請上傳至少一個 .docx 檔案"}), 400
+    if len(files) > Config.BATCH_MAX_CASES:
+        return jsonify({"error": f"單一批次最多 {Config.BATCH_MAX_CASES} 個檔案"}), 400
+        
+    # 同名檔案加上序號，避免 zip 內互相覆蓋
+    jobs = []
+    used_names = set()
+    for i, file in enumerate(files, start=1):
+        original_name = os.path.basename(file.filename)
+        if original_name in used_names:
+            original_name = f"{i}_{original_name}"
+        used_names.add(original_name)
+        jobs.append((spool_uploaded_word(file), original_name))
+        
+    futures = {
+        executor.submit(summarize_one, buffer, name, template_type, custom_prompt): index
+        for index, (buffer, name) in enumerate(jobs)
+    }
+    
+    response = Response(stream_with_context(stream_zip(futures)), mimetype='application/zip')
+    download = f"AI摘要_{len(files)}份.zip"
+    response.headers['Content-Disposition'] = f"attachment; filename=\"batch_summary.zip\"; filename*=UTF-8''{quote(download)}"
+    response.headers['X-Batch-Total'] = str(len(files))
+    response.headers['Access-Control-Expose-Headers'] = 'X-Batch-Total'
+    return response
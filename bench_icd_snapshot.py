@@ -0,0 +1,74 @@
+# bench_icd_snapshot.py
+# 比較 ICD 載入方式：CSV → dict（原本做法） vs mmap 快照
+# 每種方式各開一個子行程量測：載入時間、私有記憶體（RssAnon）、檔案對映記憶體（RssFile，可跨 worker 共用）、查詢延遲
+# 用法（專案根目錄）：python bench_icd_snapshot.py
+import json
+import os
+import subprocess
+import sys
+import time
+
+CHILD = r'''
+import json, os, sys, time
+
+def rss():
+    # Linux：/proc/self/status；RssFile 是 page cache，可被多個 worker 共用
+    result = {}
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'RssAnon', 'RssFile'):
+                    result[key] = int(value.split()[0]) / 1024
+    return result
+
+import pandas  # 兩種方式都先載入 pandas，只比較 ICD 載入本身
+from config import Config
+if sys.argv[1] == 'dict':
+    Config.ICD_SNAPSHOT_PATH = None
+
+before = rss()
+started = time.perf_counter()
+from common import icd_db
+icd_db.load_icd_db()  # import 不會載入資料（第一次使用才載入），要明確呼叫才量得到載入時間
+load_seconds = time.perf_counter() - started
+after = rss()
+
+codes = list(icd_db.icd_dict.keys())[::97][:500] + ['ZZZ999', 'I25110', 'I5020']
+started = time.perf_counter()
+for _ in range(20):
+    for code in codes:
+        icd_db.icd_dict.get(code, {})
+lookup_us = (time.perf_counter() - started) / (20 * len(codes)) * 1e6
+after_lookup = rss()
+
+print(json.dumps({
+    'entries': len(icd_db.icd_dict),
+    'load_ms': round(load_seconds * 1000, 1),
+    'lookup_us': round(lookup_us, 2),
+    'rss_anon_mb': round(after.get('RssAnon', 0) - before.get('RssAnon', 0), 1),
+    'rss_file_mb': round(after_lookup.get('RssFile', 0) - before.get('RssFile', 0), 1),
+    'rss_total_mb': round(after_lookup.get('VmRSS', 0) - before.get('VmRSS', 0), 1),
+}))
+'''
+
+def run(mode):
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD, mode],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    from config import Config
+    from common.icd_snapshot import build_snapshot
+    
+    started = time.perf_counter()
+    count = build_snapshot(Config.ICD_CSV_PATH, Config.ICD_SNAPSHOT_PATH)
+    build_ms = (time.perf_counter() - started) * 1000
+    print(f"快照建立：{count} 筆，{os.path.getsize(Config.ICD_SNAPSHOT_PATH) / 1024:.0f} KB，{build_ms:.0f} ms")
+    
+    print(f"{'方式':<10}{'載入 ms':>10}{'查詢 us':>10}{'私有 MB':>10}{'共用 MB':>10}{'RSS MB':>10}")
+    for mode in ('dict', 'snapshot'):
+        r = run(mode)
+        print(f"{mode:<10}{r['load_ms']:>10}{r['lookup_us']:>10}{r['rss_anon_mb']:>10}{r['rss_file_mb']:>10}{r['rss_total_mb']:>10}")
@@ -0,0 +1,299 @@
+# bench_load.py
+# 負載測試與回歸基準：啟動本機假 Azure 上游（fake_azure.py）與實際的伺服器，逐級提高並行數量測
+#   情境（--scenarios）：
+#     icd           POST /generate_icd（每個請求的病例文字都不同，不會命中快取）
+#     icd_stream    POST /generate_icd_stream，讀完整個 SSE；另記第一個 token 的時間（ttft）
+#     summary       POST /generate_summary，上傳含 AI_SUMMARY_HERE 書籤的 .docx（每份內容不同），收回插好摘要的 Word
+#     postprocess   在本行程直接呼叫 post_process_icd_with_cad（不經 HTTP、不呼叫上游）
+#     word_insert   在本行程直接呼叫 insert_summary_at_bookmark
+#   - 每個並行數送 --requests 個請求（同時最多 --concurrency 個），量測 p50 / p95 / p99、每秒完成數、錯誤數、峰值 RSS、上游 429 次數
+#   - 假上游的延遲分布、串流間隔、429 注入見 fake_azure.py（--latency / --token-delay / --throttle-rate / --rpm）
+#   - --save 把結果寫成基準檔；--compare 與基準檔比較，p95 變慢或吞吐量下降超過 --tolerance 列為退步（結束碼 1）
+# 用法（專案根目錄）：python bench_load.py [--scenarios icd summary postprocess] [--concurrency 1 8 32] [--requests 100]
+#                     [--latency lognormal:1,0.4] [--throttle-rate 0.02] [--save bench_baseline.json | --compare bench_baseline.json]
+# 伺服器端的限流（AZURE_RPM_LIMIT / AZURE_TPM_LIMIT）與 LLM 快取在測試中關閉（同 bench_serving.py）
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_serving import SERVER, proc_status, wait_ready, percentile
+
+HTTP_SCENARIOS = ("icd", "icd_stream", "summary")
+LOCAL_SCENARIOS = ("postprocess", "word_insert")
+BOOKMARK = "AI_SUMMARY_HERE"
+
+SAMPLE_CASE = """【入院紀錄】
+65 歲男性，高血壓、第二型糖尿病病史，運動時胸悶三個月，休息數分鐘可緩解，近一週發作頻率增加。
+理學檢查：BP 148/86 mmHg，HR 82，心音規則無雜音，兩側呼吸音清。
+心電圖：V4-V6 ST 段壓低 1 mm。Troponin I 0.02 ng/mL（<0.04），6 小時後複驗 0.03 ng/mL。
+【病程紀錄】
+心導管檢查：LAD 近端狹窄 70%，LCX、RCA 無明顯狹窄，接受 PCI 置放藥物塗層支架一枚，術後無胸痛。
+心臟超音波：EF 60%，無區域性室壁運動異常。
+【出院摘要】
+診斷：冠狀動脈疾病（單一血管病變）s/p PCI；高血壓；第二型糖尿病。
+出院用藥：aspirin 100 mg QD、clopidogrel 75 mg QD、atorvastatin 40 mg QD、metformin 500 mg BID。"""
+
+SAMPLE_SUMMARY = "\n".join(f"{k + 1}. 第 {k + 1} 項建議：持續監測 indicator trend，必要時召開 QC meeting 檢討。" for k in range(20))
+
+# ============ 請求 ============
+def post(url, body, content_type, timeout=300):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+    return urllib.request.urlopen(request, timeout=timeout)
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    for name, (filename, data, mimetype) in files.items():
+        header = f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\nContent-Type: {mimetype}\r\n\r\n'
+        parts.append(header.encode('utf-8') + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+def case_payload(run_id, index):
+    return json.dumps({"case_text": f"病歷編號 {run_id}-{index}\n{SAMPLE_CASE}"}).encode('utf-8')
+
+def call_icd(base, run_id):
+    def call(index):
+        with post(f"{base}/generate_icd", case_payload(run_id, index), "application/json") as response:
+            return response.status == 200 and "answer" in json.loads(response.read()), None
+    return call
+
+def call_icd_stream(base, run_id):
+    def call(index):
+        started = time.perf_counter()
+        ttft = None
+        done = False
+        with post(f"{base}/generate_icd_stream", case_payload(run_id, index), "application/json") as response:
+            for line in response:
+                if ttft is None and line.startswith(b"event: token"):
+                    ttft = time.perf_counter() - started
+                elif line.startswith(b"event: done"):
+                    done = True
+                elif line.startswith(b"event: error"):
+                    return False, ttft
+        return done, ttft
+    return call
+
+def call_summary(base, documents, offset=0):
+    def call(index):
+        body, content_type = multipart(
+            {"template_type": "quality_control"},
+            {"file": (f"report_{index}.docx", documents[offset + index], "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+        )
+        with post(f"{base}/generate_summary", body, content_type) as response:
+            data = response.read()
+            return response.status == 200 and data[:2] == b"PK" and bool(response.headers.get("X-Summary-Text")), None
+    return call
+
+def call_postprocess(answer):
+    from common.utils import post_process_icd_with_cad
+    def call(index):
+        return bool(post_process_icd_with_cad(answer)), None
+    return call
+
+def call_word_insert(documents):
+    from common.word_insert import insert_summary_at_bookmark
+    def call(index):
+        output = io.BytesIO()
+        insert_summary_at_bookmark(io.BytesIO(documents[index]), SAMPLE_SUMMARY, BOOKMARK, output)
+        return output.tell() > 0, None
+    return call
+
+# 每個請求一份不同的 .docx（內容不同，上傳文字快取不會命中）；在計時之前先產生好
+def build_documents(count, pages):
+    from docx import Document
+    from bench_word_insert import build_template
+    
+    path = os.path.join(tempfile.mkdtemp(), "template.docx")
+    build_template(path, pages, "body")
+    documents = []
+    for index in range(count):
+        doc = Document(path)
+        doc.paragraphs[0].insert_paragraph_before(f"報告編號 {uuid.uuid4().hex[:8]}-{index}")
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        documents.append(buffer.getvalue())
+    os.remove(path)
+    return documents
+
+# ============ 量測 ============
+def upstream_stats(upstream):
+    try:
+        with urllib.request.urlopen(f"{upstream}/stats", timeout=5) as response:
+            return json.loads(response.read())
+    except Exception:
+        return {}
+
+def run_level(scenario, call, requests, concurrency, pid, upstream):
+    peak = {}
+    stop = threading.Event()
+    
+    def sample():
+        while not stop.is_set():
+            for key, value in proc_status(pid).items():
+                peak[key] = max(peak.get(key, 0), value)
+            time.sleep(0.05)
+            
+    def timed(index):
+        started = time.perf_counter()
+        try:
+            ok, ttft = call(index)
+        except Exception:
+            ok, ttft = False, None
+        return ok, time.perf_counter() - started, ttft
+        
+    before = upstream_stats(upstream) if upstream else {}
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(requests)))
+    wall = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+    after = upstream_stats(upstream) if upstream else {}
+    
+    latencies = [seconds for ok, seconds, _ in results if ok]
+    ttfts = [ttft for ok, _, ttft in results if ok and ttft is not None]
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "errors": len(results) - len(latencies),
+        "rps": round(len(latencies) / wall, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "ttft_p50_ms": round(percentile(ttfts, 50) * 1000, 3) if ttfts else "",
+        "peak_rss_mb": round(peak.get('VmRSS', 0) / 1024, 1),
+        "upstream_429": after.get("throttled", 0) - before.get("throttled", 0)
+    }
+
+COLUMNS = ["scenario", "concurrency", "ok", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "ttft_p50_ms", "peak_rss_mb", "upstream_429"]
+
+def print_rows(rows):
+    print("".join(f"{c:>14}" for c in COLUMNS))
+    for row in rows:
+        print("".join(f"{str(row[c]):>14}" for c in COLUMNS))
+
+# ============ 基準檔 ============
+def save_baseline(path, rows, args):
+    baseline = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": {"cpu_count": os.cpu_count(), "python": platform.python_version(), "platform": platform.platform()},
+        "options": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+        "results": rows
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+    print(f"基準已寫入 {path}")
+
+# 回傳退步的項目數；p95 變慢或吞吐量下降超過 tolerance、錯誤數增加都算
+def compare_baseline(path, rows, tolerance):
+    with open(path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    
+    print(f"\n與基準比較（{path}，{baseline.get('created_at', '')}，容許 {tolerance:.0%}）")
+    print("".join(f"{c:>14}" for c in ["scenario", "concurrency", "p95_ms", "base_p95", "rps", "base_rps", "verdict"]))
+    regressions = 0
+    for row in rows:
+        base = previous.get((row["scenario"], row["concurrency"]))
+        if base is None:
+            verdict = "new"
+        else:
+            slower = base["p95_ms"] and row["p95_ms"] > base["p95_ms"] * (1 + tolerance)
+            fewer = base["rps"] and row["rps"] < base["rps"] * (1 - tolerance)
+            failed = row["errors"] > base["errors"]
+            verdict = "REGRESSION" if (slower or fewer or failed) else "ok"
+            regressions += verdict == "REGRESSION"
+        values = [row["scenario"], row["concurrency"], row["p95_ms"], base["p95_ms"] if base else "-",
+                  row["rps"], base["rps"] if base else "-", verdict]
+        print("".join(f"{str(v):>14}" for v in values))
+    return regressions
+
+def start_upstream(args):
+    command = [sys.executable, "fake_azure.py", "--port", str(args.upstream_port), "--latency", args.latency,
+               "--token-delay", str(args.token_delay), "--throttle-rate", str(args.throttle_rate),
+               "--rpm", str(args.rpm), "--retry-after", str(args.retry_after)]
+    upstream = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_ready(f"http://127.0.0.1:{args.upstream_port}/stats")
+    return upstream
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', nargs='+', default=list(HTTP_SCENARIOS + LOCAL_SCENARIOS),
+                        choices=HTTP_SCENARIOS + LOCAL_SCENARIOS)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=100, help="每個並行數送出的請求數")
+    parser.add_argument('--mode', default='gevent', help="伺服器啟動方式：threaded / gevent / gunicorn-gthread / gunicorn-gevent")
+    parser.add_argument('--pages', type=int, default=5, help="測試 .docx 的頁數")
+    parser.add_argument('--latency', default='lognormal:1,0.4', help="假上游延遲分布（見 fake_azure.py）")
+    parser.add_argument('--token-delay', type=float, default=0.01)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--rpm', type=int, default=0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--port', type=int, default=5201)
+    parser.add_argument('--upstream-port', type=int, default=5299)
+    parser.add_argument('--save', help="把結果寫成基準檔")
+    parser.add_argument('--compare', help="與基準檔比較")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    
+    http = [s for s in args.scenarios if s in HTTP_SCENARIOS]
+    local = [s for s in args.scenarios if s in LOCAL_SCENARIOS]
+    # summary 每個並行數都用沒上傳過的檔案（伺服器的文字快取以內容 hash 為 key）
+    documents = build_documents(args.requests * len(args.concurrency), args.pages) if {"summary", "word_insert"} & set(args.scenarios) else []
+    rows = []
+    
+    if http:
+        upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+        upstream = start_upstream(args)
+        server = subprocess.Popen([sys.executable, '-c', SERVER, args.mode, str(args.port), upstream_url],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base = f"http://127.0.0.1:{args.port}"
+            wait_ready(f"{base}/icd_cache_stats")
+            for scenario in http:
+                for level, concurrency in enumerate(args.concurrency):
+                    run_id = f"{scenario}-{concurrency}-{time.time()}"
+                    if scenario == "icd":
+                        call = call_icd(base, run_id)
+                    elif scenario == "icd_stream":
+                        call = call_icd_stream(base, run_id)
+                    else:
+                        call = call_summary(base, documents, level * args.requests)
+                    rows.append(run_level(scenario, call, args.requests, concurrency, server.pid, upstream_url))
+        finally:
+            server.terminate()
+            server.wait()
+            upstream.terminate()
+            upstream.wait()
+            
+    if local:
+        from common import icd_db
+        from fake_azure import ICD_ANSWER
+        icd_db.load_icd_db()
+        for scenario in local:
+            call = call_postprocess(ICD_ANSWER) if scenario == "postprocess" else call_word_insert(documents)
+            call(0)  # 暖機（代碼快取、lxml）
+            for concurrency in args.concurrency:
+                rows.append(run_level(scenario, call, args.requests, concurrency, os.getpid(), None))
+                
+    print_rows(rows)
+    if args.save:
+        save_baseline(args.save, rows, args)
+    if args.compare:
+        sys.exit(1 if compare_baseline(args.compare, rows, args.tolerance) else 0)
@@ -0,0 +1,72 @@
+# bench_pdf_ingest.py
+# PDF 擷取吞吐量（頁/秒）：舊版單行程逐頁字串相加 vs 新版依頁切段交給行程池
+#   - 產生 --pages 頁的測試 PDF（每頁滿版病程紀錄文字，接近 OCR 後的病歷 / QC 報告）
+#   - 新版依序以 --workers 指定的行程數量測；行程池先暖機，不計入建立時間
+# 用法（專案根目錄）：python bench_pdf_ingest.py [--pages 400] [--workers 1 2 4 8] [--repeat 3]
+import argparse
+import os
+import time
+
+import fitz
+
+from config import Config
+from common import pdf_ingest
+
+# ===== 舊版實作（僅供比較） =====
+def legacy_read_pdf_file(file_path):
+    doc = fitz.open(file_path)
+    text = ""
+    for page in doc:
+        text += page.get_text("text").strip() + "\n"
+    doc.close()
+    return text
+
+def build_pdf(path, pages):
+    doc = fitz.open()
+    for page_no in range(pages):
+        page = doc.new_page()
+        lines = [f"Page {page_no + 1} progress note {k}: BP 132/84, HR 78, chest pain improved, LAD stenosis 70% s/p PCI, continue DAPT."
+                 for k in range(60)]
+        page.insert_text((36, 40), "\n".join(lines), fontsize=7)
+    doc.save(path)
+    doc.close()
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=400)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    path = os.path.abspath(f"bench_pdf_{args.pages}.pdf")
+    build_pdf(path, args.pages)
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        legacy_s, legacy_text = best_of(lambda: legacy_read_pdf_file(path), args.repeat)
+        print(f"CPU 核心數：{os.cpu_count()}，PDF {args.pages} 頁，{len(data) / 1024 / 1024:.1f} MB")
+        print(f"{'mode':>16}{'seconds':>12}{'pages/s':>12}{'same_text':>12}")
+        print(f"{'legacy':>16}{legacy_s:>12.3f}{args.pages / legacy_s:>12.1f}{'-':>12}")
+        
+        for workers in sorted(set(args.workers)):
+            Config.PDF_MAX_WORKERS = workers
+            Config.PDF_PARALLEL_MIN_PAGES = 1 if workers > 1 else args.pages + 1
+            pdf_ingest._reset_pool()
+            pdf_ingest.read_pdf(data)  # 暖機：建立行程池
+            seconds, text = best_of(lambda: pdf_ingest.read_pdf(data), args.repeat)
+            print(f"{f'pool x{workers}':>16}{seconds:>12.3f}{args.pages / seconds:>12.1f}{str(text == legacy_text):>12}")
+            
+        Config.PDF_MAX_WORKERS = max(args.workers)
+        seconds, text = best_of(lambda: pdf_ingest.read_pdf(data, "1-10"), args.repeat)
+        print(f"{'pages 1-10':>16}{seconds:>12.3f}{10 / seconds:>12.1f}{'-':>12}")
+    finally:
+        os.remove(path)
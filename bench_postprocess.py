@@ -0,0 +1,132 @@
+# bench_postprocess.py
+# ICD 後處理微基準：舊版逐行 re.sub（未預編譯、每次重新組字串） vs 新版整段一次掃描 + 代碼快取
+# 用法（專案根目錄）：python bench_postprocess.py [--outputs 1000]
+import argparse
+import random
+import re
+import time
+
+from common import icd_db
+from common.utils import post_process_icd_with_cad, IcdPostProcessor, CAD_SECTION_SEPARATOR
+
+# ===== 舊版實作（僅供比較） =====
+def legacy_replace_icd_codes_in_line(line):
+    def replace_match(match):
+        raw_code = match.group(1).upper()
+        code_nodot = raw_code.replace('.', '')
+        
+        entry = icd_db.get_icd_dict().get(code_nodot, {})
+        english = entry.get('english', '').strip()
+        chinese = entry.get('chinese', '').strip()
+        
+        display_code = code_nodot[:3] + '.' + code_nodot[3:] if len(code_nodot) > 3 else code_nodot
+        
+        if english and english != 'nan':
+            display_text = f"{display_code} - {english}"
+        else:
+            display_text = f"{display_code}"
+        
+        if chinese and chinese != 'nan':
+            display_text += f" ({chinese})"
+        
+        return display_text
+    
+    return re.sub(r"([A-Z]\d{1,6}(?:\.\d{1,3})?)", replace_match, line, flags=re.IGNORECASE)
+
+def legacy_post_process_icd_with_cad(text):
+    lines = text.strip().split('\n')
+    result = []
+    in_cad_section = False
+    
+    for line in lines:
+        original_line = line.strip()
+        if not original_line:
+            result.append("")
+            continue
+        
+        if "【CAD 判斷結果】" in original_line:
+            in_cad_section = True
+            result.append(CAD_SECTION_SEPARATOR)
+            result.append("【CAD 判斷結果】")
+            result.append(CAD_SECTION_SEPARATOR)
+            result.append(original_line.replace("【CAD 判斷結果】", "").strip())
+            continue
+        
+        if in_cad_section:
+            result.append(legacy_replace_icd_codes_in_line(original_line))
+        elif "【一般 ICD 推薦】" in original_line:
+            result.append("")
+            result.append(CAD_SECTION_SEPARATOR)
+            result.append("一般 ICD-10 診斷推薦（含中英文名稱）")
+            result.append(CAD_SECTION_SEPARATOR)
+        else:
+            result.append(legacy_replace_icd_codes_in_line(original_line))
+    
+    return "\n".join(result)
+
+# ===== 模擬 LLM 輸出 =====
+NOISE = ["V1-V3 導程 ST 上升", "B12 正常", "HbA1c 7.2%", "LDL 130 mg/dL", "EF 35%", "Troponin I 2.3 ng/mL", "S3 gallop"]
+
+def make_output(codes, rng):
+    picked = rng.sample(codes, min(10, len(codes)))
+    lines = [
+        "【CAD 判斷結果】",
+        "是否主診為 CAD：是",
+        "是否併發症：是",
+        "預估 DRG：124",
+        "預估 RW：1.0448",
+        "關鍵證據：",
+        f"1. {rng.choice(NOISE)}",
+        f"2. {rng.choice(NOISE)}，使用 IV furosemide",
+        "",
+        "【一般 ICD 推薦】",
+    ]
+    for i, code in enumerate(picked, start=1):
+        display = code[:3] + '.' + code[3:] if len(code) > 3 else code
+        lines.append(f"{i}. {display} - placeholder")
+        lines.append(f"   原因：{rng.choice(NOISE)}")
+    return "\n".join(lines)
+
+def bench(label, fn, outputs, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in outputs:
+            fn(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    per_output_us = best / len(outputs) * 1e6
+    print(f"{label:<28}{best * 1000:>10.1f} ms{per_output_us:>12.1f} us/筆")
+    return best
+
+def streamed(text):
+    processor = IcdPostProcessor()
+    lines = []
+    for i in range(0, len(text), 7):   # 模擬串流 token
+        lines.extend(processor.feed(text[i:i + 7]))
+    lines.extend(processor.flush())
+    return "\n".join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--outputs', type=int, default=1000)
+    args = parser.parse_args()
+    
+    icd = icd_db.get_icd_dict()
+    rng = random.Random(0)
+    codes = [code for i, code in enumerate(icd.keys()) if i % 7 == 0]
+    outputs = [make_output(codes, rng) for _ in range(args.outputs)]
+    
+    print(f"{len(outputs)} 筆模擬輸出，平均 {sum(map(len, outputs)) // len(outputs)} 字元")
+    post_process_icd_with_cad(outputs[0])  # 預熱
+    
+    legacy = bench("舊版（逐行 re.sub）", legacy_post_process_icd_with_cad, outputs)
+    cold = bench("新版（整段掃描，快取冷）", post_process_icd_with_cad, outputs, repeat=1)
+    warm = bench("新版（快取熱）", post_process_icd_with_cad, outputs)
+    bench("新版串流（7 字元 token）", streamed, outputs)
+    print(f"加速：{legacy / warm:.1f}x（快取熱），{legacy / cold:.1f}x（快取冷）")
+    
+    # 誤判檢查：舊版會把雜訊字當成 ICD 碼
+    sample = "檢體編號 XI1099，批號 A12345，V1-V3 導程 ST 上升"
+    print("舊版：", legacy_replace_icd_codes_in_line(sample))
+    print("新版：", post_process_icd_with_cad(sample))
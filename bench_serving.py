@@ -0,0 +1,189 @@
+# bench_serving.py
+# 壓力測試：比較各種啟動方式同時處理 LLM 請求的能力
+#   threaded          開發用執行緒伺服器（app.run，每個請求一條執行緒）
+#   gevent            serve.py（gevent 協程）
+#   gunicorn-gthread  gunicorn 1 worker x 8 執行緒（常見的執行緒池設定）
+#   gunicorn-gevent   gunicorn 1 worker，gevent（gunicorn.conf.py 預設）
+#   - 另起一個假的 Azure 上游（fake_azure.py），每個請求固定延遲 --delay 秒（模擬 LLM 回應時間）
+#   - 同時送出 --concurrency 個 /generate_icd（病例文字各不相同，避免命中快取）
+#   - 量測：完成數、錯誤數、總時間、延遲 p50 / p95、實際並行數、伺服器峰值 RSS 與執行緒數
+# 用法（專案根目錄）：python bench_serving.py [--concurrency 50 200] [--delay 2] [--modes threaded gevent gunicorn-gthread gunicorn-gevent]
+# 限流（AZURE_RPM_LIMIT / AZURE_TPM_LIMIT）在測試中關閉，只量測伺服器本身
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# 伺服器子行程：把 Azure 設定指向假上游後啟動
+SERVER = r'''
+import sys
+mode, port, upstream = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+if mode in ("gevent", "gunicorn-gevent"):
+    from gevent import monkey
+    monkey.patch_all()
+from config import Config
+Config.AZURE_ENDPOINT = upstream
+Config.AZURE_API_KEY = "bench"
+Config.API_VERSION = Config.API_VERSION or "2024-06-01"
+Config.AZURE_RPM_LIMIT = 0
+Config.AZURE_TPM_LIMIT = 0
+Config.LLM_CACHE_ENABLED = False
+from app import create_app
+app = create_app()
+if mode == "gevent":
+    import serve
+    serve.serve(app, "127.0.0.1", port)
+elif mode.startswith("gunicorn"):
+    from gunicorn.app.base import BaseApplication
+    class BenchApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"127.0.0.1:{port}")
+            self.cfg.set("workers", 1)
+            self.cfg.set("worker_class", mode.split("-", 1)[1])
+            self.cfg.set("threads", 8)
+            self.cfg.set("worker_connections", 1000)
+            self.cfg.set("timeout", 300)
+        def load(self):
+            return app
+    BenchApplication().run()
+else:
+    app.run(host="127.0.0.1", port=port, threaded=True)
+'''
+
+# 行程及其子行程（gunicorn worker）的 RSS / 執行緒數加總（Linux）
+def _children(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+def proc_status(pid):
+    result = {}
+    for p in [pid] + _children(pid):
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in ('VmRSS', 'Threads'):
+                        result[key] = result.get(key, 0) + int(value.split()[0])
+        except OSError:
+            pass
+    return result
+
+def wait_ready(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError(f"伺服器沒有啟動：{url}")
+
+def post_case(url, index, run_id):
+    payload = json.dumps({"case_text": f"[{run_id}-{index}] 65 歲男性，運動時胸悶，心導管顯示 LAD 狹窄 70%，診斷 CAD。"}).encode()
+    request = urllib.request.Request(url, data=payload, headers={"Content-Type": "application/json"})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            ok = response.status == 200 and "answer" in json.loads(response.read())
+    except Exception:
+        ok = False
+    return ok, time.perf_counter() - started
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def run_mode(mode, concurrency_levels, delay, port, upstream):
+    server = subprocess.Popen(
+        [sys.executable, '-c', SERVER, mode, str(port), upstream],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    rows = []
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/icd_cache_stats")
+        base = proc_status(server.pid)
+        for concurrency in concurrency_levels:
+            peak = dict(base)
+            stop = threading.Event()
+            
+            def sample():
+                while not stop.is_set():
+                    status = proc_status(server.pid)
+                    for key, value in status.items():
+                        peak[key] = max(peak.get(key, 0), value)
+                    time.sleep(0.05)
+                    
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+            
+            url = f"http://127.0.0.1:{port}/generate_icd"
+            run_id = f"{mode}-{concurrency}-{time.time()}"
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(lambda i: post_case(url, i, run_id), range(concurrency)))
+            wall = time.perf_counter() - started
+            stop.set()
+            sampler.join()
+            
+            latencies = [seconds for ok, seconds in results if ok]
+            rows.append({
+                "mode": mode,
+                "concurrency": concurrency,
+                "ok": len(latencies),
+                "errors": len(results) - len(latencies),
+                "wall_s": round(wall, 2),
+                "p50_s": round(percentile(latencies, 50), 2),
+                "p95_s": round(percentile(latencies, 95), 2),
+                # 每個請求至少要等 delay 秒；完成數 * delay / 總時間 ≈ 實際同時在等上游的請求數
+                "effective_parallel": round(len(latencies) * delay / wall, 1),
+                "peak_rss_mb": round(peak.get('VmRSS', 0) / 1024, 1),
+                "peak_threads": peak.get('Threads', 0)
+            })
+    finally:
+        server.terminate()
+        server.wait()
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--delay', type=float, default=2.0, help="假上游每個請求的延遲秒數")
+    parser.add_argument('--modes', nargs='+', default=['threaded', 'gevent'])
+    parser.add_argument('--port', type=int, default=5101)
+    parser.add_argument('--upstream-port', type=int, default=5199)
+    args = parser.parse_args()
+    
+    upstream = subprocess.Popen(
+        [sys.executable, 'fake_azure.py', '--port', str(args.upstream_port), '--latency', f'const:{args.delay}'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_ready(f"http://127.0.0.1:{args.upstream_port}/stats")
+        rows = []
+        for k, mode in enumerate(args.modes):
+            # 每種方式用不同 port，避免前一個伺服器還沒完全釋放
+            rows.extend(run_mode(mode, args.concurrency, args.delay, args.port + k, f"http://127.0.0.1:{args.upstream_port}"))
+    finally:
+        upstream.terminate()
+        
+    columns = ["mode", "concurrency", "ok", "errors", "wall_s", "p50_s", "p95_s", "effective_parallel", "peak_rss_mb", "peak_threads"]
+    print("".join(f"{c:>19}" for c in columns))
+    for row in rows:
+        print("".join(f"{row[c]:>19}" for c in columns))
\ No newline at end of file
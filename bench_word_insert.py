@@ -0,0 +1,149 @@
+# bench_word_insert.py
+# Word 書籤插入基準：舊版逐段 paragraph._element.xml 字串比對 + 逐 run 設字體 vs 新版 XPath 找書籤 + 共用樣式
+#   - 產生 --pages 頁左右的 QC 報告範本（段落 + 每頁一個小表格），書籤放在最後一頁 / 表格內 / 頁首
+#   - 分別量測：找書籤時間、整體插入時間（含開檔存檔）、插入位置是否正確
+# 用法（專案根目錄）：python bench_word_insert.py [--pages 300] [--summary-lines 40] [--repeat 3]
+import argparse
+import os
+import tempfile
+import time
+
+from docx import Document
+from docx.shared import Pt
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+from common.word_insert import insert_summary_at_bookmark, find_bookmark_paragraph, SUMMARY_TITLE
+
+BOOKMARK = "AI_SUMMARY_HERE"
+
+# ===== 舊版實作（僅供比較） =====
+def legacy_find(doc, bookmark_name):
+    for paragraph in doc.paragraphs:
+        if bookmark_name in paragraph._element.xml:
+            return paragraph
+    return None
+
+def _legacy_fonts(run):
+    if any('\u4e00' <= char <= '\u9fff' for char in run.text):
+        run.font.name = '標楷體'
+        run._element.rPr.rFonts.set(qn('w:eastAsia'), '標楷體')
+        run._element.rPr.rFonts.set(qn('w:ascii'), 'Times New Roman')
+        run._element.rPr.rFonts.set(qn('w:hAnsi'), 'Times New Roman')
+    else:
+        run.font.name = 'Times New Roman'
+        run._element.rPr.rFonts.set(qn('w:ascii'), 'Times New Roman')
+        run._element.rPr.rFonts.set(qn('w:hAnsi'), 'Times New Roman')
+        run._element.rPr.rFonts.set(qn('w:eastAsia'), '標楷體')
+
+def legacy_insert(word_path, summary_text, bookmark_name, output_path):
+    doc = Document(word_path)
+    paragraph = legacy_find(doc, bookmark_name)
+    insert = paragraph.insert_paragraph_before if paragraph is not None else doc.add_paragraph
+    if paragraph is not None:
+        paragraph.clear()
+    else:
+        doc.add_page_break()
+        
+    title_p = insert(SUMMARY_TITLE)
+    title_p.paragraph_format.line_spacing = 1.5
+    title_run = title_p.runs[0]
+    title_run.bold = True
+    title_run.font.size = Pt(16)
+    title_run.font.name = '標楷體'
+    title_run._element.rPr.rFonts.set(qn('w:ascii'), '標楷體')
+    title_run._element.rPr.rFonts.set(qn('w:hAnsi'), '標楷體')
+    title_run._element.rPr.rFonts.set(qn('w:eastAsia'), '標楷體')
+    for line in summary_text.split('\n'):
+        if line.strip():
+            p = insert(line.strip())
+            p.paragraph_format.line_spacing = 1.5
+            p.paragraph_format.space_after = Pt(6)
+            for run in p.runs:
+                run.font.size = Pt(12)
+                _legacy_fonts(run)
+    doc.save(output_path)
+    return paragraph is not None
+
+# ===== 測試範本 =====
+def _bookmark(paragraph, name):
+    start = OxmlElement('w:bookmarkStart')
+    start.set(qn('w:id'), '0')
+    start.set(qn('w:name'), name)
+    end = OxmlElement('w:bookmarkEnd')
+    end.set(qn('w:id'), '0')
+    paragraph._p.insert(0, start)
+    paragraph._p.append(end)
+
+def build_template(path, pages, where):
+    doc = Document()
+    for page in range(pages):
+        doc.add_heading(f"{page + 1}. 品質指標 QI-{page:03d}", level=2)
+        for k in range(25):
+            doc.add_paragraph(f"本月 {page}-{k} 指標值 95.{k}%，較上月上升 0.{k}%；Indicator {page}-{k} within target range, reviewed by QC team.")
+        table = doc.add_table(rows=3, cols=4)
+        for r, row in enumerate(table.rows):
+            for c, cell in enumerate(row.cells):
+                cell.text = f"R{r}C{c} {page}"
+        doc.add_page_break()
+        
+    if where == "body":
+        p = doc.add_paragraph("總結：")
+        _bookmark(p, BOOKMARK)
+    elif where == "table":
+        cell = doc.tables[-1].cell(2, 3)
+        _bookmark(cell.paragraphs[0], BOOKMARK)
+    elif where == "header":
+        _bookmark(doc.sections[0].header.paragraphs[0], BOOKMARK)
+    doc.save(path)
+
+def located_in(path, where):
+    doc = Document(path)
+    if where == "header":
+        container = doc.sections[0].header._element
+    elif where == "table":
+        container = doc.tables[-1]._tbl
+    else:
+        container = doc.element.body
+    if SUMMARY_TITLE not in container.xpath('.//w:t/text()'):
+        return False
+    # 插在書籤段落之前：最後一段是清空的書籤段落；附加在文件最後則是摘要最後一行
+    return where != "body" or not container.xpath('string(./w:p[last()])')
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--summary-lines', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    summary = "\n".join(f"{k + 1}. 第 {k + 1} 項建議：持續監測 indicator trend，必要時召開 QC meeting 檢討。" for k in range(args.summary_lines))
+    workdir = tempfile.mkdtemp()
+    columns = ["bookmark", "paragraphs", "legacy_find_ms", "xpath_find_ms", "legacy_total_s", "new_total_s", "legacy_ok", "new_ok"]
+    print("".join(f"{c:>16}" for c in columns))
+    for where in ("body", "table", "header"):
+        template = os.path.join(workdir, f"template_{where}.docx")
+        build_template(template, args.pages, where)
+        doc = Document(template)
+        n_paragraphs = len(doc.element.body.xpath('.//w:p'))
+        
+        legacy_find_s, _ = best_of(lambda: legacy_find(doc, BOOKMARK), args.repeat)
+        xpath_find_s, _ = best_of(lambda: find_bookmark_paragraph(doc, BOOKMARK), args.repeat)
+        
+        legacy_out = os.path.join(workdir, f"legacy_{where}.docx")
+        new_out = os.path.join(workdir, f"new_{where}.docx")
+        legacy_total_s, _ = best_of(lambda: legacy_insert(template, summary, BOOKMARK, legacy_out), args.repeat)
+        new_total_s, _ = best_of(lambda: insert_summary_at_bookmark(template, summary, BOOKMARK, new_out), args.repeat)
+        
+        row = [where, n_paragraphs, round(legacy_find_s * 1000, 1), round(xpath_find_s * 1000, 1),
+               round(legacy_total_s, 2), round(new_total_s, 2), located_in(legacy_out, where), located_in(new_out, where)]
+        print("".join(f"{str(v):>16}" for v in row))
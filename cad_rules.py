@@ -1,29 +1,120 @@
 # common/cad_rules.py
-import pandas as pd
-import re
+import csv
 import os
+import threading
 from config import Config
 
 CAD_MAIN_CODES = set()
 CAD_UNSTABLE_CODES = set()
 COMPLEX_SECONDARY_CODES = set()
+CAD_RULES = []      # [{'category', 'condition', 'codes', 'drg', 'rw'}]
+
+_loaded = False
+_load_lock = threading.Lock()
+
+def normalize_code(code):
+    return str(code).strip().upper().replace('.', '')
+
+# 規則引擎：把 CSV 規則編譯成「代碼 → 規則」查表，萬用字元（I50.* / I50*）改成前綴比對
+# 判斷方式：第一個代碼為主診斷，需命中 main 規則才算 CAD；其餘代碼命中 complex 規則即為併發症
+# DRG / RW 取命中規則中 RW 最高者（例：穩定型 CAD 125 + 心衰 complex 124 → 124）
+class CadRuleEngine:
+    def __init__(self, rules):
+        self.exact = {'main': {}, 'complex': {}}
+        self.prefixes = {'main': [], 'complex': []}
+        self.drgs = set()   # 規則涵蓋的 DRG（目前為 124 / 125）
+        for rule in rules:
+            if rule['category'] not in self.exact:
+                continue
+            if rule['drg']:
+                self.drgs.add(rule['drg'])
+            for code in rule['codes']:
+                code = normalize_code(code)
+                if code.endswith('*'):
+                    self.prefixes[rule['category']].append((code.rstrip('*'), rule))
+                else:
+                    self.exact[rule['category']][code] = rule
+        # 較長的前綴優先（較精確）
+        for category in self.prefixes:
+            self.prefixes[category].sort(key=lambda x: -len(x[0]))
+    
+    def match(self, category, code):
+        code = normalize_code(code)
+        rule = self.exact[category].get(code)
+        if rule is not None:
+            return rule
+        for prefix, rule in self.prefixes[category]:
+            if code.startswith(prefix):
+                return rule
+        return None
+    
+    def evaluate(self, codes):
+        codes = [c for c in codes if str(c).strip()]
+        main_rule = self.match('main', codes[0]) if codes else None
+        
+        if main_rule is None:
+            return {
+                "cad": False,
+                "complex": False,
+                "drg": "",
+                "rw": "",
+                "main_rule": "",
+                "complex_rules": [],
+                "matched_codes": []
+            }
+        
+        complex_hits = []
+        for code in codes[1:]:
+            rule = self.match('complex', code)
+            if rule is not None:
+                complex_hits.append((code, rule))
+        
+        def rw_value(rule):
+            try:
+                return float(rule['rw'])
+            except ValueError:
+                return 0.0
+        
+        best = max([main_rule] + [rule for _, rule in complex_hits], key=rw_value)
+        
+        return {
+            "cad": True,
+            "complex": bool(complex_hits),
+            "drg": best['drg'],
+            "rw": best['rw'],
+            "main_rule": main_rule['condition'],
+            "complex_rules": sorted({rule['condition'] for _, rule in complex_hits}),
+            "matched_codes": [codes[0]] + [code for code, _ in complex_hits]
+        }
+
+engine = CadRuleEngine([])
 
 def load_cad_rules():
-    global CAD_MAIN_CODES, CAD_UNSTABLE_CODES, COMPLEX_SECONDARY_CODES
+    global _loaded
     if not os.path.exists(Config.CAD_RULE_PATH):
         raise FileNotFoundError(f"找不到 CAD_rule.csv：{Config.CAD_RULE_PATH}")
     
-    df = pd.read_csv(Config.CAD_RULE_PATH, encoding='utf-8')
-    print("實際欄位名稱：", list(df.columns))
+    # 檔案很小，用標準函式庫 csv 讀即可，不必為此載入 pandas
+    with open(Config.CAD_RULE_PATH, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        rows = list(reader)
+    print("實際欄位名稱：", header)
+    
+    CAD_MAIN_CODES.clear()
+    CAD_UNSTABLE_CODES.clear()
+    COMPLEX_SECONDARY_CODES.clear()
+    rules = []
     
-    for _, row in df.iterrows():
-        # 動態取欄位
-        cols = df.columns
-        category = str(row[cols[0]]).strip().lower()
-        condition = str(row[cols[1]]).strip().lower()
-        codes_str = str(row[cols[2]]).strip()
+    for row in rows:
+        # 動態取欄位（前三欄：category, condition, codes；第四、五欄：drg, rw）
+        if len(row) < 3:
+            continue
+        category = row[0].strip().lower()
+        condition = row[1].strip().lower()
+        codes_str = row[2].strip()
         
-        if codes_str == 'nan' or not codes_str:
+        if not codes_str:
             continue
         
         codes = [code.strip() for code in codes_str.split(',') if code.strip()]
@@ -34,9 +125,63 @@ def load_cad_rules():
                 CAD_UNSTABLE_CODES.update(codes)
         elif category == 'complex':
             COMPLEX_SECONDARY_CODES.update(codes)
+        
+        rules.append({
+            'category': category,
+            'condition': condition,
+            'codes': codes,
+            'drg': row[3].strip() if len(row) > 3 else '',
+            'rw': row[4].strip() if len(row) > 4 else ''
+        })
+    
+    global engine
+    CAD_RULES[:] = rules
+    engine = CadRuleEngine(rules)
     
+    _loaded = True
     print("CAD 主診斷碼（所有）：", sorted(CAD_MAIN_CODES))
     print("CAD 不穩定型碼：", sorted(CAD_UNSTABLE_CODES))
     print("複雜次診斷碼：", sorted(COMPLEX_SECONDARY_CODES))
 
-load_cad_rules()
\ No newline at end of file
+# 尚未載入時才載入（app 啟動時沒有預先載入的情況）
+def ensure_cad_rules():
+    if not _loaded:
+        with _load_lock:
+            if not _loaded:
+                load_cad_rules()
+
+# 以規則計算 DRG / RW（codes 第一個為主診斷）
+def evaluate_drg(codes):
+    ensure_cad_rules()
+    return engine.evaluate(codes)
+
+# 以規則核對 LLM 判斷（parsed 為 utils.parse_icd_result 的結果，推薦碼第一個視為主診斷）
+# consistent：True 一致、False 不一致、None 不適用（主診斷與模型的 DRG 都不在規則範圍內）
+def check_icd_result(parsed):
+    result = evaluate_drg(parsed.get("codes", []))
+    
+    if result["cad"]:
+        try:
+            rw_match = float(parsed.get("rw") or "nan") == float(result["rw"])
+        except ValueError:
+            rw_match = False
+        consistent = parsed.get("drg") == result["drg"] and rw_match
+    elif parsed.get("drg") in engine.drgs:
+        # 主診斷不是 CAD，模型卻給了規則內的 DRG
+        consistent = False
+    else:
+        # 主診斷與模型的 DRG 都不在 CAD_rule.csv 範圍內（例：急性心肌梗塞 I21 → DRG 121–123）：不適用
+        consistent = None
+    
+    result["llm_drg"] = parsed.get("drg", "")
+    result["llm_rw"] = parsed.get("rw", "")
+    result["consistent"] = consistent
+    return result
+
+# 不一致或模型沒給 DRG 時附加在回答後面的說明；不適用（consistent 為 None）時不附註
+def rule_check_note(check):
+    if check["consistent"] is not False:
+        return ""
+    if check["cad"]:
+        return f"【規則檢核】依 CAD_rule.csv：DRG {check['drg']}，RW {check['rw']}（模型判斷：DRG {check['llm_drg'] or '未提供'}，RW {check['llm_rw'] or '未提供'}）"
+    return f"【規則檢核】依 CAD_rule.csv：第一個推薦碼不是 CAD 主診斷碼，不適用 DRG {check['llm_drg']}"
\ No newline at end of file
@@ -0,0 +1,112 @@
+# common/chunking.py
+# 長病歷 / 長報告的 map-reduce：
+#   1. 依段落標題、日期、紀錄類別切成段落，再把段落裝箱成 <= chunk_chars 的區塊
+#   2. 各區塊平行呼叫 LLM 擷取重點（map），總時間約等於最慢的那一塊
+#   3. 呼叫端把精簡後的重點合併，再做原本的分析 / 摘要（reduce）
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import Config
+
+# 新段落的開頭：Markdown 標題、【標題】、日期、常見紀錄類別、短的「標題：」行
+SECTION_HEADING_RE = re.compile(r"""^\s*(?:
+    \#{1,6}\s+\S
+  | 【[^】\n]{1,30}】
+  | \d{4}[/.-]\d{1,2}[/.-]\d{1,2}
+  | \d{2,3}\s*[年/.]\s*\d{1,2}\s*[月/.]\s*\d{1,2}
+  | (?:admission|progress|discharge|operation|op|consultation|consult|nursing|procedure|pathology|imaging)\s+(?:note|summary|record|report)s?\b
+  | (?:入院|出院|病程|護理|手術|會診|檢查|檢驗|影像|病理)(?:紀錄|記錄|摘要|報告)
+  | [A-Za-z\u4e00-\u9fff][^:：\n]{0,30}[:：]\s*$
+)""", re.IGNORECASE | re.VERBOSE)
+
+# 段落太長時依序改用較細的切點
+SPLIT_SEPARATORS = ["\n\n", "\n", "。", ". "]
+
+# 依標題切段落（保留原本換行）
+def split_sections(text):
+    sections = []
+    current = []
+    for line in text.splitlines(keepends=True):
+        if current and SECTION_HEADING_RE.match(line):
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+def _pack(units, max_chars):
+    chunks = []
+    current = ""
+    for unit in units:
+        if current and len(current) + len(unit) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += unit
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _split_oversized(text, max_chars, level=0):
+    if len(text) <= max_chars:
+        return [text]
+    if level >= len(SPLIT_SEPARATORS):
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+        
+    sep = SPLIT_SEPARATORS[level]
+    parts = text.split(sep)
+    if len(parts) == 1:
+        return _split_oversized(text, max_chars, level + 1)
+        
+    units = []
+    for k, part in enumerate(parts):
+        piece = part + sep if k < len(parts) - 1 else part
+        units.extend(_split_oversized(piece, max_chars, level + 1))
+    return _pack(units, max_chars)
+
+# 切成 <= max_chars 的區塊；段落盡量不拆開
+def chunk_text(text, max_chars=None):
+    max_chars = max_chars or Config.LONG_TEXT_CHUNK_CHARS
+    units = []
+    for section in split_sections(text):
+        units.extend(_split_oversized(section, max_chars))
+    return [chunk.strip() for chunk in _pack(units, max_chars) if chunk.strip()]
+
+def needs_chunking(text):
+    return Config.LONG_TEXT_CHUNKING and len(text) > Config.LONG_TEXT_THRESHOLD
+
+# 平行執行 fn(chunk, index, total)，依完成順序回傳 (index, result)；任一塊失敗就拋出例外
+# 每塊在呼叫端 contextvars 的複本中執行（監控指標的 route / template 標籤跟著帶過去）
+def iter_map(fn, chunks, max_workers=None):
+    total = len(chunks)
+    if total == 1:
+        yield 0, fn(chunks[0], 0, total)
+        return
+        
+    workers = min(max_workers or Config.LONG_TEXT_MAX_FANOUT, total)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(contextvars.copy_context().run, fn, chunk, index, total): index
+            for index, chunk in enumerate(chunks)
+        }
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+# 同 iter_map，但依原本順序回傳結果列表
+def map_chunks(fn, chunks, max_workers=None):
+    results = [None] * len(chunks)
+    for index, result in iter_map(fn, chunks, max_workers):
+        results[index] = result
+    return results
+
+# 把各段重點合併成 reduce 階段的輸入
+def join_chunk_notes(notes, label="第 {index}/{total} 段重點"):
+    total = len(notes)
+    return "\n\n".join(
+        f"【{label.format(index=index + 1, total=total)}】\n{note.strip()}"
+        for index, note in enumerate(notes)
+    )
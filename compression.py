@@ -0,0 +1,130 @@
+# common/compression.py
+# 回應壓縮與壓縮過的請求內容（院內 WAN 頻寬有限，JSON 與病歷文字壓縮後通常剩 1/4 以下）
+#   - JSON / HTML / 文字回應依 Accept-Encoding 用 br（有安裝 brotli 時）或 gzip；小於 COMPRESS_MIN_BYTES 不壓
+#   - 串流回應（SSE 要逐筆送出）與 send_file 下載（docx / xlsx 本身就是 zip）不壓
+#   - 請求帶 Content-Encoding: gzip / deflate / br 時在 WSGI 層先解壓，Flask 讀到的就是原文；
+#     解壓後超過 COMPRESS_MAX_REQUEST_BYTES 回 413，不支援的編碼回 415
+import gzip
+import io
+import json
+import zlib
+from config import Config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain", "text/csv", "text/css", "application/javascript"}
+REQUEST_ENCODINGS = {"gzip", "x-gzip", "deflate"} | ({"br"} if brotli is not None else set())
+READ_BLOCK = 64 * 1024
+
+class RequestTooLarge(ValueError):
+    pass
+
+# 回應可用的編碼（依偏好順序）
+def response_encodings():
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=Config.COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=Config.COMPRESS_GZIP_LEVEL, mtime=0)
+
+# 解壓請求內容，輸出超過 limit 位元組即停止（避免壓縮炸彈）
+def decompress(data, encoding, limit):
+    if encoding == "br":
+        decompressor = brotli.Decompressor()
+        output = bytearray()
+        for i in range(0, len(data), READ_BLOCK):
+            output += decompressor.process(data[i:i + READ_BLOCK])
+            if len(output) > limit:
+                raise RequestTooLarge()
+        if not decompressor.is_finished():
+            raise ValueError("壓縮內容不完整")
+        return bytes(output)
+        
+    # gzip 與 zlib 格式的 deflate 都由標頭自動判斷
+    decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+    try:
+        output = decompressor.decompress(data, limit + 1)
+    except zlib.error as e:
+        raise ValueError(f"壓縮內容無法解開：{e}")
+    if len(output) > limit:
+        raise RequestTooLarge()
+    if not decompressor.eof:
+        raise ValueError("壓縮內容不完整")
+    return output
+
+def _read_body(environ, limit):
+    length = environ.get("CONTENT_LENGTH")
+    if length:
+        try:
+            length = int(length)
+        except ValueError:
+            raise ValueError("Content-Length 格式錯誤")
+        if length < 0:
+            raise ValueError("Content-Length 格式錯誤")
+        if length > limit:
+            raise RequestTooLarge()
+        return environ["wsgi.input"].read(length)
+    data = environ["wsgi.input"].read(limit + 1)
+    if len(data) > limit:
+        raise RequestTooLarge()
+    return data
+
+def _error(start_response, status, message):
+    body = json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+    start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+    return [body]
+
+# WSGI 中介層：解壓請求內容後改寫 wsgi.input / CONTENT_LENGTH，再交給 Flask
+class DecompressRequest:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        
+    def __call__(self, environ, start_response):
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        if not encoding or encoding == "identity" or not Config.COMPRESS_ENABLED:
+            return self.wsgi_app(environ, start_response)
+        if encoding not in REQUEST_ENCODINGS:
+            return _error(start_response, "415 UNSUPPORTED MEDIA TYPE", f"不支援的 Content-Encoding：{encoding}")
+            
+        limit = Config.COMPRESS_MAX_REQUEST_BYTES
+        try:
+            body = decompress(_read_body(environ, limit), encoding, limit)
+        except RequestTooLarge:
+            return _error(start_response, "413 REQUEST ENTITY TOO LARGE", "請求內容過大")
+        except ValueError as e:
+            return _error(start_response, "400 BAD REQUEST", str(e))
+            
+        environ["wsgi.input"] = io.BytesIO(body)
+        environ["CONTENT_LENGTH"] = str(len(body))
+        environ.pop("HTTP_CONTENT_ENCODING")
+        environ.pop("wsgi.input_terminated", None)
+        return self.wsgi_app(environ, start_response)
+
+# 請求解壓 + 回應壓縮（在 metrics.init_app 之後呼叫，請求處理時間才包含壓縮）
+def init_app(app):
+    from flask import request
+    
+    app.wsgi_app = DecompressRequest(app.wsgi_app)
+    
+    @app.after_request
+    def compress_response(response):
+        if (not Config.COMPRESS_ENABLED or response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+            
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(response_encodings())
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < Config.COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -10,6 +10,122 @@ class Config:
     API_VERSION = ""
     DEPLOYMENT = "gpt-4o"
     
+    # 多部署（可跨區域）：空的表示只用上面這一組；設定後依權重 / 負載分配，被限流或故障時自動改送其他部署
+    # 每筆：name、endpoint、api_key、api_version、deployment、weight，可選 rpm_limit / tpm_limit（預設用下面的值）
+    # 例：[{"name": "eastus", "endpoint": "https://xxx-eastus.openai.azure.com/", "api_key": "...",
+    #       "api_version": "2024-06-01", "deployment": "gpt-4o", "weight": 2}, {...}]
+    AZURE_DEPLOYMENTS = []
+    AZURE_FAILURE_THRESHOLD = 3          # 連續失敗幾次後暫停使用該部署
+    AZURE_FAILURE_COOLDOWN = 30          # 暫停秒數
+    
+    # Azure 呼叫層：連線池、逾時、重試、限流（RPM / TPM 依部署配額設定，0 表示不限制）
+    AZURE_TIMEOUT = 120                  # 秒；單次呼叫讀取逾時（串流為兩個 chunk 之間）
+    AZURE_CONNECT_TIMEOUT = 10
+    AZURE_MAX_RETRIES = 4                # 429 / 5xx / 逾時 的重試次數
+    AZURE_BACKOFF_BASE = 1.0             # 指數退避起始秒數（有 Retry-After 時以它為準）
+    AZURE_BACKOFF_MAX = 30
+    AZURE_RPM_LIMIT = 900                # 每個部署的配額
+    AZURE_TPM_LIMIT = 150000
+    AZURE_MAX_CONCURRENCY = 200          # 每個行程同時進行中的請求上限（gevent 模式下可同時等待很多個）
+    AZURE_POOL_CONNECTIONS = 200
+    AZURE_POOL_KEEPALIVE = 50
+    AZURE_KEEPALIVE_EXPIRY = 30
+    
     # 檔案路徑
     ICD_CSV_PATH = "ICD_code.csv"
-    CAD_RULE_PATH = "CAD_rule.csv"
\ No newline at end of file
+    CAD_RULE_PATH = "CAD_rule.csv"
+    ICD_SNAPSHOT_PATH = "ICD_code.snapshot"   # python -m common.icd_snapshot 產生；不存在時改讀 CSV
+    
+    # 正式環境啟動（python serve.py，gevent 協程；LLM 等待時不佔住執行緒）
+    SERVE_HOST = '0.0.0.0'
+    SERVE_PORT = 5001
+    SERVE_MAX_CONNECTIONS = 1000         # 同時處理中的連線上限
+    
+    # create_app() 啟動伺服器時是否預先載入 ICD / CAD 資料；False 則第一次使用才載入（啟動較快）
+    # import app 取得的模組層級 app 一律不預先載入
+    PRELOAD_DATA = True
+    
+    # LLM 回應快取（只用在 temperature=0 的 ICD 分析）
+    LLM_CACHE_ENABLED = True
+    LLM_CACHE_MAX_ENTRIES = 512          # 記憶體 LRU 筆數上限
+    LLM_CACHE_TTL = 7 * 24 * 3600        # 秒；0 表示不過期
+    LLM_CACHE_DB_PATH = None             # 設成 "llm_cache.sqlite3" 啟用磁碟層
+    LLM_CACHE_DB_MAX_ENTRIES = 10000
+    
+    # 儲存的 Prompt（SQLite，多個 worker 共用同一個檔案）
+    PROMPT_DB_PATH = "prompt_store.sqlite3"
+    PROMPT_STORE_MAX_PER_USER = 10       # 每位使用者每種 Prompt 保留筆數
+    PROMPT_STORE_RECHECK = 1.0           # 秒；多久檢查一次其他 worker 是否有寫入
+    # 舊版 JSON 檔（資料表還沒有資料時匯入一次）
+    PROMPT_LEGACY_FILES = {
+        "summary": r"C:\Users\482525\Prompt_File\saved_prompts.json",
+        "icd": r"C:\Users\482525\Prompt_File\saved_icd_prompts.json",
+    }
+    
+    # ICD 對話 session（/refine_icd 追問；SQLite，多個 worker 共用同一個檔案）
+    # 注意：session 內含完整病歷文字（個資），會以明文寫入 SESSION_DB_PATH 指定的 SQLite 檔（預設在專案目錄），
+    # 保留到 SESSION_TTL 過期；啟用前請確認該目錄的存取權限與院內個資規範
+    SESSIONS_ENABLED = False             # 預設關閉：不寫入病歷、回應的 session_id 為 null、/refine_icd 回 404
+    SESSION_DB_PATH = "icd_sessions.sqlite3"
+    SESSION_TTL = 2 * 3600               # 秒；超過沒使用即失效（過期資料在建立新 session 時刪除）
+    SESSION_MAX_ENTRIES = 5000
+    SESSION_MAX_TURNS = 10               # 保留的追問輪數；超過丟掉最舊的追問（首輪分析保留）
+    ICD_RETURN_HISTORY = False           # 回應附上完整 history（舊版行為）；請求也可帶 include_history=true
+    
+    # 回應壓縮（依 Accept-Encoding 用 br / gzip）與壓縮的請求內容（Content-Encoding: gzip / deflate / br）
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_BYTES = 1024            # 小於此大小的回應不壓縮
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 5          # 0–11；11 壓得最小但很慢
+    COMPRESS_MAX_REQUEST_BYTES = 64 * 1024 * 1024   # 請求內容解壓後上限，超過回 413
+    
+    # Word 上傳 / 輸出緩衝區
+    DOC_SPOOL_MAX_BYTES = 20 * 1024 * 1024   # 以內留在記憶體，超過才寫到暫存檔
+    DOC_SPOOL_DIR = None                 # 暫存檔與串流模式下載檔的目錄；None 表示系統暫存目錄下的 ai_summary_spool
+    DOC_SPOOL_TTL = 3600                 # 秒；串流模式的下載檔保留多久
+    DOC_SWEEP_INTERVAL = 600             # 秒；清理頻率，0 表示不自動清理
+    
+    # PDF 文字擷取
+    PDF_MAX_WORKERS = 0                  # 行程池大小；0 表示 CPU 核心數
+    PDF_PARALLEL_MIN_PAGES = 32          # 頁數少於此值直接在本行程擷取
+    PDF_POOL_START_METHOD = "spawn"      # gevent worker 內 fork 不安全；None 表示平台預設（Linux fork）
+    
+    # 上傳文件文字快取（以檔案內容 hash 為 key）
+    TEXT_CACHE_ENABLED = True
+    TEXT_CACHE_MAX_ENTRIES = 256
+    TEXT_CACHE_MAX_CHARS = 20000000      # 快取文字總字數上限
+    
+    # 近似重複病例（MinHash + LSH）
+    NEAR_DUP_ENABLED = True
+    NEAR_DUP_SHOW_THRESHOLD = 0.8        # 相似度達此值就在回應附上先前的分析
+    NEAR_DUP_REUSE = False               # 開啟後相似度達 NEAR_DUP_REUSE_THRESHOLD 直接沿用先前結果，不呼叫 Azure
+    NEAR_DUP_REUSE_THRESHOLD = 0.95
+    NEAR_DUP_NUM_PERM = 128              # MinHash 簽章長度
+    NEAR_DUP_BANDS = 16                  # LSH 區段數（每段 8 個）；約相似度 0.7 以上才會成為候選
+    NEAR_DUP_SHINGLE_SIZE = 5            # 字元 k-gram 長度
+    NEAR_DUP_MAX_ENTRIES = 20000         # 記憶體中保留的分析筆數
+    
+    # 監控指標（/metrics，Prometheus 文字格式；每個行程各自累計）
+    METRICS_ENABLED = True
+    METRICS_STREAM_USAGE = False         # 串流呼叫也要求上游回報 token 用量（stream_options，需 api-version 2024-09-01-preview 以上）
+    
+    # 批次 ICD 分析
+    BATCH_MAX_WORKERS = 4                # 同時送出的 LLM 請求上限（依 Azure 配額調整）
+    BATCH_MAX_CASES = 1000               # 單一批次病例上限
+    BATCH_MAX_JOBS = 20                  # 保留的批次工作數
+    BATCH_DB_PATH = "batch_jobs.sqlite3" # 批次工作狀態與結果（多個 worker 共用，任何 worker 都查得到進度）
+    BATCH_STALE_SECONDS = 1800           # 執行中的工作超過此秒數沒有任何病例完成即標記 failed（worker 重啟、卡住）
+    BATCH_SAVE_RETRIES = 3               # 寫入病例結果失敗（例：SQLite 鎖定逾時）的重試次數
+    
+    # 送 LLM 前的本地候選碼比對（Aho-Corasick）
+    ICD_CANDIDATES_IN_PROMPT = True      # 把候選碼清單附在病歷後面
+    ICD_CANDIDATE_MAX = 30               # 最多附幾個候選碼
+    ICD_CANDIDATE_MAX_ENGLISH_WORDS = 8  # 只收字數以內的英文病名（太長的不會原文出現在病歷）
+    ICD_CANDIDATE_MAX_CHINESE_CHARS = 16
+    BATCH_SKIP_NON_CAD = False           # 批次稽核：病歷完全沒有 CAD 候選時不呼叫 LLM，直接判定「否」
+    
+    # 長病歷 / 長報告 map-reduce：超過門檻才分段平行擷取重點，再合併分析
+    LONG_TEXT_CHUNKING = True
+    LONG_TEXT_THRESHOLD = 24000          # 字元數；以下維持單次呼叫
+    LONG_TEXT_CHUNK_CHARS = 12000        # 每段字元數上限
+    LONG_TEXT_MAX_FANOUT = 4             # 單一請求同時送出的分段呼叫上限（批次時會再乘上 BATCH_MAX_WORKERS）
\ No newline at end of file
@@ -0,0 +1,117 @@
+# common/doc_buffers.py
+# Word 上傳 → 解析 → 插入摘要 → 下載，全程用記憶體緩衝區
+#   - 上傳檔與輸出檔都是 SpooledTemporaryFile：DOC_SPOOL_MAX_BYTES 以內留在記憶體，超過才寫到 DOC_SPOOL_DIR 的匿名暫存檔（關閉即刪除）
+#   - 串流模式的輸出要給之後的 /download_summary 取用（可能落在另一個 worker），只有這種情況會寫成具名檔案
+#   - 清理執行緒定期刪掉 DOC_SPOOL_DIR 內超過 DOC_SPOOL_TTL 的檔案，順便清掉舊版留在系統暫存目錄的 upload_* / output_*
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+from config import Config
+from .utils import read_word_document, read_pdf_document
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# 舊版固定寫在系統暫存目錄、從不刪除的檔名
+LEGACY_TEMP_RE = re.compile(r'^(?:upload|output)_[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}_')
+
+def spool_dir():
+    path = Config.DOC_SPOOL_DIR or os.path.join(tempfile.gettempdir(), 'ai_summary_spool')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def new_buffer():
+    ensure_sweeper()
+    return tempfile.SpooledTemporaryFile(max_size=Config.DOC_SPOOL_MAX_BYTES, dir=spool_dir())
+
+# 上傳的 .docx 複製到緩衝區；其他副檔名回傳 None
+def spool_uploaded_word(file):
+    if not (file and file.filename.lower().endswith('.docx')):
+        return None
+    buffer = new_buffer()
+    shutil.copyfileobj(file.stream, buffer)
+    buffer.seek(0)
+    return buffer
+
+def is_pdf_upload(file):
+    return bool(file and file.filename.lower().endswith('.pdf'))
+
+# 上傳的 .docx / .pdf 直接從上傳串流轉成文字，回傳 (文字, document_key)；pages 只用於 PDF。格式不符或頁碼錯誤丟 ValueError
+def read_upload_text(file, pages=None):
+    if is_pdf_upload(file):
+        return read_pdf_document(file.stream, pages)
+    if file and file.filename.lower().endswith('.docx'):
+        return read_word_document(file.stream)
+    raise ValueError("只接受 .docx 或 .pdf 檔案")
+
+def download_name(file):
+    return f"AI摘要_{os.path.basename(file.filename)}"
+
+# ============ 串流模式的下載檔 ============
+# 檔名以 URL 編碼存放（保留中文檔名，又不會有路徑字元）
+def save_download(file_id, filename, buffer):
+    stem, ext = os.path.splitext(os.path.basename(filename))
+    # 中文編碼後每字 9 個字元，截短避免超過檔名長度上限
+    path = os.path.join(spool_dir(), f"output_{file_id}_{urllib.parse.quote(stem[:40] + ext, safe='')}")
+    buffer.seek(0)
+    # 先寫到暫存名稱再改名，下載端不會讀到寫一半的檔案
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as f:
+        shutil.copyfileobj(buffer, f)
+    os.replace(tmp_path, path)
+    return path
+
+# 回傳 (路徑, 下載檔名)；不存在回傳 (None, None)
+def find_download(file_id):
+    prefix = f"output_{file_id}_"
+    directory = spool_dir()
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and not name.endswith('.part'):
+            return os.path.join(directory, name), urllib.parse.unquote(name[len(prefix):])
+    return None, None
+
+# ============ 清理 ============
+def sweep(now=None):
+    now = now or time.time()
+    removed = 0
+    targets = [(spool_dir(), None), (tempfile.gettempdir(), LEGACY_TEMP_RE)]
+    for directory, pattern in targets:
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if pattern is not None and not pattern.match(entry.name):
+                continue
+            try:
+                if entry.is_file() and now - entry.stat().st_mtime > Config.DOC_SPOOL_TTL:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                # 其他 worker 剛好刪掉，或 Windows 上檔案還開著
+                pass
+    return removed
+
+_sweeper_pid = None
+_sweeper_lock = threading.Lock()
+
+def _sweep_forever():
+    while True:
+        try:
+            sweep()
+        except Exception as e:
+            print(f"暫存檔清理錯誤: {e}")
+        time.sleep(Config.DOC_SWEEP_INTERVAL)
+
+# 每個行程各一條清理執行緒（gunicorn fork 後的 worker 第一次用到才啟動）
+def ensure_sweeper():
+    global _sweeper_pid
+    if _sweeper_pid == os.getpid() or Config.DOC_SWEEP_INTERVAL <= 0:
+        return
+    with _sweeper_lock:
+        if _sweeper_pid != os.getpid():
+            _sweeper_pid = os.getpid()
+            threading.Thread(target=_sweep_forever, name='doc_sweeper', daemon=True).start()
@@ -0,0 +1,45 @@
+# tasks/drg_rules.py
+from flask import Blueprint, request, jsonify
+from common.cad_rules import evaluate_drg
+
+drg_rules_bp = Blueprint('drg_rules', __name__)
+
+MAX_CASES = 10000
+
+def get_codes(item):
+    codes = item.get('codes') if isinstance(item, dict) else item
+    if not isinstance(codes, list):
+        return None
+    return [str(code) for code in codes]
+
+# 依 CAD_rule.csv 計算 DRG / RW，不呼叫 LLM（codes 第一個為主診斷）
+# 單筆：{"codes": ["I25.110", "I50.20"]}
+# 多筆：{"cases": [{"case_id": "A1", "codes": [...]}, ...]}
+@drg_rules_bp.route('/drg/evaluate', methods=['POST'])
+def drg_evaluate():
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({"error": "無效的 JSON 資料"}), 400
+    
+    if 'cases' in data:
+        cases = data['cases']
+        if not isinstance(cases, list):
+            return jsonify({"error": "cases 必須為陣列"}), 400
+        if len(cases) > MAX_CASES:
+            return jsonify({"error": f"一次最多 {MAX_CASES} 筆"}), 400
+        
+        results = []
+        for index, case in enumerate(cases):
+            codes = get_codes(case)
+            if codes is None:
+                return jsonify({"error": f"第 {index + 1} 筆缺少 codes 陣列"}), 400
+            result = evaluate_drg(codes)
+            if isinstance(case, dict) and 'case_id' in case:
+                result["case_id"] = case['case_id']
+            results.append(result)
+        return jsonify({"results": results})
+    
+    codes = get_codes(data)
+    if codes is None:
+        return jsonify({"error": "請提供 codes 陣列"}), 400
+    return jsonify(evaluate_drg(codes))
\ No newline at end of file
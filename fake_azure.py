@@ -0,0 +1,249 @@
+# fake_azure.py
+# 本機假的 Azure OpenAI 上游（壓力測試 / 基準用，不需要真的金鑰）
+#   - 接受 Azure 路徑 /openai/deployments/<deployment>/chat/completions 與 /v1/chat/completions
+#   - 延遲分布：const:2、uniform:1,3、normal:2,0.5、lognormal:2,0.5（中位數, sigma）；串流時是第一個 token 前的延遲
+#   - 串流：第一個 chunk 只有內容過濾結果（沒有 choices，同 Azure），之後每 --chunk-chars 字一個 chunk，間隔 --token-delay 秒；
+#     要求 stream_options.include_usage 時最後附 usage
+#   - 429 注入：--throttle-rate 機率隨機回 429，或 --rpm 超過每分鐘請求數時回 429（都帶 Retry-After）；--error-rate 機率回 500
+#   - GET /stats：請求數、429 / 500 次數、同時處理中的峰值
+# 用法（專案根目錄）：python fake_azure.py [--port 8999] [--latency lognormal:1.5,0.4] [--throttle-rate 0.05]
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ICD_ANSWER = """【CAD 判斷結果】
+是否主診為 CAD：是
+是否併發症：否
+預估 DRG：125
+預估 RW：0.7146
+關鍵證據：
+1. 運動誘發胸痛
+2. 心導管 LAD 狹窄 70%
+
+【一般 ICD 推薦】
+1. I25.10 - Atherosclerotic heart disease of native coronary artery without angina pectoris
+   原因：冠狀動脈狹窄
+2. I10 - Essential (primary) hypertension
+   原因：長期高血壓用藥
+3. E11.9 - Type 2 diabetes mellitus without complications
+   原因：糖尿病口服藥控制"""
+
+SUMMARY_ANSWER = """**摘要**
+主訴：運動時胸悶三個月
+主要診斷：冠狀動脈疾病（LAD 狹窄 70%）
+重要檢查發現：心導管顯示單一血管病變，EF 60%
+治療經過：接受 PCI 置放支架一枚，術後無胸痛
+出院狀況與建議：病況穩定出院，持續雙重抗血小板治療並於心臟科門診追蹤"""
+
+EXTRACT_ANSWER = """- 運動時胸悶三個月
+- 心導管：LAD 狹窄 70%
+- 處置：PCI 置放支架一枚"""
+
+CJK_RE = re.compile(r"[\u3400-\u9fff]")
+CHUNK_PROMPT_RE = re.compile(r"第 \d+/\d+ 段")
+
+# 解析延遲分布，回傳每次呼叫一次取樣（秒）的函式
+def parse_latency(spec):
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v.strip()] if args else []
+    if kind == 'const':
+        value = values[0] if values else 0.0
+        return lambda: value
+    if kind == 'uniform':
+        low, high = values
+        return lambda: random.uniform(low, high)
+    if kind == 'normal':
+        mean, sd = values
+        return lambda: max(0.0, random.gauss(mean, sd))
+    if kind == 'lognormal':
+        import math
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"不支援的延遲分布：{spec}")
+
+# 粗估 token 數（中文約 1 字 1 token，其餘約 4 字元 1 token；與 common.azure_client.estimate_tokens 相同）
+def count_tokens(text):
+    cjk = len(CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4
+
+# 依 system prompt 回不同的內容：CAD 分析、分段擷取、摘要
+def pick_answer(messages):
+    system = messages[0].get("content", "") if messages else ""
+    if CHUNK_PROMPT_RE.search(system):
+        return EXTRACT_ANSWER
+    if "CAD" in system:
+        return ICD_ANSWER
+    return SUMMARY_ANSWER
+
+class FakeAzure:
+    def __init__(self, latency, token_delay=0.0, chunk_chars=8, throttle_rate=0.0, error_rate=0.0, rpm=0, retry_after=1.0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.chunk_chars = chunk_chars
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.retry_after = retry_after
+        
+        self._recent = deque()      # 最近一分鐘接受的請求時間（--rpm）
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "completed": 0, "throttled": 0, "errors": 0, "streams": 0, "in_flight": 0, "peak_in_flight": 0}
+        
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+            if key == "in_flight":
+                self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.stats["in_flight"])
+                
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+            
+    # 回傳 None（正常處理）或要回的錯誤狀態碼
+    def admit(self):
+        self._count("requests")
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            return 429
+        if self.rpm:
+            now = time.monotonic()
+            with self._lock:
+                while self._recent and now - self._recent[0] > 60:
+                    self._recent.popleft()
+                if len(self._recent) >= self.rpm:
+                    return 429
+                self._recent.append(now)
+        if self.error_rate and random.random() < self.error_rate:
+            return 500
+        return None
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def log_message(self, *args):
+            pass
+            
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            
+        def _write_chunk(self, payload):
+            data = f"data: {payload}\n\n".encode('utf-8')
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+            
+        def do_GET(self):
+            if self.path.rstrip('/') == '/stats':
+                self._send_json(200, fake.get_stats())
+            else:
+                self._send_json(404, {"error": {"code": "404", "message": "Resource not found"}})
+                
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.split('?')[0].endswith('/chat/completions'):
+                self._send_json(404, {"error": {"code": "404", "message": "Resource not found"}})
+                return
+                
+            status = fake.admit()
+            if status == 429:
+                fake._count("throttled")
+                self._send_json(429, {"error": {"code": "429", "message": "Requests to the ChatCompletions_Create Operation have exceeded rate limit."}},
+                                {"Retry-After": f"{fake.retry_after:g}", "retry-after-ms": str(int(fake.retry_after * 1000))})
+                return
+            if status == 500:
+                fake._count("errors")
+                self._send_json(500, {"error": {"code": "InternalServerError", "message": "The server had an error while processing your request."}})
+                return
+                
+            fake._count("in_flight")
+            try:
+                messages = body.get("messages", [])
+                answer = pick_answer(messages)
+                usage = {
+                    "prompt_tokens": sum(count_tokens(m.get("content") or "") + 4 for m in messages),
+                    "completion_tokens": count_tokens(answer)
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                model = body.get("model", "gpt-4o")
+                
+                time.sleep(fake.latency())
+                if body.get("stream"):
+                    fake._count("streams")
+                    self._stream(answer, model, usage if (body.get("stream_options") or {}).get("include_usage") else None)
+                else:
+                    self._send_json(200, {
+                        "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                        "usage": usage
+                    })
+                fake._count("completed")
+            finally:
+                fake._count("in_flight", -1)
+                
+        def _stream(self, answer, model, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            
+            base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+            # Azure 第一個 chunk：只有 prompt 的內容過濾結果
+            self._write_chunk(json.dumps(dict(base, choices=[], prompt_filter_results=[{"prompt_index": 0, "content_filter_results": {}}])))
+            for i in range(0, len(answer), fake.chunk_chars):
+                if i and fake.token_delay:
+                    time.sleep(fake.token_delay)
+                delta = {"content": answer[i:i + fake.chunk_chars]}
+                self._write_chunk(json.dumps(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]), ensure_ascii=False))
+            self._write_chunk(json.dumps(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])))
+            if usage:
+                self._write_chunk(json.dumps(dict(base, choices=[], usage=usage)))
+            self._write_chunk("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            
+    return Handler
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--latency', default='const:1', help="const:秒 / uniform:低,高 / normal:平均,標準差 / lognormal:中位數,sigma")
+    parser.add_argument('--token-delay', type=float, default=0.02, help="串流 chunk 之間的間隔秒數")
+    parser.add_argument('--chunk-chars', type=int, default=8)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="隨機回 429 的機率")
+    parser.add_argument('--rpm', type=int, default=0, help="每分鐘請求數上限，超過回 429；0 表示不限制")
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="隨機回 500 的機率")
+    return parser
+
+def serve(args):
+    fake = FakeAzure(
+        parse_latency(args.latency),
+        token_delay=args.token_delay,
+        chunk_chars=args.chunk_chars,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        rpm=args.rpm,
+        retry_after=args.retry_after
+    )
+    server = Server((args.host, args.port), make_handler(fake))
+    print(f"假 Azure OpenAI 上游：http://{args.host}:{args.port}（延遲 {args.latency}）", flush=True)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    serve(build_parser().parse_args())
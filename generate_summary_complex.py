@@ -1,16 +1,16 @@
 # tasks/generate_summary.py
-from flask import Blueprint, request, jsonify, send_file, session
+from flask import Blueprint, request, jsonify, send_file, session, Response, stream_with_context
 from common.azure_client import get_client_and_deployment
-from common.utils import read_word_file, read_pdf_file  # 你的檔案讀取函數
-from werkzeug.utils import secure_filename
-from docx import Document  # 新增：處理 Word
-import os
-import json
-import tempfile
+from common.utils import read_word_document, sse_event  # 你的檔案讀取函數
+from common.chunking import chunk_text, needs_chunking, iter_map, map_chunks, join_chunk_notes
+from common.llm_cache import llm_cache
+from common import metrics
+from config import Config
+from common.prompt_store import get_prompt_store, request_namespace
+from common.word_insert import insert_summary_at_bookmark  # 插入摘要到 Word 書籤位置
+from common.doc_buffers import spool_uploaded_word, is_pdf_upload, read_upload_text, new_buffer, download_name, save_download, find_download, DOCX_MIMETYPE
+import re
 import uuid  # 用來產生唯一檔名
-from docx.shared import Pt
-from docx.oxml.ns import qn # 字體
-from docx.enum.text import WD_LINE_SPACING # 行距
 
 summary_bp = Blueprint('summary', __name__)
 
@@ -65,32 +65,7 @@ SUMMARY_TEMPLATES = {
 """
 }
 
-# 儲存 Prompt（上限 20 個）
-# 1. 指定您想要的資料夾路徑
-SAVE_DIR = r"C:\Users\482525\Prompt_File"
-# 2. 指定完整檔案路徑
-PROMPT_FILE = os.path.join(SAVE_DIR, 'saved_prompts.json')
-
-def load_from_file():
-    # 如果檔案夾或檔案不存在，回傳空列表
-    if os.path.exists(PROMPT_FILE):
-        try:
-            with open(PROMPT_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"讀取錯誤: {e}")
-            return []
-    return []
-
-def save_to_file(prompts):
-    # 自動檢查資料夾是否存在，不存在就建立它
-    if not os.path.exists(SAVE_DIR):
-        os.makedirs(SAVE_DIR)
-        
-    with open(PROMPT_FILE, 'w', encoding='utf-8') as f:
-        # ensure_ascii=False 確保中文字不會變成編碼，indent=4 讓格式好看
-        json.dump(prompts, f, ensure_ascii=False, indent=4)
-
+# 儲存 Prompt（SQLite，依使用者分開，各保留最新 10 個）
 @summary_bp.route('/save_prompt', methods=['POST'])
 def save_prompt():
     data = request.json
@@ -100,117 +75,100 @@ def save_prompt():
     if not name or not prompt:
         return jsonify({"error": "名稱與 Prompt 必填"}), 400
     
-    # 從「檔案」讀取目前的列表
-    prompts = load_from_file()
-    
-    # 避免重複名稱（刪除舊的同名項）
-    prompts = [p for p in prompts if p['name'] != name]
-    
-    # 加入新資料
-    prompts.append({'name': name, 'prompt': prompt})
-    
-    # 上限 10 個
-    if len(prompts) > 10:
-        prompts = prompts[-10:]
-    
-    # 儲存回「檔案」
-    save_to_file(prompts)
+    # 同名覆蓋、超過上限刪最舊的，都在同一個交易內完成
+    get_prompt_store().save("summary", request_namespace(request, data), name, prompt)
     
     return jsonify({"success": True})
 
 @summary_bp.route('/load_saved_prompts')
 def load_saved_prompts():
-    # 這裡必須調用讀取 C:\Users\482525\Prompt_File 的邏輯
-    prompts = load_from_file() 
-    print(f"DEBUG: 撈取到的資料為 {prompts}") # 加這行在終端機檢查
+    prompts = get_prompt_store().list("summary", request_namespace(request))
     return jsonify({"prompts": prompts})
 
-# 新增：插入摘要到 Word 書籤位置
-def insert_summary_at_bookmark(word_path, summary_text, bookmark_name="AI_SUMMARY_HERE", output_path=None):
-    doc = Document(word_path)
+# 監控指標的 template 標籤（不認得的模板與 build_summary_messages 一樣當成 general）
+def bind_summary_template(template_type):
+    metrics.bind(template=template_type if template_type in SUMMARY_TEMPLATES else "general")
+
+# 組合送給 LLM 的訊息
+def build_summary_messages(full_content, template_type="general", custom_prompt=""):
+    # 選擇模板
+    base_prompt = SUMMARY_TEMPLATES.get(template_type, SUMMARY_TEMPLATES["general"])
     
-    bookmark_found = False
+    # 自訂 prompt 優先
+    final_prompt = custom_prompt + "\n\n" + base_prompt if custom_prompt else base_prompt
     
-    for paragraph in doc.paragraphs:
-        if bookmark_name in paragraph._element.xml:
-            paragraph.clear()
-            
-            # === 標題 ===
-            title_p = paragraph.insert_paragraph_before("【產生報告總結及建議】")
-            title_p.paragraph_format.line_spacing = 1.5
-            title_run = title_p.runs[0]
-            title_run.bold = True
-            title_run.font.size = Pt(16)
-            
-            # 強制三種字體都設為標楷體（標題通常是中文）
-            title_run.font.name = '標楷體'
-            title_run._element.rPr.rFonts.set(qn('w:ascii'), '標楷體')
-            title_run._element.rPr.rFonts.set(qn('w:hAnsi'), '標楷體')
-            title_run._element.rPr.rFonts.set(qn('w:eastAsia'), '標楷體')
-            
-            # === 內文 ===
-            for line in summary_text.split('\n'):
-                if line.strip():
-                    p = paragraph.insert_paragraph_before(line.strip())
-                    p.paragraph_format.line_spacing = 1.5
-                    p.paragraph_format.space_after = Pt(6)
-                    
-                    # 對每一行，可能有多個 run（如果有粗體等）
-                    for run in p.runs:
-                        run.font.size = Pt(12)
-                        
-                        # 關鍵：根據文字內容決定字體
-                        if any('\u4e00' <= char <= '\u9fff' for char in run.text):  # 有中文
-                            run.font.name = '標楷體'
-                            run._element.rPr.rFonts.set(qn('w:eastAsia'), '標楷體')
-                            run._element.rPr.rFonts.set(qn('w:ascii'), 'Times New Roman')
-                            run._element.rPr.rFonts.set(qn('w:hAnsi'), 'Times New Roman')
-                        else:  # 純英文
-                            run.font.name = 'Times New Roman'
-                            run._element.rPr.rFonts.set(qn('w:ascii'), 'Times New Roman')
-                            run._element.rPr.rFonts.set(qn('w:hAnsi'), 'Times New Roman')
-                            run._element.rPr.rFonts.set(qn('w:eastAsia'), '標楷體')  # 保險
-            
-            bookmark_found = True
-            break
+    return [
+        {"role": "system", "content": final_prompt},
+        {"role": "user", "content": full_content}
+    ]
+
+# ============ 長文件：分段擷取重點（map），再用精簡後的重點產生摘要（reduce） ============
+SUMMARY_EXTRACT_PROMPT = """以下是一份長文件的第 {index}/{total} 段。最終會依下列需求產生摘要：
+{requirement}
+
+請先擷取本段與上述需求相關的重點，條列輸出（保留數據、年份、單位名稱與趨勢），不要寫成摘要、不要加開場白。
+本段沒有相關內容就輸出「無」。"""
+
+CONTENT_NOTES_LABEL = "文件第 {index}/{total} 段重點"
+SUMMARY_EXTRACT_SAMPLING = {"temperature": 0.0, "max_tokens": 800}
+
+def make_chunk_extractor(template_type="general", custom_prompt=""):
+    base_prompt = SUMMARY_TEMPLATES.get(template_type, SUMMARY_TEMPLATES["general"])
+    requirement = custom_prompt + "\n\n" + base_prompt if custom_prompt else base_prompt
     
-    # === fallback：書籤沒找到，加到最後 ===
-    if not bookmark_found:
-        doc.add_page_break()
-        
-        # 標題
-        title_p = doc.add_paragraph("【產生報告總結及建議】")
-        title_p.paragraph_format.line_spacing = 1.5
-        title_run = title_p.runs[0]
-        title_run.bold = True
-        title_run.font.size = Pt(16)
-        title_run.font.name = '標楷體'
-        title_run._element.rPr.rFonts.set(qn('w:ascii'), '標楷體')
-        title_run._element.rPr.rFonts.set(qn('w:hAnsi'), '標楷體')
-        title_run._element.rPr.rFonts.set(qn('w:eastAsia'), '標楷體')
-        
-        # 內文
-        for line in summary_text.split('\n'):
-            if line.strip():
-                p = doc.add_paragraph(line.strip())
-                p.paragraph_format.line_spacing = 1.5
-                p.paragraph_format.space_after = Pt(6)
-                
-                for run in p.runs:
-                    run.font.size = Pt(12)
-                    if any('\u4e00' <= char <= '\u9fff' for char in run.text):
-                        run.font.name = '標楷體'
-                        run._element.rPr.rFonts.set(qn('w:eastAsia'), '標楷體')
-                        run._element.rPr.rFonts.set(qn('w:ascii'), 'Times New Roman')
-                        run._element.rPr.rFonts.set(qn('w:hAnsi'), 'Times New Roman')
-                    else:
-                        run.font.name = 'Times New Roman'
-                        run._element.rPr.rFonts.set(qn('w:ascii'), 'Times New Roman')
-                        run._element.rPr.rFonts.set(qn('w:hAnsi'), 'Times New Roman')
-                        run._element.rPr.rFonts.set(qn('w:eastAsia'), '標楷體')
+    def extract(chunk, index, total):
+        client, deployment = get_client_and_deployment()
+        system_prompt = (SUMMARY_EXTRACT_PROMPT
+                         .replace("{index}", str(index + 1))
+                         .replace("{total}", str(total))
+                         .replace("{requirement}", requirement))
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": chunk}
+        ]
+        # temperature=0：同一份文件、同樣需求重跑時直接重用各段重點
+        cache_key = llm_cache.make_key(deployment, messages, **SUMMARY_EXTRACT_SAMPLING) if Config.LLM_CACHE_ENABLED else None
+        if cache_key:
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        response = client.chat.completions.create(
+            model=deployment,
+            messages=messages,
+            **SUMMARY_EXTRACT_SAMPLING
+        )
+        note = response.choices[0].message.content.strip()
+        if cache_key:
+            llm_cache.set(cache_key, note)
+        return note
     
-    doc.save(output_path or word_path)
-    return output_path or word_path
+    return extract
+
+# 回傳 (送去摘要的內容, 區塊數)；短文件原樣回傳
+def condense_content(full_content, template_type="general", custom_prompt=""):
+    if not needs_chunking(full_content):
+        return full_content, 1
+    chunks = chunk_text(full_content)
+    with metrics.stage("chunk_map"):
+        notes = map_chunks(make_chunk_extractor(template_type, custom_prompt), chunks)
+    return join_chunk_notes(notes, CONTENT_NOTES_LABEL), len(chunks)
+
+# 呼叫 LLM 產生摘要
+def summarize_text(full_content, template_type="general", custom_prompt=""):
+    client, deployment = get_client_and_deployment()
+    
+    full_content, _ = condense_content(full_content, template_type, custom_prompt)
+    with metrics.stage("build_prompt"):
+        messages = build_summary_messages(full_content, template_type, custom_prompt)
+    
+    response = client.chat.completions.create(
+        model=deployment,
+        messages=messages,
+        temperature=0.3,
+        max_tokens=1000
+    )
+    
+    return response.choices[0].message.content.strip()
 
 @summary_bp.route('/generate_summary', methods=['POST'])
 def generate_summary():
@@ -218,76 +176,190 @@ def generate_summary():
     text_input = request.form.get('text_input', '').strip()
     custom_prompt = request.form.get('custom_prompt', '').strip()
     template_type = request.form.get('template_type', 'general')
+    bind_summary_template(template_type)
+    
+    pages = request.form.get('pages', '').strip()  # PDF 頁碼範圍，例如 1-5,8
     
-    # 2. 處理檔案上傳（只接受 .docx）
-    uploaded_word_path = None
-    file = request.files.get('file')
-    if file and file.filename.lower().endswith('.docx'):
-        filename = secure_filename(file.filename)
-        uploaded_word_path = os.path.join(tempfile.gettempdir(), f"upload_{uuid.uuid4()}_{filename}")
-        file.save(uploaded_word_path)
+    # 2. 處理檔案上傳（.docx 讀進記憶體緩衝區，之後插入摘要；.pdf 只取文字）
+    upload = request.files.get('file')
+    uploaded_word = spool_uploaded_word(upload)
     
-    # 3. 讀取文字內容（優先 text_input，其次上傳檔案）
+    # 3. 讀取文字內容（優先 text_input，其次上傳檔案）；同內容的檔案直接取快取的文字
     full_content = text_input
-    if uploaded_word_path:
+    document_key = None
+    if uploaded_word:
         try:
-            full_content = read_word_file(uploaded_word_path)  # 你的讀取函數
+            full_content, document_key = read_word_document(uploaded_word)  # 你的讀取函數
         except:
+            uploaded_word.close()
             return jsonify({"error": "讀取 Word 檔案失敗"}), 500
+    elif is_pdf_upload(upload):
+        try:
+            full_content, document_key = read_upload_text(upload, pages)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except:
+            return jsonify({"error": "讀取 PDF 檔案失敗"}), 500
     
     if not full_content.strip():
         return jsonify({"error": "請提供文字或上傳 Word 檔案"}), 400
     
     try:
-        client, deployment = get_client_and_deployment()
-        
-        # 選擇模板
-        base_prompt = SUMMARY_TEMPLATES.get(template_type, SUMMARY_TEMPLATES["general"])
-        
-        # 自訂 prompt 優先
-        final_prompt = custom_prompt + "\n\n" + base_prompt if custom_prompt else base_prompt
-        
-        messages = [
-            {"role": "system", "content": final_prompt},
-            {"role": "user", "content": full_content}
-        ]
-        
-        response = client.chat.completions.create(
-            model=deployment,
-            messages=messages,
-            temperature=0.3,
-            max_tokens=1000
-        )
-        
-        summary = response.choices[0].message.content.strip()
+        summary = summarize_text(full_content, template_type, custom_prompt)
         
         # ============ 新增：如果有上傳 Word，插入摘要並回傳檔案 ============
-        if uploaded_word_path:
-            output_filename = f"AI摘要_{os.path.basename(uploaded_word_path)}"
-            output_path = os.path.join(tempfile.gettempdir(), f"output_{uuid.uuid4()}_{output_filename}")
-            
-            insert_summary_at_bookmark(uploaded_word_path, summary, "AI_SUMMARY_HERE", output_path)
-            
-            os.remove(uploaded_word_path)
+        if uploaded_word:
+            output = new_buffer()
+            with metrics.stage("word_insert"):
+                insert_summary_at_bookmark(uploaded_word, summary, "AI_SUMMARY_HERE", output)
+            uploaded_word.close()
+            output.seek(0)
             
             # 修正處：使用 response 物件並加上自定義 Header
             from flask import make_response
             import urllib.parse
             
+            # 回應送完後由 send_file 關閉緩衝區
             response = make_response(send_file(
-                output_path,
+                output,
                 as_attachment=True,
-                download_name=output_filename,
-                mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+                download_name=download_name(upload),
+                mimetype=DOCX_MIMETYPE
             ))
             # 將摘要放入 Header (需編碼處理避免中文亂碼)
             response.headers['X-Summary-Text'] = urllib.parse.quote(summary)
+            response.headers['X-Document-Key'] = document_key
             # 允許前端讀取此自訂 Header
-            response.headers['Access-Control-Expose-Headers'] = 'X-Summary-Text'
+            response.headers['Access-Control-Expose-Headers'] = 'X-Summary-Text, X-Document-Key'
             
             return response
         
+        # 沒有 Word 可插入（純文字或 PDF）：只回傳摘要
+        return jsonify({"summary": summary, "document_key": document_key})
+        
     except Exception as e:
         import traceback
         print(traceback.format_exc())
-        return jsonify({"error": f"處理失敗：{str(e)}"}), 500
\ No newline at end of file
+        metrics.count_error("request", e)
+        return jsonify({"error": f"處理失敗：{str(e)}"}), 500
+    finally:
+        if uploaded_word:
+            uploaded_word.close()
+
+# 串流版：摘要 token 即時以 SSE 推送，串流結束後才組 Word，並提供獨立下載連結
+# 事件：progress（長文件分段擷取進度）、token（摘要片段）、done（完整摘要 + download_url）、error
+@summary_bp.route('/generate_summary_stream', methods=['POST'])
+def generate_summary_stream():
+    text_input = request.form.get('text_input', '').strip()
+    custom_prompt = request.form.get('custom_prompt', '').strip()
+    template_type = request.form.get('template_type', 'general')
+    bind_summary_template(template_type)
+    
+    pages = request.form.get('pages', '').strip()
+    
+    upload = request.files.get('file')
+    uploaded_word = spool_uploaded_word(upload)
+    
+    full_content = text_input
+    document_key = None
+    if uploaded_word:
+        try:
+            full_content, document_key = read_word_document(uploaded_word)
+        except:
+            uploaded_word.close()
+            return jsonify({"error": "讀取 Word 檔案失敗"}), 500
+    elif is_pdf_upload(upload):
+        try:
+            full_content, document_key = read_upload_text(upload, pages)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except:
+            return jsonify({"error": "讀取 PDF 檔案失敗"}), 500
+    
+    if not full_content.strip():
+        return jsonify({"error": "請提供文字或上傳 Word 檔案"}), 400
+    
+    def generate():
+        try:
+            client, deployment = get_client_and_deployment()
+            
+            # 長文件：各段平行擷取，每完成一段送一次 progress
+            content = full_content
+            if needs_chunking(full_content):
+                chunks = chunk_text(full_content)
+                notes = [None] * len(chunks)
+                extract = make_chunk_extractor(template_type, custom_prompt)
+                with metrics.stage("chunk_map"):
+                    for completed, (index, note) in enumerate(iter_map(extract, chunks), 1):
+                        notes[index] = note
+                        yield sse_event("progress", {"stage": "map", "completed": completed, "total": len(chunks)})
+                content = join_chunk_notes(notes, CONTENT_NOTES_LABEL)
+            
+            with metrics.stage("build_prompt"):
+                messages = build_summary_messages(content, template_type, custom_prompt)
+            stream = client.chat.completions.create(
+                model=deployment,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=1000,
+                stream=True
+            )
+            
+            chunks = []
+            for chunk in stream:
+                # Azure 第一個 chunk 可能只有內容過濾結果，沒有 choices
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if not token:
+                    continue
+                
+                chunks.append(token)
+                yield sse_event("token", {"text": token})
+            
+            summary = "".join(chunks).strip()
+            
+            # 串流結束後才插入 Word，檔案另外下載（下載請求可能落在別的 worker，只有這裡寫成具名檔）
+            download_url = None
+            if uploaded_word:
+                file_id = uuid.uuid4().hex
+                with new_buffer() as output:
+                    with metrics.stage("word_insert"):
+                        insert_summary_at_bookmark(uploaded_word, summary, "AI_SUMMARY_HERE", output)
+                    save_download(file_id, download_name(upload), output)
+                download_url = f"/download_summary/{file_id}"
+            
+            yield sse_event("done", {"summary": summary, "download_url": download_url, "document_key": document_key})
+        
+        except Exception as e:
+            import traceback
+            print(traceback.format_exc())
+            metrics.count_error("request", e)
+            yield sse_event("error", {"error": f"處理失敗：{str(e)}"})
+        
+        finally:
+            if uploaded_word:
+                uploaded_word.close()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# 下載串流模式產生的 Word（以 file_id 對應暫存檔，多個 worker 共用暫存目錄也能找到）
+@summary_bp.route('/download_summary/<file_id>')
+def download_summary(file_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', file_id):
+        return jsonify({"error": "無效的檔案編號"}), 400
+    
+    output_path, filename = find_download(file_id)
+    if not output_path:
+        return jsonify({"error": "檔案不存在或已過期"}), 404
+    
+    return send_file(
+        output_path,
+        as_attachment=True,
+        download_name=filename,
+        mimetype=DOCX_MIMETYPE
+    )
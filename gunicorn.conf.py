@@ -0,0 +1,23 @@
+# gunicorn.conf.py
+# Linux 正式環境：gunicorn -c gunicorn.conf.py（app 由 wsgi_app 的 create_app() 建立，依 PRELOAD_DATA 預先載入）
+# 預設 gevent worker：每個 worker 可同時等待數百個 LLM 回應；GUNICORN_WORKER_CLASS=gthread 可改回執行緒模式
+import os
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+if worker_class == "gevent":
+    # preload_app 會在 fork 前載入 app，所以要在這裡先 patch
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5001")
+# 跨請求的狀態（批次工作、摘要下載、Prompt、對話 session）都放在 SQLite / 暫存檔，任何 worker 都查得到
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+worker_connections = 1000        # gevent：每個 worker 同時處理的連線數
+threads = 8                      # gthread：每個 worker 的執行緒數
+timeout = 300                    # 長病歷 map-reduce 可能要數分鐘
+graceful_timeout = 30
+keepalive = 5
+
+# 在 fork 前載入 ICD / CAD 資料（見 app.init_data），worker 共用記憶體
+preload_app = True
+wsgi_app = "app:create_app()"
\ No newline at end of file
@@ -0,0 +1,220 @@
+# common/icd_candidates.py
+# 送 LLM 前的本地候選碼比對：一次掃描病歷，找出出現過的 ICD 名稱 / 縮寫 / 明寫代碼
+#   英文名稱：以「單字」為單位建 Aho-Corasick（狀態數遠少於逐字元）
+#   中文名稱：以「單一字元」為單位建 Aho-Corasick
+#   明寫代碼：沿用 ICD_CODE_PATTERN，再對照 icd_dict 確認存在
+# 名稱過長的病名幾乎不會原文出現在病歷，只收 ICD_CANDIDATE_MAX_* 以內的，括號內的修飾語另收一份去掉後的版本
+import re
+import threading
+from collections import deque
+from config import Config
+from . import icd_db
+from . import cad_rules
+from .utils import ICD_CODE_PATTERN
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+PAREN_RE = re.compile(r"\s*[(（][^()（）]*[)）]")
+
+# 常見縮寫 / 口語病名 → 代碼（代碼不在 icd_dict 時自動略過）
+# 刻意不收容易誤判的縮寫（PE = physical exam、UA = uric acid、PAD / HF / AF / DM / VT 也對應到一般字詞或多種病況 ...）
+ABBREVIATIONS = {
+    "cad": "I25.10",
+    "ashd": "I25.10",
+    "chf": "I50.9",
+    "hfref": "I50.20",
+    "hfpef": "I50.30",
+    "ami": "I21.9",
+    "stemi": "I21.3",
+    "nstemi": "I21.4",
+    "htn": "I10",
+    "t2dm": "E11.9",
+    "afib": "I48.91",
+    "dcm": "I42.0",
+    "hcm": "I42.2",
+    "ckd": "N18.9",
+    "aki": "N17.9",
+    "copd": "J44.9",
+    "cva": "I63.9",
+    "paod": "I73.9",
+    "冠心病": "I25.10",
+    "冠狀動脈疾病": "I25.10",
+    "心衰竭": "I50.9",
+    "心臟衰竭": "I50.9",
+    "心肌梗塞": "I21.9",
+    "不穩定型心絞痛": "I20.0",
+    "高血壓": "I10",
+    "糖尿病": "E11.9",
+    "心房顫動": "I48.91",
+    "慢性腎臟病": "N18.9",
+}
+
+def normalize_code(code):
+    return code.strip().upper().replace('.', '')
+
+def display_code(code_nodot):
+    return code_nodot[:3] + '.' + code_nodot[3:] if len(code_nodot) > 3 else code_nodot
+
+class AhoCorasick:
+    # 符號可以是字元或單字；value 為比對到時回傳的內容
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]     # 節點本身結束的 (長度, value)
+        self.dict_link = [0]     # 沿 fail 走到的下一個有 output 的節點（0 表示沒有）
+        
+    def add(self, symbols, value):
+        node = 0
+        for symbol in symbols:
+            nxt = self.goto[node].get(symbol)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][symbol] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(None)
+                self.dict_link.append(0)
+            node = nxt
+        if self.output[node] is None:
+            self.output[node] = (len(symbols), value)
+            
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for symbol, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and symbol not in self.goto[f]:
+                    f = self.fail[f]
+                f = self.goto[f].get(symbol, 0)
+                self.fail[child] = f if f != child else 0
+                self.dict_link[child] = f if self.output[f] is not None else self.dict_link[f]
+                
+    def __len__(self):
+        return len(self.goto)
+        
+    # 回傳所有比對 (start, end, value)，end 不含
+    def find_all(self, symbols):
+        goto, fail, output, dict_link = self.goto, self.fail, self.output, self.dict_link
+        node = 0
+        for pos, symbol in enumerate(symbols):
+            while node and symbol not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(symbol, 0)
+            hit = node if output[node] is not None else dict_link[node]
+            while hit:
+                length, value = output[hit]
+                yield pos + 1 - length, pos + 1, value
+                hit = dict_link[hit]
+
+# 重疊的比對只留最長的（coronary artery disease 不再另外算 artery disease）
+def _longest_matches(matches):
+    chosen = []
+    taken = set()
+    for start, end, value in sorted(matches, key=lambda m: (m[0] - m[1], m[0])):
+        if any(p in taken for p in range(start, end)):
+            continue
+        taken.update(range(start, end))
+        chosen.append((start, end, value))
+    return sorted(chosen)
+
+class CandidateMatcher:
+    def __init__(self, icd_dict):
+        self.icd_dict = icd_dict
+        self.english = AhoCorasick()
+        self.chinese = AhoCorasick()
+        
+        for code, entry in icd_dict.items():
+            english = (entry.get('english') or '').strip()
+            chinese = (entry.get('chinese') or '').strip()
+            if english and english != 'nan':
+                for name in {english, PAREN_RE.sub('', english)}:
+                    tokens = TOKEN_RE.findall(name.lower())
+                    if 0 < len(tokens) <= Config.ICD_CANDIDATE_MAX_ENGLISH_WORDS:
+                        self.english.add(tokens, code)
+            if chinese and chinese != 'nan':
+                for name in {chinese, PAREN_RE.sub('', chinese)}:
+                    name = ''.join(name.split())
+                    if 1 < len(name) <= Config.ICD_CANDIDATE_MAX_CHINESE_CHARS:
+                        self.chinese.add(name, code)
+                        
+        for term, code in ABBREVIATIONS.items():
+            code = normalize_code(code)
+            if code not in icd_dict:
+                continue
+            if re.search(r"[a-z]", term):
+                self.english.add(TOKEN_RE.findall(term), code)
+            else:
+                self.chinese.add(term, code)
+                
+        self.english.build()
+        self.chinese.build()
+        
+    # 回傳 [{code, name, term, source}]，依「明寫代碼 → 名稱 / 縮寫」與出現順序排列
+    def find(self, text, limit=None):
+        limit = limit or Config.ICD_CANDIDATE_MAX
+        found = {}
+        
+        def add(code_nodot, term, source):
+            if code_nodot in found:
+                return
+            entry = self.icd_dict.get(code_nodot) or {}
+            found[code_nodot] = {
+                "code": display_code(code_nodot),
+                "name": (entry.get('english') or '').strip(),
+                "term": term,
+                "source": source
+            }
+            
+        for m in ICD_CODE_PATTERN.finditer(text):
+            code_nodot = m.group(1).upper().replace('.', '')
+            if code_nodot in self.icd_dict:
+                add(code_nodot, m.group(0), "code")
+                
+        lowered = text.lower()
+        tokens = TOKEN_RE.findall(lowered)
+        for start, end, code_nodot in _longest_matches(self.english.find_all(tokens)):
+            add(code_nodot, ' '.join(tokens[start:end]), "english")
+            
+        for start, end, code_nodot in _longest_matches(self.chinese.find_all(text)):
+            add(code_nodot, text[start:end], "chinese")
+            
+        return list(found.values())[:limit]
+
+_matcher = None
+_matcher_source = None
+_matcher_lock = threading.Lock()
+
+# 取得比對器：第一次比對才建立（不在 preload 時建，fork 後 refcount 寫入會讓每個 worker 各複製一份）；ICD 表重新載入後自動重建
+def get_candidate_matcher():
+    global _matcher, _matcher_source
+    source = icd_db.get_icd_dict()
+    if _matcher is None or _matcher_source is not source:
+        with _matcher_lock:
+            if _matcher is None or _matcher_source is not source:
+                _matcher = CandidateMatcher(source)
+                _matcher_source = source
+    return _matcher
+
+# 缺血性心臟病（I20–I25，含 AMI）或 CAD_rule.csv 的主診斷碼
+ISCHEMIC_PREFIXES = ('I20', 'I21', 'I22', 'I23', 'I24', 'I25')
+
+def is_cad_candidate(code):
+    return normalize_code(code).startswith(ISCHEMIC_PREFIXES) or cad_rules.engine.match('main', code) is not None
+
+# 病歷 + 出院摘要的候選碼，以及是否有任何 CAD 候選（沒有的話多半不必送 CAD 分析）
+def extract_candidates(case_text, discharge_summary=""):
+    cad_rules.ensure_cad_rules()
+    text = case_text + ("\n" + discharge_summary if discharge_summary else "")
+    candidates = get_candidate_matcher().find(text)
+    return {
+        "candidates": candidates,
+        "has_cad_candidate": any(is_cad_candidate(c["code"]) for c in candidates)
+    }
+
+# 附在使用者訊息後的精簡清單
+def format_candidates(candidates):
+    if not candidates:
+        return ""
+    lines = [f"{c['code']} {c['name']}（病歷：{c['term']}）" for c in candidates]
+    return "【本地比對候選碼】（僅供參考，仍須依臨床事件判斷，可增刪）\n" + "\n".join(lines)
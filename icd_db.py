@@ -1,23 +1,53 @@
 # common/icd_db.py
-import pandas as pd
 import os
+import threading
 from config import Config
+from .icd_snapshot import IcdSnapshot
 
 icd_dict = {}
 
+_loaded = False
+_load_lock = threading.Lock()
+
+# 快照存在且比 CSV 新 → 直接 mmap（多個 worker 共用 page cache）
+def snapshot_is_fresh():
+    path = Config.ICD_SNAPSHOT_PATH
+    if not path or not os.path.exists(path):
+        return False
+    if not os.path.exists(Config.ICD_CSV_PATH):
+        return True
+    return os.path.getmtime(path) >= os.path.getmtime(Config.ICD_CSV_PATH)
+
 def load_icd_db():
-    global icd_dict
+    global icd_dict, _loaded
+    if snapshot_is_fresh():
+        icd_dict = IcdSnapshot(Config.ICD_SNAPSHOT_PATH)
+        _loaded = True
+        print(f"ICD DB 載入完成（快照），共 {len(icd_dict)} 筆")
+        return
+    
     if not os.path.exists(Config.ICD_CSV_PATH):
         raise FileNotFoundError(f"找不到 ICD_code.csv：{Config.ICD_CSV_PATH}")
     
+    import pandas as pd  # 只有讀 CSV 時才需要 pandas
+    
     df = pd.read_csv(Config.ICD_CSV_PATH, encoding='utf-8')
+    entries = {}
     for _, row in df.iterrows():
         code = str(row['疾病代碼']).strip()
         if code != 'nan':
-            icd_dict[code] = {
+            entries[code] = {
                 'english': str(row.get('CM 英文名稱(2023)', '')),
                 'chinese': str(row.get('CM 中文名稱(2023)', ''))
             }
-    print(f"ICD DB 載入完成，共 {len(icd_dict)} 筆")
+    icd_dict = entries
+    _loaded = True
+    print(f"ICD DB 載入完成，共 {len(icd_dict)} 筆（可執行 python -m common.icd_snapshot 建立快照加速）")
 
-load_icd_db()  # 啟動時自動載入
\ No newline at end of file
+# 取得 ICD 對照表；app 啟動時沒有預先載入的話，第一次使用才載入
+def get_icd_dict():
+    if not _loaded:
+        with _load_lock:
+            if not _loaded:
+                load_icd_db()
+    return icd_dict
\ No newline at end of file
@@ -0,0 +1,213 @@
+# common/icd_index.py
+# ICD 搜尋索引：第一次搜尋時建立（約 0.3 秒、70 MB），之後查詢只需數毫秒
+#   代碼：排序好的代碼陣列，二分搜尋取前綴範圍（I50. → I50 開頭全部）
+#   英文：單字 → 病名的倒排索引；最後一個字可只打前綴（fail → failure）
+#   中文：單一字元 → 病名的索引，再以連續子字串 / 雙字詞比對排序（心衰 → 心臟衰竭）
+# 倒排串列依病名長度排序，取前 N 名時可提早結束，常見字也不必掃完整個串列
+import bisect
+import heapq
+import re
+import sys
+import threading
+from array import array
+from . import icd_db
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+CJK_RE = re.compile(r"[\u3400-\u9fff]")
+CODE_QUERY_RE = re.compile(r"^[A-Za-z]\d[0-9A-Za-z.]*$|^[A-Za-z]$")
+
+def _clean(value):
+    value = (value or '').strip()
+    return '' if value == 'nan' else value
+
+def display_code(code_nodot):
+    return code_nodot[:3] + '.' + code_nodot[3:] if len(code_nodot) > 3 else code_nodot
+
+# 從多個已排序串列依序取出不重複的編號
+def _merge_unique(postings):
+    last = None
+    for value in heapq.merge(*postings):
+        if value != last:
+            yield value
+            last = value
+
+class _TopK:
+    # 保留分數最高的 limit 筆
+    def __init__(self, limit):
+        self.limit = limit
+        self.heap = []
+    
+    def full(self):
+        return len(self.heap) >= self.limit
+    
+    def worst(self):
+        return self.heap[0][0]
+    
+    def push(self, score, i, tie):
+        item = (score, tie, i)
+        if len(self.heap) < self.limit:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+    
+    def ranked(self):
+        return [(score, i) for score, _, i in sorted(self.heap, reverse=True)]
+
+class IcdIndex:
+    def __init__(self, icd_dict):
+        entries = sorted(((code.upper(), entry) for code, entry in icd_dict.items()), key=lambda e: e[0])
+        self.codes = [code for code, _ in entries]
+        self.english = [_clean(entry.get('english')) for _, entry in entries]
+        self.chinese = [_clean(entry.get('chinese')) for _, entry in entries]
+        self.tokens = [tuple(sys.intern(t) for t in TOKEN_RE.findall(name.lower())) for name in self.english]
+        
+        # 倒排串列存「名稱由短到長」的名次，查詢時先看到的就是較佳結果，可提早結束
+        self.english_order = array('I', sorted(range(len(entries)), key=lambda i: (len(self.tokens[i]), self.codes[i])))
+        self.chinese_order = array('I', sorted(range(len(entries)), key=lambda i: (len(self.chinese[i]), self.codes[i])))
+        
+        english_postings = {}
+        for rank, i in enumerate(self.english_order):
+            for token in set(self.tokens[i]):
+                english_postings.setdefault(token, []).append(rank)
+        chinese_postings = {}
+        for rank, i in enumerate(self.chinese_order):
+            for char in set(self.chinese[i]) - {' '}:
+                chinese_postings.setdefault(char, []).append(rank)
+        
+        # array('I') 比 list[int] 省很多記憶體
+        self.english_postings = {k: array('I', v) for k, v in english_postings.items()}
+        self.chinese_postings = {k: array('I', v) for k, v in chinese_postings.items()}
+        self.vocabulary = sorted(self.english_postings)
+    
+    def _item(self, i, score):
+        return {
+            "code": display_code(self.codes[i]),
+            "english": self.english[i],
+            "chinese": self.chinese[i],
+            "score": round(score, 4)
+        }
+    
+    # 代碼前綴：I50. / I5020 / i50
+    def search_code(self, query, limit):
+        prefix = query.upper().replace('.', '')
+        start = bisect.bisect_left(self.codes, prefix)
+        end = bisect.bisect_left(self.codes, prefix + '\uffff')
+        hits = range(start, min(end, start + limit * 20))
+        # 完全相同 > 較短（上層碼）> 代碼順序
+        ranked = sorted(hits, key=lambda i: (self.codes[i] != prefix, len(self.codes[i]), self.codes[i]))
+        return [self._item(i, 1.0 if self.codes[i] == prefix else len(prefix) / len(self.codes[i])) for i in ranked[:limit]]
+    
+    # 英文：前面的字需完全相同，最後一個字可為前綴
+    def search_english(self, query, limit):
+        tokens = TOKEN_RE.findall(query.lower())
+        if not tokens:
+            return []
+        complete = tokens if query[-1:].isspace() else tokens[:-1]
+        last_prefix = None if query[-1:].isspace() else tokens[-1]
+        
+        for token in complete:
+            if token not in self.english_postings:
+                return []
+        
+        # 從最短的倒排串列開始，其他條件再逐筆驗證
+        sources = [self.english_postings[t] for t in complete]
+        base = min(sources, key=len) if sources else None
+        if last_prefix:
+            start = bisect.bisect_left(self.vocabulary, last_prefix)
+            end = bisect.bisect_left(self.vocabulary, last_prefix + '\uffff')
+            prefix_postings = [self.english_postings[t] for t in self.vocabulary[start:end]]
+            if not prefix_postings:
+                return []
+            if base is None or sum(map(len, prefix_postings)) < len(base):
+                base = _merge_unique(prefix_postings)
+        
+        matched = len(complete) + (1 if last_prefix else 0)
+        top = _TopK(limit)
+        for rank in base:
+            i = self.english_order[rank]
+            name_tokens = self.tokens[i]
+            if not name_tokens:
+                continue
+            # 命中字數佔病名比例越高越前面；名稱越來越長，分數已不超過第 limit 名（同分時先出現者優先）→ 結束
+            score = matched / len(name_tokens)
+            if top.full() and score <= top.worst():
+                break
+            if any(t not in name_tokens for t in complete):
+                continue
+            if last_prefix and not any(t.startswith(last_prefix) for t in name_tokens):
+                continue
+            top.push(score, i, -rank)
+        
+        return [self._item(i, score) for score, i in top.ranked()]
+    
+    # 中文：所有字都要出現；整串連續出現 > 雙字詞命中多 > 病名短
+    def search_chinese(self, query, limit):
+        phrase = ''.join(query.split())
+        chars = set(phrase)
+        if not chars:
+            return []
+        for char in chars:
+            if char not in self.chinese_postings:
+                return []
+        
+        base = min((self.chinese_postings[c] for c in chars), key=len)
+        bigrams = [phrase[k:k + 2] for k in range(len(phrase) - 1)]
+        
+        top = _TopK(limit)
+        for rank in base:
+            i = self.chinese_order[rank]
+            name = self.chinese[i]
+            if top.full() and len(phrase) / len(name) + 1.0 <= top.worst():
+                break
+            if any(c not in name for c in chars):
+                continue
+            score = len(phrase) / len(name)
+            if phrase in name:
+                score += 1.0
+            elif bigrams:
+                score += 0.5 * sum(1 for b in bigrams if b in name) / len(bigrams)
+            top.push(score, i, -rank)
+        
+        return [self._item(i, score) for score, i in top.ranked()]
+    
+    # 依查詢字串自動判斷：含中文 → 中文；像代碼 → 代碼前綴；其他 → 英文
+    def search(self, query, limit=20):
+        stripped = query.strip()
+        if not stripped:
+            return []
+        if CJK_RE.search(stripped):
+            return self.search_chinese(stripped, limit)
+        if CODE_QUERY_RE.match(stripped):
+            return self.search_code(stripped, limit)
+        return self.search_english(query, limit)
+        
+    # 批次查詢代碼（有沒有點都可以）
+    def lookup(self, codes):
+        results = []
+        for raw in codes:
+            code = str(raw).strip().upper().replace('.', '')
+            k = bisect.bisect_left(self.codes, code)
+            if code and k < len(self.codes) and self.codes[k] == code:
+                item = self._item(k, 1.0)
+                item.pop("score")
+                item["found"] = True
+            else:
+                item = {"code": display_code(code), "english": "", "chinese": "", "found": False}
+            item["query"] = raw
+            results.append(item)
+        return results
+
+_index = None
+_index_source = None
+_index_lock = threading.Lock()
+
+# 取得索引：第一次搜尋才建立（不在 preload 時建，免得每個 worker 都把整份快照展開成 Python 物件）；ICD 表重新載入後自動重建
+def get_icd_index():
+    global _index, _index_source
+    source = icd_db.get_icd_dict()
+    if _index is None or _index_source is not source:
+        with _index_lock:
+            if _index is None or _index_source is not source:
+                _index = IcdIndex(source)
+                _index_source = source
+    return _index
@@ -1,14 +1,23 @@
 # tasks/icd_recommend.py
-from flask import Blueprint, request, jsonify
-from common.azure_client import get_client_and_deployment
-from common.cad_rules import CAD_MAIN_CODES, CAD_UNSTABLE_CODES, COMPLEX_SECONDARY_CODES
-from common.utils import post_process_icd_with_cad
-import os
-import json
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from common.azure_client import get_client_and_deployment, get_stats as get_azure_stats
+from common.cad_rules import CAD_MAIN_CODES, ensure_cad_rules, check_icd_result, rule_check_note
+from common.utils import post_process_icd_with_cad, IcdPostProcessor, sse_event, parse_icd_result
+from common.prompt_store import get_prompt_store, request_namespace
+from common.llm_cache import llm_cache
+from common.icd_candidates import extract_candidates, format_candidates
+from common.chunking import chunk_text, needs_chunking, iter_map, map_chunks, join_chunk_notes
+from common.doc_buffers import read_upload_text
+from common.text_cache import text_cache
+from common.near_dup import near_dup_index, context_key
+from common.session_store import get_session_store
+from common import metrics
+from config import Config
+import time
 
 icd_bp = Blueprint('icd', __name__)
 
-CAD_ANALYSIS_PROMPT = f"""
+CAD_ANALYSIS_PROMPT = """
 你是一位心臟內科主治醫師，正在協助醫院內部 DRG 品質審查計畫。
 你的任務是從病歷中重建臨床事件，並嚴謹判斷本次住院是否以冠狀動脈疾病（CAD）為主診斷，以及是否符合複雜型標準。
 
@@ -51,7 +60,7 @@ CAD_ANALYSIS_PROMPT = f"""
 
 支持性證據（引用） 
 
-[step3]生成建議 DRG 組 (參考:{', '.join(sorted(CAD_MAIN_CODES))}) 
+[step3]生成建議 DRG 組 (參考:{cad_main_codes}) 
 
 使用以下邏輯，建議一個 DRG 群組內部審查：
 
@@ -86,31 +95,14 @@ CAD_ANALYSIS_PROMPT = f"""
 - 原因必須直接來自事件，不能推測
 """
 
-# 儲存 Prompt（上限 20 個）
-# 1. 指定您想要的資料夾路徑
-SAVE_DIR = r"C:\Users\482525\Prompt_File"
-# 2. 指定完整檔案路徑
-PROMPT_FILE = os.path.join(SAVE_DIR, 'saved_icd_prompts.json')
+# CAD 規則載入後才填入主診斷碼（避免 import 時就讀 CSV）
+def get_cad_analysis_prompt():
+    ensure_cad_rules()
+    return CAD_ANALYSIS_PROMPT.replace("{cad_main_codes}", ', '.join(sorted(CAD_MAIN_CODES)))
 
-def load_from_file():
-    # 如果檔案夾或檔案不存在，回傳空列表
-    if os.path.exists(PROMPT_FILE):
-        try:
-            with open(PROMPT_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"讀取錯誤: {e}")
-            return []
-    return []
-
-def save_to_file(prompts):
-    # 自動檢查資料夾是否存在，不存在就建立它
-    if not os.path.exists(SAVE_DIR):
-        os.makedirs(SAVE_DIR)
-        
-    with open(PROMPT_FILE, 'w', encoding='utf-8') as f:
-        # ensure_ascii=False 確保中文字不會變成編碼，indent=4 讓格式好看
-        json.dump(prompts, f, ensure_ascii=False, indent=4)
+CUSTOM_PROMPT_LABEL = "【使用者補充指示】（與上述規則衝突時，以此為準）"
+
+# 儲存 Prompt（SQLite，common/prompt_store.py，依使用者分開，各保留最新 10 個）
 
 # 儲存 ICD Prompt
 @icd_bp.route('/save_icd_prompt', methods=['POST'])
@@ -122,85 +114,502 @@ def save_icd_prompt():
     if not prompt:
         return jsonify({"error": "Prompt 內容不可為空"}), 400
     
-    # 讀取現有
-    prompts = []
-    if os.path.exists(PROMPT_FILE):
-        with open(PROMPT_FILE, 'r', encoding='utf-8') as f:
-            prompts = json.load(f)
-    
-    # 移除同名（避免重複）
-    prompts = [p for p in prompts if p['name'] != name]
-    
-    # 新增
-    prompts.append({"name": name, "prompt": prompt})
-    
-    # 上限 10 個
-    if len(prompts) > 10:
-        prompts = prompts[-10:]
-    
-    # 寫回
-    with open(PROMPT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(prompts, f, ensure_ascii=False, indent=2)
+    # 同名覆蓋、超過上限刪最舊的，都在同一個交易內完成
+    get_prompt_store().save("icd", request_namespace(request, data), name, prompt)
     
     return jsonify({"success": True})
 
 # 載入 ICD Prompt 列表
 @icd_bp.route('/load_icd_prompts')
 def load_icd_prompts():
-    if os.path.exists(PROMPT_FILE):
-        with open(PROMPT_FILE, 'r', encoding='utf-8') as f:
-            prompts = json.load(f)
-    else:
-        prompts = []
+    prompts = get_prompt_store().list("icd", request_namespace(request))
     return jsonify({"prompts": prompts})
 
-@icd_bp.route('/generate_icd', methods=['POST'])
-def generate_icd():
-    if request.json is None:
-        return jsonify({"error": "無效的 JSON 資料"}), 400
+# 組合送給 LLM 的訊息：固定的 CAD prompt 永遠是第一則，後面才放每次不同的內容
+# （自訂指示另成一則 system 訊息；前綴逐字相同，上游 prompt 快取與追問都接得上）
+# prefilter：extract_candidates 的結果（呼叫端已算過就傳進來，避免重算）
+def build_icd_messages(case_text, discharge_summary="", custom_prompt="", prefilter=None):
+    full_input = f"【病例文字】\n{case_text}"
+    if discharge_summary:
+        full_input += f"\n\n【出院摘要】\n{discharge_summary}"
     
-    data = request.json
+    if Config.ICD_CANDIDATES_IN_PROMPT:
+        if prefilter is None:
+            prefilter = extract_candidates(case_text, discharge_summary)
+        candidate_block = format_candidates(prefilter["candidates"])
+        if candidate_block:
+            full_input += f"\n\n{candidate_block}"
+    
+    messages = [{"role": "system", "content": get_cad_analysis_prompt()}]  # 你的 CAD Prompt
+    if custom_prompt:
+        messages.append({"role": "system", "content": f"{CUSTOM_PROMPT_LABEL}\n{custom_prompt}"})
+    messages.append({"role": "user", "content": full_input})
+    return messages
+
+# ICD 分析固定參數（temperature=0 → 相同輸入可直接重用快取結果）
+ICD_SAMPLING = {"temperature": 0.0, "max_tokens": 1500}
+
+def icd_cache_key(deployment, messages, sampling=ICD_SAMPLING):
+    if not Config.LLM_CACHE_ENABLED:
+        return None
+    return llm_cache.make_key(deployment, messages, **sampling)
+
+# 呼叫 LLM（先查快取），回傳 (原始輸出, 是否命中快取)
+def run_icd_completion(messages, sampling=ICD_SAMPLING):
+    client, deployment = get_client_and_deployment()
+    
+    cache_key = icd_cache_key(deployment, messages, sampling)
+    if cache_key:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached, True
     
+    response = client.chat.completions.create(
+        model=deployment,
+        messages=messages,
+        **sampling
+    )
+    
+    llm_output = response.choices[0].message.content.strip()
+    if cache_key:
+        llm_cache.set(cache_key, llm_output)
+    return llm_output, False
+
+# ============ 長病歷：分段擷取重點（map），再用精簡後的重點做 CAD 分析（reduce） ============
+ICD_EXTRACT_PROMPT = """
+你是一位心臟內科主治醫師，正在協助 DRG 品質審查。以下是一份長病歷的第 {index}/{total} 段。
+請只擷取與診斷及 DRG 判斷有關的臨床事件，條列輸出（每點 40 字內，保留日期與數值）：
+- 症狀與主訴
+- 心電圖、心肌酵素、影像等檢查發現
+- 處置（PCI、靜脈利尿劑、氧氣、正性肌力藥物、IABP、呼吸器…）
+- 醫師記載的診斷
+不要推論、不要下結論；本段沒有相關內容就輸出「無」。
+"""
+
+ICD_EXTRACT_SAMPLING = {"temperature": 0.0, "max_tokens": 600}
+CASE_NOTES_LABEL = "病歷第 {index}/{total} 段重點"
+
+def extract_case_chunk(chunk, index, total):
+    messages = [
+        {"role": "system", "content": ICD_EXTRACT_PROMPT.replace("{index}", str(index + 1)).replace("{total}", str(total))},
+        {"role": "user", "content": chunk}
+    ]
+    return run_icd_completion(messages, ICD_EXTRACT_SAMPLING)[0]
+
+# 回傳 (送給 CAD 分析的病例文字, 區塊數)；短病歷原樣回傳
+def condense_case_text(case_text):
+    if not needs_chunking(case_text):
+        return case_text, 1
+    chunks = chunk_text(case_text)
+    with metrics.stage("chunk_map"):
+        notes = map_chunks(extract_case_chunk, chunks)
+    return join_chunk_notes(notes, CASE_NOTES_LABEL), len(chunks)
+
+# ============ 近似重複病例：同一次住院小幅修改後重送，沿用 / 附上先前的分析 ============
+# 回傳 (probe, match)；probe 給 remember_analysis 用（避免重算簽章），match 為 None 或 {"similarity", "value"}
+def find_near_duplicate(case_text, discharge_summary="", custom_prompt=""):
+    if not Config.NEAR_DUP_ENABLED:
+        return None, None
+    text = f"{case_text}\n{discharge_summary}"
+    context = context_key(prompt=custom_prompt, deployment=Config.DEPLOYMENT)
+    with metrics.stage("near_dup"):
+        signature = near_dup_index.signature(text)
+        match = near_dup_index.query(text, context, Config.NEAR_DUP_SHOW_THRESHOLD, signature)
+    return (text, context, signature), match
+
+def should_reuse(match):
+    return bool(match) and Config.NEAR_DUP_REUSE and match["similarity"] >= Config.NEAR_DUP_REUSE_THRESHOLD
+
+# 完全相同（相似度 1）的已經在索引裡，不重複加入
+def remember_analysis(probe, match, llm_output, case_id=""):
+    if probe is None or (match and match["similarity"] >= 1.0):
+        return
+    text, context, signature = probe
+    near_dup_index.add(text, {"llm_output": llm_output, "case_id": case_id, "analysed_at": time.time()}, context, signature)
+
+# 回應中的 near_duplicate 欄位：相似度與先前的分析結果
+#   先前的結果與這次相同（沿用、或內容完全一樣）時不再重複附上 answer；lean 只回比對到的病例與相似度
+def near_duplicate_info(match, reused, llm_output, lean=False):
+    if not match:
+        return None
+    value = match["value"]
+    if lean:
+        return {"case_id": value["case_id"], "similarity": match["similarity"]}
+    info = {
+        "similarity": match["similarity"],
+        "reused": reused,
+        "case_id": value["case_id"],
+        "analysed_at": value["analysed_at"]
+    }
+    if not reused and value["llm_output"] != llm_output:
+        info["answer"] = post_process_icd_with_cad(value["llm_output"])
+    return info
+
+def near_duplicate_note(match):
+    return f"【近似病例】與先前分析的病歷相似度 {match['similarity']:.0%}，沿用先前結果（未重新呼叫模型）"
+
+# ============ 對話 session：首輪分析的訊息留在伺服器，追問（/refine_icd）只送新問題 ============
+# 請求選項：JSON / 表單欄位或網址參數
+def request_option(name):
+    data = request.form if request.files else (request.get_json(silent=True) or {})
+    return data.get(name, request.args.get(name))
+
+def is_true(value):
+    return value is True or str(value).lower() in ("1", "true", "yes")
+
+# 回應要保留的欄位：None 表示全部（history 另外看 include_history）
+#   fields=answer,rule_check（或 JSON 陣列）只回列出的欄位；lean=true 只回結構化結果
+LEAN_FIELDS = ("result", "rule_check", "session_id", "cached", "near_duplicate")
+
+def is_lean():
+    return is_true(request_option('lean'))
+
+# fields 格式不對（例：數字、物件）丟 ValueError，由各路由回 400
+def response_fields():
+    value = request_option('fields')
+    if isinstance(value, str):
+        value = value.split(',')
+    if value is not None and not (isinstance(value, list) and all(isinstance(name, str) for name in value)):
+        raise ValueError("fields 必須是以逗號分隔的字串或字串陣列")
+    names = {name.strip() for name in value or () if name.strip()}
+    if names:
+        return names
+    if is_lean():
+        return set(LEAN_FIELDS)
+    return None
+
+# 回應是否附上完整 history（舊版行為）；預設只回 session_id
+def wants_history(fields):
+    return Config.ICD_RETURN_HISTORY or is_true(request_option('include_history')) or (fields is not None and "history" in fields)
+
+# 依 response_fields / wants_history 篩選回應欄位
+def select_fields(result, fields, include_history):
+    return {
+        key: value for key, value in result.items()
+        if (key == "history" and include_history) or (key != "history" and (fields is None or key in fields))
+    }
+
+# 存下固定 CAD prompt 之後的訊息與模型回答；未啟用 session 時回傳 None
+def save_session(messages, llm_output, custom_prompt="", document_key=None):
+    store = get_session_store()
+    if store is None:
+        return None
+    return store.create({
+        "messages": messages[1:] + [{"role": "assistant", "content": llm_output}],
+        "base_messages": len(messages),
+        "turns": 0,
+        "template": "custom" if custom_prompt else "default",
+        "document_key": document_key
+    })
+
+# session 內的訊息接回固定 CAD prompt（與首輪逐字相同）
+def session_messages(session):
+    return [{"role": "system", "content": get_cad_analysis_prompt()}] + session["messages"]
+
+# 追加一輪問答；追問超過 SESSION_MAX_TURNS 輪時丟掉最舊的追問，首輪分析一定保留
+def append_turn(session, question, answer):
+    base = session["base_messages"]
+    turns = session["messages"][base:] + [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+    session["messages"] = session["messages"][:base] + turns[-2 * Config.SESSION_MAX_TURNS:]
+    session["turns"] += 1
+
+# 讀取前端送來的欄位
+def parse_icd_request(data):
     # 關鍵修正：欄位名稱改成前端新 ID
     case_text = data.get('case_text', '').strip()
     discharge_summary = data.get('discharge', '').strip()
     custom_prompt = (data.get('prompt') or '').strip()
+    metrics.bind(template="custom" if custom_prompt else "default")
+    return case_text, discharge_summary, custom_prompt
+
+# JSON，或 multipart 表單（同樣欄位）加上傳病歷檔 file（.pdf / .docx，pages 指定 PDF 頁碼）
+# 檔案文字接在 case_text 後面；回傳 (case_text, discharge, prompt, document_key)，沒有上傳檔時 document_key 為 None
+# 輸入有誤丟 ValueError
+def read_icd_request():
+    if request.files:
+        case_text, discharge_summary, custom_prompt = parse_icd_request(request.form)
+        document_key = None
+        upload = request.files.get('file')
+        if upload and upload.filename:
+            try:
+                file_text, document_key = read_upload_text(upload, request.form.get('pages', '').strip())
+            except ValueError:
+                raise
+            except Exception:
+                raise ValueError("讀取上傳檔案失敗")
+            file_text = file_text.strip()
+            case_text = f"{case_text}\n{file_text}" if case_text else file_text
+        return case_text, discharge_summary, custom_prompt, document_key
+        
+    data = request.get_json(silent=True)
+    if data is None:
+        raise ValueError("無效的 JSON 資料")
+    return parse_icd_request(data) + (None,)
+
+@icd_bp.route('/generate_icd', methods=['POST'])
+def generate_icd():
+    try:
+        case_text, discharge_summary, custom_prompt, document_key = read_icd_request()
+        fields = response_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     if not case_text:
         return jsonify({"error": "請輸入病例文字"}), 400
     
     try:
-        full_input = f"【病例文字】\n{case_text}"
-        if discharge_summary:
-            full_input += f"\n\n【出院摘要】\n{discharge_summary}"
+        # 候選碼用完整原文比對（本地、很快）；送 LLM 的病例文字太長時先分段擷取
+        with metrics.stage("prefilter"):
+            prefilter = extract_candidates(case_text, discharge_summary)
+        probe, match = find_near_duplicate(case_text, discharge_summary, custom_prompt)
+        reused = should_reuse(match)
+        if reused:
+            # 近似重複且相似度夠高：沿用先前結果，不分段、不呼叫上游
+            with metrics.stage("build_prompt"):
+                messages = build_icd_messages(case_text, discharge_summary, custom_prompt, prefilter)
+            llm_output, cached, chunk_count = match["value"]["llm_output"], True, 1
+        else:
+            condensed_text, chunk_count = condense_case_text(case_text)
+            with metrics.stage("build_prompt"):
+                messages = build_icd_messages(condensed_text, discharge_summary, custom_prompt, prefilter)
+            llm_output, cached = run_icd_completion(messages)
+            remember_analysis(probe, match, llm_output)
         
-        system_prompt = CAD_ANALYSIS_PROMPT  # 你的 CAD Prompt
-        if custom_prompt:
-            system_prompt = f"{custom_prompt}\n\n{system_prompt}"
+        with metrics.stage("postprocess"):
+            # 命中快取也要重跑後處理，icd_dict 名稱更新才會套用
+            final_output = post_process_icd_with_cad(llm_output)
+            
+            # 本地規則核對 DRG / RW，不一致時附註，不必再問一次模型
+            parsed = parse_icd_result(llm_output)
+            rule_check = check_icd_result(parsed)
+        note = rule_check_note(rule_check)
+        if note:
+            final_output += "\n\n" + note
+        if reused:
+            final_output += "\n\n" + near_duplicate_note(match)
         
-        client, deployment = get_client_and_deployment()
+        return jsonify(select_fields({
+            "answer": final_output,
+            "result": parsed,
+            "session_id": save_session(messages, llm_output, custom_prompt, document_key),
+            "cached": cached,
+            "rule_check": rule_check,
+            "prefilter": prefilter,
+            "chunks": chunk_count,
+            "document_key": document_key,
+            "near_duplicate": near_duplicate_info(match, reused, llm_output, is_lean()),
+            "history": messages + [{"role": "assistant", "content": llm_output}]
+        }, fields, wants_history(fields)))
         
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": full_input}
-        ]
+    except Exception as e:
+        metrics.count_error("request", e)
+        return jsonify({"error": f"處理失敗：{str(e)}"}), 500
+
+# 串流版：token 一到就以 SSE 推給前端，每湊滿一行即替換 ICD 中英文名稱
+# 事件：progress（長病歷分段擷取進度）、token（原始片段）、lines（已處理完成的行）、done（完整結果，格式同 /generate_icd）、error
+@icd_bp.route('/generate_icd_stream', methods=['POST'])
+def generate_icd_stream():
+    try:
+        case_text, discharge_summary, custom_prompt, document_key = read_icd_request()
+        fields = response_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if not case_text:
+        return jsonify({"error": "請輸入病例文字"}), 400
+    
+    with metrics.stage("prefilter"):
+        prefilter = extract_candidates(case_text, discharge_summary)
+    probe, match = find_near_duplicate(case_text, discharge_summary, custom_prompt)
+    reused = should_reuse(match)
+    include_history = wants_history(fields)
+    lean = is_lean()
+    
+    def generate():
+        try:
+            client, deployment = get_client_and_deployment()
+            
+            # 長病歷：各段平行擷取，每完成一段送一次 progress（沿用近似病例結果時不必）
+            condensed_text = case_text
+            chunk_count = 1
+            if needs_chunking(case_text) and not reused:
+                chunks = chunk_text(case_text)
+                chunk_count = len(chunks)
+                notes = [None] * chunk_count
+                with metrics.stage("chunk_map"):
+                    for completed, (index, note) in enumerate(iter_map(extract_case_chunk, chunks), 1):
+                        notes[index] = note
+                        yield sse_event("progress", {"stage": "map", "completed": completed, "total": chunk_count})
+                condensed_text = join_chunk_notes(notes, CASE_NOTES_LABEL)
+            
+            with metrics.stage("build_prompt"):
+                messages = build_icd_messages(condensed_text, discharge_summary, custom_prompt, prefilter)
+            
+            # 沿用近似病例或命中快取：整段一次送出，不呼叫上游（沿用時不查快取，免得多算一次 miss）
+            if reused:
+                cache_key, cached = None, match["value"]["llm_output"]
+            else:
+                cache_key = icd_cache_key(deployment, messages)
+                cached = llm_cache.get(cache_key) if cache_key else None
+            
+            if cached is not None:
+                stream_tokens = [cached]
+            else:
+                stream = client.chat.completions.create(
+                    model=deployment,
+                    messages=messages,
+                    stream=True,
+                    **ICD_SAMPLING
+                )
+                # Azure 第一個 chunk 可能只有內容過濾結果，沒有 choices
+                stream_tokens = (
+                    chunk.choices[0].delta.content
+                    for chunk in stream if chunk.choices
+                )
+            
+            # 逐行後處理穿插在串流中，累計本地處理的時間
+            processor = IcdPostProcessor()
+            postprocess_seconds = 0.0
+            chunks = []
+            answer_lines = []
+            for token in stream_tokens:
+                if not token:
+                    continue
+                
+                chunks.append(token)
+                yield sse_event("token", {"text": token})
+                
+                started = time.perf_counter()
+                lines = processor.feed(token)
+                postprocess_seconds += time.perf_counter() - started
+                if lines:
+                    answer_lines.extend(lines)
+                    yield sse_event("lines", {"lines": lines})
+            
+            started = time.perf_counter()
+            lines = processor.flush()
+            postprocess_seconds += time.perf_counter() - started
+            if lines:
+                answer_lines.extend(lines)
+                yield sse_event("lines", {"lines": lines})
+            
+            llm_output = "".join(chunks).strip()
+            
+            started = time.perf_counter()
+            parsed = parse_icd_result(llm_output)
+            rule_check = check_icd_result(parsed)
+            metrics.observe_stage("postprocess", postprocess_seconds + time.perf_counter() - started)
+            note = rule_check_note(rule_check)
+            if note:
+                lines = ["", note]
+                answer_lines.extend(lines)
+                yield sse_event("lines", {"lines": lines})
+            if reused:
+                lines = ["", near_duplicate_note(match)]
+                answer_lines.extend(lines)
+                yield sse_event("lines", {"lines": lines})
+            
+            if cache_key and cached is None:
+                llm_cache.set(cache_key, llm_output)
+            if not reused:
+                remember_analysis(probe, match, llm_output)
+            
+            yield sse_event("done", select_fields({
+                "answer": "\n".join(answer_lines),
+                "result": parsed,
+                "session_id": save_session(messages, llm_output, custom_prompt, document_key),
+                "cached": cached is not None,
+                "rule_check": rule_check,
+                "prefilter": prefilter,
+                "chunks": chunk_count,
+                "document_key": document_key,
+                "near_duplicate": near_duplicate_info(match, reused, llm_output, lean),
+                "history": messages + [{"role": "assistant", "content": llm_output}]
+            }, fields, include_history))
         
-        response = client.chat.completions.create(
-            model=deployment,
-            messages=messages,
-            temperature=0.0,
-            max_tokens=1500
-        )
+        except Exception as e:
+            metrics.count_error("request", e)
+            yield sse_event("error", {"error": f"處理失敗：{str(e)}"})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# 追問：沿用 session 內的病歷與先前的回答，只送新問題
+# 輸入 JSON {session_id, question}；回傳 answer、session_id、turns（已追問次數）、cached
+@icd_bp.route('/refine_icd', methods=['POST'])
+def refine_icd():
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({"error": "無效的 JSON 資料"}), 400
+    
+    session_id = (data.get('session_id') or '').strip()
+    question = (data.get('question') or '').strip()
+    if not session_id or not question:
+        return jsonify({"error": "session_id 與 question 必填"}), 400
+    try:
+        fields = response_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    store = get_session_store()
+    if store is None:
+        return jsonify({"error": "未啟用對話 session（Config.SESSIONS_ENABLED）"}), 404
+    session = store.get(session_id)
+    if session is None:
+        return jsonify({"error": "對話不存在或已過期，請重新分析"}), 404
+    metrics.bind(template=session["template"])
+    
+    try:
+        with metrics.stage("build_prompt"):
+            messages = session_messages(session) + [{"role": "user", "content": question}]
+        llm_output, cached = run_icd_completion(messages)
         
-        llm_output = response.choices[0].message.content.strip()
-        final_output = post_process_icd_with_cad(llm_output)
+        session = store.update(session_id, lambda s: append_turn(s, question, llm_output))
+        if session is None:
+            return jsonify({"error": "對話不存在或已過期，請重新分析"}), 404
         
-        history = messages + [{"role": "assistant", "content": llm_output}]
+        with metrics.stage("postprocess"):
+            answer = post_process_icd_with_cad(llm_output)
+            parsed = parse_icd_result(llm_output)
         
-        return jsonify({
-            "answer": final_output,
-            "history": history
-        })
+        return jsonify(select_fields({
+            "answer": answer,
+            "result": parsed,
+            "session_id": session_id,
+            "turns": session["turns"],
+            "cached": cached,
+            "history": messages + [{"role": "assistant", "content": llm_output}]
+        }, fields, wants_history(fields)))
         
     except Exception as e:
-        return jsonify({"error": f"處理失敗：{str(e)}"}), 500
\ No newline at end of file
+        metrics.count_error("request", e)
+        return jsonify({"error": f"處理失敗：{str(e)}"}), 500
+
+# 對話 session 筆數
+@icd_bp.route('/icd_session_stats')
+def icd_session_stats():
+    store = get_session_store()
+    return jsonify(store.get_stats() if store is not None else {"sessions": 0, "enabled": False})
+
+# 快取命中率 / 筆數
+@icd_bp.route('/icd_cache_stats')
+def icd_cache_stats():
+    return jsonify(llm_cache.get_stats())
+
+# Azure 呼叫統計：重試 / 429 / 限流等待
+@icd_bp.route('/azure_stats')
+def azure_stats():
+    return jsonify(get_azure_stats())
+
+# 上傳文件文字快取統計
+@icd_bp.route('/text_cache_stats')
+def text_cache_stats():
+    return jsonify(text_cache.get_stats())
+
+# 近似重複病例索引統計
+@icd_bp.route('/near_dup_stats')
+def near_dup_stats():
+    return jsonify(near_dup_index.get_stats())
\ No newline at end of file
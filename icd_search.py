@@ -0,0 +1,48 @@
+# tasks/icd_search.py
+from flask import Blueprint, request, jsonify
+from common.icd_index import get_icd_index
+from common.icd_candidates import extract_candidates
+import time
+
+icd_search_bp = Blueprint('icd_search', __name__)
+
+MAX_LIMIT = 100
+MAX_LOOKUP_CODES = 1000
+
+# 搜尋：/icd/search?q=心衰 、?q=systolic heart fail 、?q=I50.
+@icd_search_bp.route('/icd/search')
+def icd_search():
+    query = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit 必須為整數"}), 400
+    
+    started = time.perf_counter()
+    results = get_icd_index().search(query, limit)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    return jsonify({"query": query, "results": results, "elapsed_ms": round(elapsed_ms, 3)})
+
+# 批次查詢代碼：{"codes": ["I25.110", "I5020", ...]}
+@icd_search_bp.route('/icd/lookup', methods=['POST'])
+def icd_lookup():
+    data = request.json
+    if data is None or not isinstance(data.get('codes'), list):
+        return jsonify({"error": "請提供 codes 陣列"}), 400
+    if len(data['codes']) > MAX_LOOKUP_CODES:
+        return jsonify({"error": f"一次最多查詢 {MAX_LOOKUP_CODES} 個代碼"}), 400
+    
+    return jsonify({"results": get_icd_index().lookup(data['codes'])})
+
+# 本地候選碼比對（不呼叫 LLM）：{"case_text": "...", "discharge": "..."}
+@icd_search_bp.route('/icd/candidates', methods=['POST'])
+def icd_candidates():
+    data = request.json
+    if data is None or not (data.get('case_text') or '').strip():
+        return jsonify({"error": "請輸入病例文字"}), 400
+    
+    started = time.perf_counter()
+    result = extract_candidates(data['case_text'].strip(), (data.get('discharge') or '').strip())
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return jsonify(result)
\ No newline at end of file
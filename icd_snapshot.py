@@ -0,0 +1,146 @@
+# common/icd_snapshot.py
+# ICD 二進位快照：把 ICD_code.csv 編譯成「排序好的代碼陣列 + UTF-8 名稱 blob 的 offset」
+# 以唯讀 mmap 開啟，多個 gunicorn worker 透過 page cache 共用同一份，不必各自建 dict
+#
+# 檔案格式（little-endian）：
+#   header  : magic(4s) version(I) count(I) code_width(I) blob_start(I)
+#   codes   : count * code_width bytes，ASCII 代碼右補 \0，已排序
+#   offsets : (2 * count + 1) * uint32，第 i 筆英文 = blob[off[2i]:off[2i+1]]，中文 = blob[off[2i+1]:off[2i+2]]
+#   blob    : 所有名稱的 UTF-8 bytes
+import bisect
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b'ICDS'
+VERSION = 1
+HEADER = struct.Struct('<4sIIII')
+
+# 把 {code: {'english': ..., 'chinese': ...}} 寫成快照檔
+def write_snapshot(entries, out_path):
+    codes = sorted(entries)
+    encoded = [code.encode('utf-8') for code in codes]
+    code_width = max((len(c) for c in encoded), default=1)
+    
+    offsets = [0]
+    blob = bytearray()
+    for code in codes:
+        for field in ('english', 'chinese'):
+            blob += entries[code].get(field, '').encode('utf-8')
+            offsets.append(len(blob))
+            
+    blob_start = HEADER.size + len(codes) * code_width + len(offsets) * 4
+    
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(codes), code_width, blob_start))
+        f.write(b''.join(c.ljust(code_width, b'\0') for c in encoded))
+        f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        f.write(blob)
+    os.replace(tmp_path, out_path)  # 原子替換，正在讀舊檔的 worker 不受影響
+    return len(codes)
+
+# 從 CSV 編譯快照（欄位與 load_icd_db 相同）
+def build_snapshot(csv_path, out_path):
+    import pandas as pd
+    
+    df = pd.read_csv(csv_path, encoding='utf-8', dtype=str)
+    entries = {}
+    for code, english, chinese in zip(df['疾病代碼'], df['CM 英文名稱(2023)'], df['CM 中文名稱(2023)']):
+        if not isinstance(code, str) or not code.strip():
+            continue
+        entries[code.strip()] = {
+            'english': english if isinstance(english, str) else '',
+            'chinese': chinese if isinstance(chinese, str) else ''
+        }
+    return write_snapshot(entries, out_path)
+
+class _CodeArray:
+    # 讓 bisect 直接在 mmap 上做二分搜尋，不必把代碼讀進記憶體
+    def __init__(self, mm, start, count, width):
+        self.mm = mm
+        self.start = start
+        self.count = count
+        self.width = width
+        
+    def __len__(self):
+        return self.count
+        
+    def __getitem__(self, i):
+        pos = self.start + i * self.width
+        return self.mm[pos:pos + self.width]
+
+# 唯讀、類 dict 介面：icd_dict.get(code, {}) 的用法不變
+class IcdSnapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            
+        magic, version, count, code_width, blob_start = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"不是有效的 ICD 快照檔：{path}")
+            
+        self._count = count
+        self._width = code_width
+        self._codes = _CodeArray(self._mm, HEADER.size, count, code_width)
+        self._offsets_start = HEADER.size + count * code_width
+        self._blob_start = blob_start
+        
+    def _index(self, code):
+        key = code.encode('utf-8')
+        if len(key) > self._width:
+            return -1
+        key = key.ljust(self._width, b'\0')
+        i = bisect.bisect_left(self._codes, key)
+        if i < self._count and self._codes[i] == key:
+            return i
+        return -1
+        
+    def _text(self, n):
+        start, end = struct.unpack_from('<II', self._mm, self._offsets_start + n * 4)
+        return self._mm[self._blob_start + start:self._blob_start + end].decode('utf-8')
+        
+    def _entry(self, i):
+        return {'english': self._text(2 * i), 'chinese': self._text(2 * i + 1)}
+        
+    def _code(self, i):
+        return self._codes[i].rstrip(b'\0').decode('utf-8')
+        
+    def get(self, code, default=None):
+        i = self._index(code)
+        return self._entry(i) if i >= 0 else default
+        
+    def __getitem__(self, code):
+        i = self._index(code)
+        if i < 0:
+            raise KeyError(code)
+        return self._entry(i)
+        
+    def __contains__(self, code):
+        return self._index(code) >= 0
+        
+    def __len__(self):
+        return self._count
+        
+    def __iter__(self):
+        return self.keys()
+        
+    def keys(self):
+        return (self._code(i) for i in range(self._count))
+        
+    def items(self):
+        return ((self._code(i), self._entry(i)) for i in range(self._count))
+        
+    def close(self):
+        self._mm.close()
+
+# 用法：python -m common.icd_snapshot [ICD_code.csv] [ICD_code.snapshot]
+if __name__ == '__main__':
+    from config import Config
+    
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else Config.ICD_CSV_PATH
+    out_path = sys.argv[2] if len(sys.argv) > 2 else Config.ICD_SNAPSHOT_PATH
+    count = build_snapshot(csv_path, out_path)
+    print(f"ICD 快照建立完成：{out_path}，共 {count} 筆，{os.path.getsize(out_path) / 1024:.0f} KB")
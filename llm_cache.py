@@ -0,0 +1,146 @@
+# common/llm_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from . import metrics
+
+# 以「完整訊息 + deployment + 取樣參數」的 hash 當 key，快取 LLM 原始輸出
+# 第一層：記憶體 LRU；第二層（選用）：SQLite，多個 worker 可共用
+class LLMCache:
+    def __init__(self, max_entries=512, ttl=86400, db_path=None, db_max_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.db_max_entries = db_max_entries
+        
+        self._memory = OrderedDict()   # key -> (created_at, value)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        
+        if self.db_path:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            conn = self._conn()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+            conn.commit()
+            
+    @staticmethod
+    def make_key(deployment, messages, **params):
+        payload = json.dumps(
+            {"deployment": deployment, "messages": messages, "params": params},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        
+    # 每個執行緒各自一條 SQLite 連線
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+        
+    def _expired(self, created_at, now):
+        return self.ttl and now - created_at > self.ttl
+        
+    def _remember(self, key, created_at, value):
+        with self._lock:
+            self._memory[key] = (created_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.stats["evictions"] += 1
+                
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._expired(entry[0], now):
+                    del self._memory[key]
+                else:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    metrics.count_cache("llm", True)
+                    return entry[1]
+                    
+        if self.db_path:
+            conn = self._conn()
+            row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value, created_at = row
+                if self._expired(created_at, now):
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                else:
+                    conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                    conn.commit()
+                    self._remember(key, created_at, value)
+                    with self._lock:
+                        self.stats["disk_hits"] += 1
+                    metrics.count_cache("llm", True)
+                    return value
+                    
+        with self._lock:
+            self.stats["misses"] += 1
+        metrics.count_cache("llm", False)
+        return None
+        
+    def set(self, key, value):
+        now = time.time()
+        self._remember(key, now, value)
+        with self._lock:
+            self.stats["stores"] += 1
+            
+        if self.db_path:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            # 超過上限：刪掉最久沒用到的；順便清掉過期的
+            if self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.db_max_entries,)
+            )
+            conn.commit()
+            
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.db_path:
+            conn = self._conn()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+            
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        total = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / total, 4) if total else 0.0
+        return stats
+
+llm_cache = LLMCache(
+    max_entries=Config.LLM_CACHE_MAX_ENTRIES,
+    ttl=Config.LLM_CACHE_TTL,
+    db_path=Config.LLM_CACHE_DB_PATH,
+    db_max_entries=Config.LLM_CACHE_DB_MAX_ENTRIES
+)
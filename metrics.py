@@ -0,0 +1,202 @@
+# common/metrics.py
+# 監控指標：各階段耗時、Azure token 用量與呼叫結果（含 429）、快取命中、錯誤次數，以 Prometheus 文字格式由 /metrics 輸出
+#   - 標籤 route（URL 規則，批次為 batch_icd / batch_summary）與 template（摘要模板；ICD 為 default / custom prompt）
+#   - 標籤放在 contextvars：串流產生器在同一個執行緒 / 協程繼續跑，分段平行擷取的執行緒由 chunking.iter_map 複製過去
+#   - 純記憶體、每個行程各自累計（gunicorn 多個 worker 時 Prometheus 要分別抓，或用 serve.py 單行程）
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from config import Config
+
+PREFIX = "ai_summary_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+DEFAULT_LABELS = {"route": "other", "template": "-"}
+_labels = contextvars.ContextVar("metrics_labels", default=DEFAULT_LABELS)
+
+# 設定目前請求 / 批次工作的標籤（沒給的沿用原本的值）
+def bind(**labels):
+    _labels.set(dict(_labels.get(), **labels))
+
+def reset(**labels):
+    _labels.set(dict(DEFAULT_LABELS, **labels))
+
+def current_labels():
+    return _labels.get()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(pairs):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric:
+    kind = None
+    
+    def __init__(self, name, help_text, labelnames):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        
+    # route / template 沒給就取目前綁定的標籤
+    def _key(self, labels):
+        bound = _labels.get()
+        return tuple(str(labels[name] if name in labels else bound.get(name, "")) for name in self.labelnames)
+        
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in items:
+            lines.extend(self._samples(list(zip(self.labelnames, key)), value))
+        return lines
+        
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class Counter(_Metric):
+    kind = "counter"
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+            
+    def _samples(self, pairs, value):
+        return [f"{self.name}{_format_labels(pairs)} {_number(value)}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+    
+    def __init__(self, name, help_text, labelnames, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+            
+    def _samples(self, pairs, entry):
+        counts, total, count = entry
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', f'{bound:g}')])} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(pairs)} {_number(total)}")
+        lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+http_request_seconds = Histogram(
+    "http_request_seconds", "HTTP 請求處理時間（串流回應只算到開始送出）", ["route", "method", "status"])
+stage_seconds = Histogram(
+    "stage_seconds", "各階段耗時：parse_docx / parse_pdf、prefilter、chunk_map、build_prompt、llm、postprocess、word_insert 等",
+    ["route", "template", "stage"])
+llm_tokens = Histogram(
+    "llm_tokens", "每次 Azure 呼叫的 token 數（上游 usage；kind 為 prompt / completion / cached_prompt）",
+    ["route", "template", "deployment", "kind"], TOKEN_BUCKETS)
+llm_attempts_total = Counter(
+    "llm_attempts_total", "Azure 實際送出次數（含重試），依結果 ok / throttled / server_error / connection_error / client_error",
+    ["route", "template", "deployment", "outcome"])
+llm_wait_seconds_total = Counter(
+    "llm_wait_seconds_total", "Azure 呼叫因 RPM / TPM 限流等待的秒數", ["route", "template", "deployment"])
+cache_lookups_total = Counter(
+    "cache_lookups_total", "快取查詢次數（cache 為 llm / text / near_dup，result 為 hit / miss）",
+    ["route", "template", "cache", "result"])
+errors_total = Counter(
+    "errors_total", "各階段拋出的例外次數", ["route", "template", "stage", "error"])
+
+REGISTRY = [http_request_seconds, stage_seconds, llm_tokens, llm_attempts_total,
+            llm_wait_seconds_total, cache_lookups_total, errors_total]
+
+def observe_stage(name, seconds):
+    if Config.METRICS_ENABLED:
+        stage_seconds.observe(seconds, stage=name)
+
+def count_error(stage_name, error):
+    if Config.METRICS_ENABLED:
+        errors_total.inc(stage=stage_name, error=type(error).__name__)
+
+# with stage("word_insert"): ... 記錄耗時；區塊內拋出例外時另外計數（例外照常往外拋）
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        count_error(name, e)
+        raise
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+def count_cache(cache, hit):
+    if Config.METRICS_ENABLED:
+        cache_lookups_total.inc(cache=cache, result="hit" if hit else "miss")
+
+def count_attempt(deployment, outcome):
+    if Config.METRICS_ENABLED:
+        llm_attempts_total.inc(deployment=deployment, outcome=outcome)
+
+def count_wait(deployment, seconds):
+    if Config.METRICS_ENABLED:
+        llm_wait_seconds_total.inc(seconds, deployment=deployment)
+
+# 上游回應的 usage（非串流在 response.usage；串流需開 METRICS_STREAM_USAGE，最後一個 chunk 才有）
+def record_usage(deployment, usage):
+    if not (Config.METRICS_ENABLED and usage is not None):
+        return
+    llm_tokens.observe(usage.prompt_tokens or 0, deployment=deployment, kind="prompt")
+    llm_tokens.observe(usage.completion_tokens or 0, deployment=deployment, kind="completion")
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is not None:
+        llm_tokens.observe(cached, deployment=deployment, kind="cached_prompt")
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def clear():
+    for metric in REGISTRY:
+        metric.clear()
+
+# 每個請求開始時綁定 route，結束時記錄處理時間；並註冊 /metrics
+def init_app(app):
+    from flask import Response, g, request
+    
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        reset(route=request.url_rule.rule if request.url_rule else "other")
+        
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop("metrics_started", None)
+        if Config.METRICS_ENABLED and started is not None:
+            http_request_seconds.observe(time.perf_counter() - started, method=request.method, status=response.status_code)
+        return response
+        
+    def metrics_view():
+        return Response(render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+        
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
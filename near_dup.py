@@ -0,0 +1,146 @@
+# common/near_dup.py
+# 近似重複病例：MinHash + LSH
+#   - 同一次住院重送時常只有小改動（空白、重貼一行檢驗、換一段出院摘要），完整 hash 的 LLM 快取接不到
+#   - 文字正規化後取字元 k-gram（中英文混排不必斷詞），numpy 算出所有 k-gram 的 hash，
+#     MinHash 簽章每次只算 SIGNATURE_BLOCK 個 k-gram 再取累計最小值（200 頁病歷也只用幾 MB 暫存）
+#   - 簽章切成 bands 個區段，任一區段完全相同即為候選，再以簽章相同比例估計 Jaccard 相似度
+#   - 只有同樣 context（自訂 prompt、deployment）的分析才互相比對；記憶體中保留最近 max_entries 筆
+#   - numpy 第一次算簽章時才載入，import 本模組不會拖慢啟動
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from config import Config
+from . import metrics
+
+WHITESPACE_RE = re.compile(r"\s+")
+KGRAM_BASE = 1000003
+SIGNATURE_BLOCK = 4096               # 每次計算的 k-gram 數（暫存矩陣 num_perm × SIGNATURE_BLOCK）
+
+# 全形轉半形、轉小寫、拿掉所有空白（只差空白 / 換行的版本視為完全相同）
+def normalize(text):
+    return WHITESPACE_RE.sub("", unicodedata.normalize("NFKC", text).lower())
+
+# 所有字元 k-gram 的 64-bit 多項式 hash（去重）
+def shingle_hashes(text, k):
+    import numpy as np
+    codes = np.frombuffer(normalize(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < k:
+        codes = np.concatenate([codes, np.zeros(k - len(codes), dtype=np.uint64)])
+    n = len(codes) - k + 1
+    hashes = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        hashes = hashes * np.uint64(KGRAM_BASE) + codes[j:j + n]
+    return np.unique(hashes)
+
+def context_key(**context):
+    payload = "\x1f".join(f"{name}={context[name] or ''}" for name in sorted(context))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+class NearDuplicateIndex:
+    def __init__(self, num_perm=128, bands=16, shingle_size=5, max_entries=20000, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm 必須是 bands 的整數倍")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.seed = seed
+        self._params = None
+        
+        self._entries = OrderedDict()   # entry_id -> {"context", "signature", "keys", "value"}
+        self._buckets = {}              # (context, band, band bytes) -> set(entry_id)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {"queries": 0, "matches": 0, "adds": 0, "evictions": 0}
+        
+    # 乘法-位移 hash 族：(a * x + b) 取高 32 位元，a 為奇數（第一次使用才產生）
+    def _hash_params(self):
+        if self._params is None:
+            import numpy as np
+            rng = np.random.RandomState(self.seed)
+            a = (rng.randint(1, 2 ** 63, size=self.num_perm, dtype=np.uint64) | np.uint64(1))[:, None]
+            b = rng.randint(0, 2 ** 63, size=self.num_perm, dtype=np.uint64)[:, None]
+            self._params = (a, b)
+        return self._params
+        
+    # 分塊計算再取累計最小值，暫存矩陣不隨病歷長度變大
+    def signature(self, text):
+        import numpy as np
+        a, b = self._hash_params()
+        hashes = shingle_hashes(text, self.shingle_size)
+        signature = np.full(self.num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+        for start in range(0, len(hashes), SIGNATURE_BLOCK):
+            block = hashes[None, start:start + SIGNATURE_BLOCK]
+            np.minimum(signature, ((block * a + b) >> np.uint64(32)).min(axis=1), out=signature)
+        return signature
+        
+    def _band_keys(self, context, signature):
+        sig = signature.astype("uint32")
+        return [(context, band, sig[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        
+    # 回傳最相似的一筆 {"similarity", "value"}；沒有候選或低於 min_similarity 回傳 None
+    def query(self, text, context="", min_similarity=0.0, signature=None):
+        signature = self.signature(text) if signature is None else signature
+        with self._lock:
+            self.stats["queries"] += 1
+            candidates = set()
+            for key in self._band_keys(context, signature):
+                candidates.update(self._buckets.get(key, ()))
+            best_id, best = None, -1.0
+            for entry_id in candidates:
+                similarity = int((self._entries[entry_id]["signature"] == signature).sum()) / self.num_perm
+                if similarity > best:
+                    best_id, best = entry_id, similarity
+            if best_id is None or best < min_similarity:
+                metrics.count_cache("near_dup", False)
+                return None
+            self._entries.move_to_end(best_id)
+            self.stats["matches"] += 1
+            metrics.count_cache("near_dup", True)
+            return {"similarity": round(best, 4), "value": self._entries[best_id]["value"]}
+            
+    def add(self, text, value, context="", signature=None):
+        signature = self.signature(text) if signature is None else signature
+        keys = self._band_keys(context, signature)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {"context": context, "signature": signature, "keys": keys, "value": value}
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            self.stats["adds"] += 1
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+        return entry_id
+        
+    def _evict_oldest(self):
+        entry_id, entry = self._entries.popitem(last=False)
+        for key in entry["keys"]:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+        self.stats["evictions"] += 1
+        
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["buckets"] = len(self._buckets)
+        return stats
+
+near_dup_index = NearDuplicateIndex(
+    num_perm=Config.NEAR_DUP_NUM_PERM,
+    bands=Config.NEAR_DUP_BANDS,
+    shingle_size=Config.NEAR_DUP_SHINGLE_SIZE,
+    max_entries=Config.NEAR_DUP_MAX_ENTRIES
+)
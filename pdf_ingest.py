@@ -0,0 +1,132 @@
+# common/pdf_ingest.py
+# PDF 文字擷取：依頁數切成幾段連續頁，交給行程池平行擷取（PyMuPDF 擷取是純 CPU 工作，執行緒無法平行）
+#   - 頁數少於 PDF_PARALLEL_MIN_PAGES 直接在本行程擷取，不付行程間傳遞的成本
+#   - 可只擷取指定頁（"1-5,8,20-"，頁碼從 1 開始）
+#   - 各頁文字收在 list 最後一次 join，不再逐頁字串相加
+#   - 上傳內容（bytes）先寫成一個暫存檔，每段只傳檔案路徑給子行程，不必每段都 pickle 整份 PDF
+#   - 子行程預設以 spawn 啟動：gevent worker 已 monkey patch 且有 hub / 執行緒在跑，直接 fork 並不安全
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+
+# 解析頁碼範圍，回傳 0 起算的頁索引（保留輸入順序、去除重複）；格式錯誤丟 ValueError
+def parse_page_range(spec, page_count):
+    if not spec or not spec.strip():
+        return list(range(page_count))
+        
+    pages = []
+    seen = set()
+    for part in spec.replace('，', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, stop = part.partition('-')
+        try:
+            first = int(start) if start.strip() else 1
+            last = (int(stop) if stop.strip() else page_count) if sep else first
+        except ValueError:
+            raise ValueError(f"頁碼格式錯誤：{part}")
+        if first < 1 or last < first:
+            raise ValueError(f"頁碼範圍錯誤：{part}")
+        for index in range(first - 1, min(last, page_count)):
+            if index not in seen:
+                seen.add(index)
+                pages.append(index)
+    if not pages:
+        raise ValueError(f"指定頁碼超出範圍（共 {page_count} 頁）")
+    return pages
+
+# 來源統一成 fitz.open 的參數：路徑或 bytes（檔案物件先讀成 bytes）
+def _source(source):
+    if isinstance(source, (bytes, bytearray, str, os.PathLike)):
+        return source
+    source.seek(0)
+    return source.read()
+
+def _open(source):
+    import fitz
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype='pdf')
+    return fitz.open(source)
+
+# 行程池的工作：擷取一段頁面的文字
+def _extract_pages(source, pages):
+    doc = _open(source)
+    try:
+        return [doc[index].get_text("text").strip() for index in pages]
+    finally:
+        doc.close()
+
+def _workers():
+    return Config.PDF_MAX_WORKERS or os.cpu_count() or 1
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# 每個行程各自一個行程池（gunicorn fork 後的 worker 第一次用到才建立）
+def get_pool():
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                import multiprocessing
+                context = multiprocessing.get_context(Config.PDF_POOL_START_METHOD)
+                _pool = ProcessPoolExecutor(max_workers=_workers(), mp_context=context)
+                _pool_pid = os.getpid()
+    return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# 把頁面平均切成 n 段連續頁
+def _split(pages, n):
+    size = -(-len(pages) // n)
+    return [pages[i:i + size] for i in range(0, len(pages), size)]
+
+# 回傳各頁文字（依 page_range 的順序）
+def extract_pdf_pages(source, page_range=None):
+    source = _source(source)
+    doc = _open(source)
+    try:
+        pages = parse_page_range(page_range, doc.page_count)
+        if len(pages) < Config.PDF_PARALLEL_MIN_PAGES or _workers() <= 1:
+            return [doc[index].get_text("text").strip() for index in pages]
+    finally:
+        doc.close()
+        
+    batches = _split(pages, _workers())
+    temp_path = None
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            from .doc_buffers import spool_dir
+            fd, temp_path = tempfile.mkstemp(suffix='.pdf', dir=spool_dir())
+            with os.fdopen(fd, 'wb') as f:
+                f.write(source)
+        path = temp_path or source
+        
+        try:
+            pool = get_pool()
+            futures = [pool.submit(_extract_pages, path, batch) for batch in batches]
+            texts = []
+            for future in futures:
+                texts.extend(future.result())
+            return texts
+        except BrokenProcessPool:
+            # worker 被系統砍掉等情況：重建行程池，這次先在本行程擷取
+            _reset_pool()
+            return _extract_pages(path, pages)
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+
+def read_pdf(source, page_range=None):
+    texts = extract_pdf_pages(source, page_range)
+    return "\n".join(texts) + "\n" if texts else ""
@@ -0,0 +1,57 @@
+# profile_startup.py
+# 啟動時間分析：用 python -X importtime 量測 import app + create_app()（伺服器啟動）時各模組的載入時間，列出最慢的模組
+# 用法（專案根目錄）：python profile_startup.py [--top 25] [--no-preload]
+import argparse
+import subprocess
+import sys
+import time
+
+def profile(preload, top):
+    code = (
+        "import time; t = time.perf_counter()\n"
+        "from config import Config\n"
+        f"Config.PRELOAD_DATA = {preload}\n"
+        "import app\n"
+        "app.create_app()\n"
+        "print('TOTAL', time.perf_counter() - t)\n"
+    )
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    
+    if proc.returncode != 0:
+        print(proc.stderr)
+        sys.exit(proc.returncode)
+    
+    # 格式：import time: self [us] | cumulative | imported package
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    
+    total = next(float(l.split()[1]) for l in proc.stdout.splitlines() if l.startswith('TOTAL'))
+    
+    # 依最上層套件彙總自身時間（例如 flask.* 全部算在 flask）
+    packages = {}
+    for cumulative_us, self_us, name in rows:
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    
+    print(f"PRELOAD_DATA={preload}：import app + create_app() 共 {total * 1000:.0f} ms（含直譯器啟動 {wall * 1000:.0f} ms）")
+    print(f"{'ms':>10}  套件")
+    for package, self_us in sorted(packages.items(), key=lambda x: -x[1])[:top]:
+        print(f"{self_us / 1000:>10.1f}  {package}")
+    
+    heavy = [m for m in ('pandas', 'docx', 'fitz', 'openai') if any(r[2].strip() == m for r in rows)]
+    print("已載入的重型套件：", ', '.join(heavy) or '無')
+    print()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--no-preload', action='store_true')
+    args = parser.parse_args()
+    
+    profile(not args.no_preload, args.top)
@@ -0,0 +1,167 @@
+# common/prompt_store.py
+# 儲存的 Prompt：SQLite（WAL）+ 記憶體快取
+#   - 依 kind（summary / icd）與 namespace（使用者）分開存放，每個 namespace 保留最新 max_per_user 筆
+#   - 寫入在單一交易內完成（同名覆蓋 + 超出上限刪除），多個執行緒 / worker 同時儲存不會互相覆蓋
+#   - 列表直接從記憶體回傳；本行程寫入時立即失效，其他 worker 寫入則以 PRAGMA data_version 偵測
+import json
+import os
+import sqlite3
+import threading
+import time
+from config import Config
+
+class PromptStore:
+    def __init__(self, db_path, max_per_user=10):
+        self.db_path = db_path
+        self.max_per_user = max_per_user
+        
+        self._cache = {}     # (kind, namespace) -> [{'name', 'prompt'}]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._data_version = None
+        self._version_checked = 0.0
+        
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS prompts ("
+            "kind TEXT NOT NULL, namespace TEXT NOT NULL, name TEXT NOT NULL, "
+            "prompt TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (kind, namespace, name))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_prompts_updated ON prompts(kind, namespace, updated_at)")
+        conn.commit()
+        
+        # 偵測其他行程寫入用的專屬連線
+        self._watch = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        self._watch_lock = threading.Lock()
+        
+    # 每個執行緒各自一條 SQLite 連線
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+        
+    # 其他 worker 有寫入就清空快取（最多每 PROMPT_STORE_RECHECK 秒檢查一次）
+    def _check_external_changes(self):
+        now = time.monotonic()
+        if now - self._version_checked < Config.PROMPT_STORE_RECHECK:
+            return
+        with self._watch_lock:
+            self._version_checked = now
+            version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+            if self._data_version is not None and version != self._data_version:
+                with self._lock:
+                    self._cache.clear()
+            self._data_version = version
+            
+    # 由舊到新（與原本 JSON 檔的順序相同）
+    def list(self, kind, namespace):
+        self._check_external_changes()
+        key = (kind, namespace)
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            return [dict(p) for p in cached]
+            
+        rows = self._conn().execute(
+            "SELECT name, prompt FROM prompts WHERE kind = ? AND namespace = ? ORDER BY updated_at",
+            (kind, namespace)
+        ).fetchall()
+        prompts = [{"name": name, "prompt": prompt} for name, prompt in rows]
+        with self._lock:
+            self._cache[key] = prompts
+        return [dict(p) for p in prompts]
+        
+    # 同名覆蓋；超過上限刪除最舊的
+    def save(self, kind, namespace, name, prompt):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO prompts (kind, namespace, name, prompt, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, namespace, name, prompt, time.time())
+            )
+            conn.execute(
+                "DELETE FROM prompts WHERE kind = ? AND namespace = ? AND name IN ("
+                "SELECT name FROM prompts WHERE kind = ? AND namespace = ? "
+                "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (kind, namespace, kind, namespace, self.max_per_user)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self._cache.pop((kind, namespace), None)
+            
+    def delete(self, kind, namespace, name):
+        conn = self._conn()
+        deleted = conn.execute(
+            "DELETE FROM prompts WHERE kind = ? AND namespace = ? AND name = ?",
+            (kind, namespace, name)
+        ).rowcount
+        with self._lock:
+            self._cache.pop((kind, namespace), None)
+        return deleted > 0
+        
+    # 匯入舊版 JSON 檔（[{name, prompt}, ...]）；該 kind 已有資料就略過
+    def import_json(self, kind, namespace, path):
+        if not os.path.exists(path):
+            return 0
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM prompts WHERE kind = ? LIMIT 1", (kind,)).fetchone():
+            return 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                prompts = json.load(f)
+        except Exception as e:
+            print(f"舊版 Prompt 檔讀取錯誤: {e}")
+            return 0
+            
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for k, p in enumerate(prompts):
+                conn.execute(
+                    "INSERT OR IGNORE INTO prompts (kind, namespace, name, prompt, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (kind, namespace, p['name'], p['prompt'], now + k * 1e-3)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self._cache.clear()
+        return len(prompts)
+
+DEFAULT_NAMESPACE = "shared"
+
+_store = None
+_store_lock = threading.Lock()
+
+# 第一次使用才建立；順便匯入舊版 JSON 檔
+def get_prompt_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = PromptStore(Config.PROMPT_DB_PATH, Config.PROMPT_STORE_MAX_PER_USER)
+                for kind, path in Config.PROMPT_LEGACY_FILES.items():
+                    store.import_json(kind, DEFAULT_NAMESPACE, path)
+                _store = store
+    return _store
+
+
+# 使用者命名空間：JSON / 表單 / 查詢字串的 user 欄位，或 X-User 標頭；都沒有就是共用
+def request_namespace(request, data=None):
+    user = ""
+    if data:
+        user = data.get('user') or ""
+    user = user or request.args.get('user') or request.form.get('user') or request.headers.get('X-User') or ""
+    return user.strip()[:64] or DEFAULT_NAMESPACE
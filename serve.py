@@ -0,0 +1,26 @@
+# serve.py
+# 正式環境啟動：gevent 協程伺服器，等待 Azure 回應時不佔住執行緒，單一行程可同時處理數百個請求
+# Windows / Linux 皆可用：python serve.py（開發除錯仍用 python app.py）
+# Linux 多行程：gunicorn -c gunicorn.conf.py
+from gevent import monkey
+monkey.patch_all()  # 必須在載入其他模組之前（socket、threading 都要換成協程版本）
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from config import Config
+
+def serve(app, host=None, port=None, max_connections=None):
+    host = host or Config.SERVE_HOST
+    port = port or Config.SERVE_PORT
+    server = WSGIServer(
+        (host, port),
+        app,
+        spawn=Pool(max_connections or Config.SERVE_MAX_CONNECTIONS),
+        log=None
+    )
+    print(f"gevent 伺服器啟動：http://{host}:{port}")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    from app import create_app
+    serve(create_app())
\ No newline at end of file
@@ -0,0 +1,118 @@
+# common/session_store.py
+# ICD 分析的對話 session：訊息留在伺服器端，前端只拿短 id，追問（/refine_icd）時只送新問題
+#   - 只存固定 CAD prompt 之後的訊息（自訂指示、病歷、歷次問答）；固定前綴每次重新組，與首輪逐字相同，上游 prompt 快取才接得上
+#   - SQLite（WAL），多個 worker 共用同一個檔案；追加問答在單一交易內完成，同時追問不會互相覆蓋
+#   - 超過 ttl 沒有使用即失效；建立新 session 時順便清掉過期的，並限制總筆數
+#   - 內容含完整病歷文字，以明文存在 SESSION_DB_PATH；預設不啟用（Config.SESSIONS_ENABLED）
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from config import Config
+
+class SessionStore:
+    def __init__(self, db_path, ttl=86400, max_entries=5000):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        
+        self._local = threading.local()
+        
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)")
+        
+    # 每個執行緒各自一條 SQLite 連線
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+        
+    def _expired(self, updated_at, now):
+        return self.ttl and now - updated_at > self.ttl
+        
+    # 建立 session，回傳 12 字元的 id
+    def create(self, data):
+        session_id = secrets.token_urlsafe(9)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO sessions (id, data, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, json.dumps(data, ensure_ascii=False), now, now)
+            )
+            if self.ttl:
+                conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM sessions WHERE id IN ("
+                "SELECT id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return session_id
+        
+    # 不存在或已過期回傳 None
+    def get(self, session_id):
+        row = self._conn().execute("SELECT data, updated_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or self._expired(row[1], time.time()):
+            return None
+        return json.loads(row[0])
+        
+    # 以 update(data) 修改內容後寫回（同一個交易內讀寫）；不存在或已過期回傳 None
+    def update(self, session_id, update):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data, updated_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None or self._expired(row[1], now):
+                conn.execute("ROLLBACK")
+                return None
+            data = json.loads(row[0])
+            update(data)
+            conn.execute(
+                "UPDATE sessions SET data = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(data, ensure_ascii=False), now, session_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return data
+        
+    def delete(self, session_id):
+        return self._conn().execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+        
+    def get_stats(self):
+        count, oldest = self._conn().execute("SELECT COUNT(*), MIN(updated_at) FROM sessions").fetchone()
+        return {"sessions": count, "oldest_age_seconds": round(time.time() - oldest, 1) if oldest else 0.0}
+
+_store = None
+_store_lock = threading.Lock()
+
+# 第一次使用才建立；未啟用 session（SESSIONS_ENABLED 關閉或沒有 SESSION_DB_PATH）時回傳 None
+def get_session_store():
+    global _store
+    if not (Config.SESSIONS_ENABLED and Config.SESSION_DB_PATH):
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore(Config.SESSION_DB_PATH, Config.SESSION_TTL, Config.SESSION_MAX_ENTRIES)
+    return _store
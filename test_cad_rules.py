@@ -0,0 +1,42 @@
+# tests/test_cad_rules.py
+# 規則檢核：CAD 主診斷比對 DRG / RW；主診斷與 DRG 都不在 CAD_rule.csv 範圍內時為不適用
+import pytest
+from common import cad_rules
+from common.utils import parse_icd_result
+
+RULES = [
+    {'category': 'main', 'condition': 'unstable_refractory', 'codes': ['I25.110', 'I25.112'], 'drg': '124', 'rw': '1.0448'},
+    {'category': 'main', 'condition': 'no_angina', 'codes': ['I25.10'], 'drg': '125', 'rw': '0.7146'},
+    {'category': 'complex', 'condition': 'heart_failure', 'codes': ['I50.*'], 'drg': '124', 'rw': '1.0448'},
+]
+
+@pytest.fixture(autouse=True)
+def rules(monkeypatch):
+    monkeypatch.setattr(cad_rules, 'engine', cad_rules.CadRuleEngine(RULES))
+    monkeypatch.setattr(cad_rules, '_loaded', True)
+
+def answer(cad, drg, rw, codes):
+    lines = [f"是否主診為 CAD：{cad}", f"預估 DRG：{drg}", f"預估 RW：{rw}", "【一般 ICD 推薦】"]
+    lines += [f"{i}. {code} - name" for i, code in enumerate(codes, start=1)]
+    return "\n".join(lines)
+
+def test_cad_consistent():
+    check = cad_rules.check_icd_result(parse_icd_result(answer("是", "125", "0.7146", ["I25.10", "I10"])))
+    assert check["consistent"] is True
+    assert cad_rules.rule_check_note(check) == ""
+
+def test_cad_with_complex_secondary_mismatch():
+    check = cad_rules.check_icd_result(parse_icd_result(answer("是", "125", "0.7146", ["I25.10", "I50.9"])))
+    assert check["consistent"] is False
+    assert "DRG 124" in cad_rules.rule_check_note(check)
+
+def test_acute_mi_not_applicable():
+    check = cad_rules.check_icd_result(parse_icd_result(answer("否", "122", "1.1", ["I21.4", "I10"])))
+    assert check["cad"] is False
+    assert check["consistent"] is None
+    assert cad_rules.rule_check_note(check) == ""
+
+def test_non_cad_main_with_cad_drg():
+    check = cad_rules.check_icd_result(parse_icd_result(answer("是", "125", "0.7146", ["I10", "I25.10"])))
+    assert check["consistent"] is False
+    assert "不是 CAD 主診斷碼" in cad_rules.rule_check_note(check)
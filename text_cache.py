@@ -0,0 +1,99 @@
+# common/text_cache.py
+# 上傳文件的文字擷取快取：以檔案內容的 SHA-256 當 key，同一份 .docx / PDF 重複上傳（換範本、改 prompt 重跑）不必再解析
+#   - 記憶體 LRU，同時限制筆數與總字數（大型 PDF 的文字可能有數 MB）
+#   - document_key 也回傳給呼叫端，下游（例如 LLM 快取、回應欄位）可直接拿來代表「這份文件的這些頁」
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from config import Config
+from . import metrics
+
+HASH_BLOCK = 1024 * 1024
+
+# 路徑、bytes 或檔案物件的內容 hash（檔案物件讀完會移回開頭）
+def content_hash(source):
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        digest.update(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                digest.update(block)
+    else:
+        source.seek(0)
+        for block in iter(lambda: source.read(HASH_BLOCK), b''):
+            digest.update(block)
+        source.seek(0)
+    return digest.hexdigest()
+
+def document_key(kind, digest, pages=None):
+    return f"{kind}:{digest}:{pages}" if pages else f"{kind}:{digest}"
+
+class TextCache:
+    def __init__(self, max_entries=256, max_chars=20000000):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        
+        self._memory = OrderedDict()   # document_key -> text
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        
+    def get(self, key):
+        with self._lock:
+            text = self._memory.get(key)
+            if text is None:
+                self.stats["misses"] += 1
+                return None
+            self._memory.move_to_end(key)
+            self.stats["hits"] += 1
+            return text
+            
+    def set(self, key, text):
+        # 單份就超過上限的不收，避免把其他文件全部擠掉
+        if len(text) > self.max_chars:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._chars -= len(old)
+            self._memory[key] = text
+            self._chars += len(text)
+            while len(self._memory) > self.max_entries or self._chars > self.max_chars:
+                _, evicted = self._memory.popitem(last=False)
+                self._chars -= len(evicted)
+                self.stats["evictions"] += 1
+                
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._chars = 0
+            
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._memory)
+            stats["chars"] = self._chars
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0.0
+        return stats
+        
+    # 回傳 (文字, document_key)；extract(source) 只在沒有快取時呼叫
+    def get_or_extract(self, kind, source, extract, pages=None):
+        key = document_key(kind, content_hash(source), pages)
+        if Config.TEXT_CACHE_ENABLED:
+            text = self.get(key)
+            metrics.count_cache("text", text is not None)
+            if text is not None:
+                return text, key
+        with metrics.stage(f"parse_{kind}"):
+            text = extract(source)
+        if Config.TEXT_CACHE_ENABLED:
+            self.set(key, text)
+        return text, key
+
+text_cache = TextCache(
+    max_entries=Config.TEXT_CACHE_MAX_ENTRIES,
+    max_chars=Config.TEXT_CACHE_MAX_CHARS
+)
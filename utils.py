@@ -1,77 +1,196 @@
 # common/utils.py
 import re
-from .icd_db import icd_dict
-import docx
-import fitz
+import json
+from . import icd_db
+
+# ICD-10 代碼：字母 + 2 碼數字，可接小數點與 1~4 碼；前後不可緊鄰英數字（避免 V1、B12、abc123 之類誤判）
+ICD_CODE_PATTERN = re.compile(r"(?<![A-Za-z0-9.])([A-Z]\d{2}(?:\.?[0-9A-Z]{1,4})?)(?![A-Za-z0-9])", re.IGNORECASE)
+
+# 只快取 ICD 表內的代碼（上限即 ICD 表筆數）；LLM 輸出的任意字串不進快取，免得無限增長
+_render_cache = {}
+_render_cache_source = None   # 快取對應的 icd_dict；重新載入後自動清空
+
+# 代碼 → 「CODE - English (中文)」；不在 ICD 表內回傳 None（保留原文）
+def render_icd_code(code_nodot):
+    global _render_cache, _render_cache_source
+    source = icd_db.get_icd_dict()
+    if source is not _render_cache_source:
+        _render_cache = {}
+        _render_cache_source = source
+    
+    if code_nodot in _render_cache:
+        return _render_cache[code_nodot]
+    
+    entry = source.get(code_nodot)
+    if entry is None:
+        return None
+    
+    english = entry.get('english', '').strip()
+    chinese = entry.get('chinese', '').strip()
+    
+    display_code = code_nodot[:3] + '.' + code_nodot[3:] if len(code_nodot) > 3 else code_nodot
+    
+    if english and english != 'nan':
+        display_text = f"{display_code} - {english}"
+    else:
+        display_text = f"{display_code}"
+    
+    if chinese and chinese != 'nan':
+        display_text += f" ({chinese})"
+    
+    _render_cache[code_nodot] = display_text
+    return display_text
+
+def _replace_match(match):
+    display_text = render_icd_code(match.group(1).upper().replace('.', ''))
+    return display_text if display_text is not None else match.group(0)
+
+# 替換文字中所有 ICD 碼為中英文格式（整段一次掃描）
+def render_icd_codes(text):
+    return ICD_CODE_PATTERN.sub(_replace_match, text)
 
 # 輔助函數：替換單行中的所有 ICD 碼為中英文格式
 def replace_icd_codes_in_line(line):
-    def replace_match(match):
-        raw_code = match.group(1).upper()
-        code_nodot = raw_code.replace('.', '')
-        
-        entry = icd_dict.get(code_nodot, {})
-        english = entry.get('english', '').strip()
-        chinese = entry.get('chinese', '').strip()
+    return render_icd_codes(line)
+
+CAD_SECTION_SEPARATOR = "========================================================================================================"
+
+# 逐行後處理器：可一次餵入整段文字，也可逐段餵入串流 token（湊滿一行才處理）
+class IcdPostProcessor:
+    def __init__(self, render_codes=True):
+        self.render_codes = render_codes   # False：呼叫端已整段替換過代碼
+        self.in_cad_section = False
+        self._partial = ""          # 尚未遇到換行的殘餘文字
+        self._pending_blanks = 0    # 暫存空白行，遇到下一個非空行才輸出（等同 strip 頭尾）
+        self._started = False
+    
+    def _render(self, line):
+        return render_icd_codes(line) if self.render_codes else line
+    
+    def _process_line(self, original_line):
+        if "【CAD 判斷結果】" in original_line:
+            self.in_cad_section = True
+            return [
+                CAD_SECTION_SEPARATOR,
+                "【CAD 判斷結果】",
+                CAD_SECTION_SEPARATOR,
+                self._render(original_line.replace("【CAD 判斷結果】", "").strip()),
+            ]
         
-        display_code = code_nodot[:3] + '.' + code_nodot[3:] if len(code_nodot) > 3 else code_nodot
+        if self.in_cad_section:
+            return [self._render(original_line)]
         
-        if english and english != 'nan':
-            display_text = f"{display_code} - {english}"
-        else:
-            display_text = f"{display_code}"
+        if "【一般 ICD 推薦】" in original_line:
+            return [
+                "",
+                CAD_SECTION_SEPARATOR,
+                "一般 ICD-10 診斷推薦（含中英文名稱）",
+                CAD_SECTION_SEPARATOR,
+            ]
         
-        if chinese and chinese != 'nan':
-            display_text += f" ({chinese})"
+        return [self._render(original_line)]
+    
+    def _emit(self, line):
+        original_line = line.strip()
+        if not original_line:
+            if self._started:
+                self._pending_blanks += 1
+            return []
         
-        return display_text
+        result = [""] * self._pending_blanks
+        self._pending_blanks = 0
+        self._started = True
+        return result + self._process_line(original_line)
     
-    return re.sub(r"([A-Z]\d{1,6}(?:\.\d{1,3})?)", replace_match, line, flags=re.IGNORECASE)
+    def feed(self, chunk):
+        """餵入一段文字，回傳這次湊滿的已處理行"""
+        self._partial += chunk
+        *complete, self._partial = self._partial.split('\n')
+        result = []
+        for line in complete:
+            result.extend(self._emit(line))
+        return result
+    
+    def flush(self):
+        """串流結束：處理最後一行（頭尾空白行不輸出）"""
+        result = self._emit(self._partial)
+        self._partial = ""
+        return result
+    
+    @property
+    def partial(self):
+        return self._partial
 
 # 後端處理函數：修正碼 + 替換官方名稱
 def post_process_icd_with_cad(text):
-    lines = text.strip().split('\n')
-    result = []
-    in_cad_section = False
+    # 先整段一次替換代碼，再逐行處理段落標題
+    processor = IcdPostProcessor(render_codes=False)
+    text = render_icd_codes(text)
+    result = processor.feed(text)
+    result.extend(processor.flush())
+    return "\n".join(result)
+
+# 從 LLM 原始輸出擷取結構化欄位（批次稽核報表用）
+def parse_icd_result(text):
+    def field(label):
+        m = re.search(label + r"\s*[：:]\s*([^\n]*)", text)
+        return m.group(1).strip() if m else ""
     
-    for line in lines:
-        original_line = line.strip()
-        if not original_line:
-            result.append("")
-            continue
-        
-        if "【CAD 判斷結果】" in original_line:
-            in_cad_section = True
-            result.append("========================================================================================================")
-            result.append("【CAD 判斷結果】")
-            result.append("========================================================================================================")
-            result.append(original_line.replace("【CAD 判斷結果】", "").strip())
-            continue
-        
-        if in_cad_section:
-            result.append(replace_icd_codes_in_line(original_line))
-        
-        elif "【一般 ICD 推薦】" in original_line:
-            result.append("")
-            result.append("========================================================================================================")
-            result.append("一般 ICD-10 診斷推薦（含中英文名稱）")
-            result.append("========================================================================================================")
-        
-        else:
-            result.append(replace_icd_codes_in_line(original_line))
+    def yes_no(value):
+        if value.startswith("是"):
+            return "是"
+        if value.startswith("否"):
+            return "否"
+        return value
     
-    return "\n".join(result)
+    drg = re.search(r"\d{3}", field("預估 DRG"))
+    rw = re.search(r"\d+(?:\.\d+)?", field("預估 RW"))
+    
+    # 推薦碼只看【一般 ICD 推薦】段落（沒有段落標題就看全文）
+    section = text.split("【一般 ICD 推薦】", 1)[-1]
+    codes = []
+    for m in re.finditer(r"^\s*\d+\.\s*([A-Z]\d{2}(?:\.?[0-9A-Z]{1,4})?)\b", section, flags=re.MULTILINE | re.IGNORECASE):
+        code_nodot = m.group(1).upper().replace('.', '')
+        display_code = code_nodot[:3] + '.' + code_nodot[3:] if len(code_nodot) > 3 else code_nodot
+        if display_code not in codes:
+            codes.append(display_code)
+    
+    return {
+        "cad": yes_no(field("是否主診為 CAD")),
+        "complex": yes_no(field("是否併發症")),
+        "drg": drg.group(0) if drg else "",
+        "rw": rw.group(0) if rw else "",
+        "codes": codes
+    }
 
-# 讀取 Word
-def read_word_file(file_path):
-    doc = docx.Document(file_path)
+# 將事件包成 Server-Sent Events 格式
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _parse_word(source):
+    import io
+    import docx
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    elif hasattr(source, 'seek'):
+        source.seek(0)
+    doc = docx.Document(source)
     return "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
 
-# 讀取 PDF
-def read_pdf_file(file_path):
-    doc = fitz.open(file_path)
-    text = ""
-    for page in doc:
-        text += page.get_text("text").strip() + "\n"
-    doc.close()
-    return text
\ No newline at end of file
+# 讀取 Word / PDF 並回傳 (文字, document_key)；同內容的檔案直接取快取（見 text_cache）
+def read_word_document(file_path):
+    from .text_cache import text_cache
+    return text_cache.get_or_extract("docx", file_path, _parse_word)
+
+def read_pdf_document(file_path, pages=None):
+    from .text_cache import text_cache
+    from .pdf_ingest import read_pdf
+    return text_cache.get_or_extract("pdf", file_path, lambda source: read_pdf(source, pages), pages)
+
+# 讀取 Word（路徑或檔案物件皆可）
+def read_word_file(file_path):
+    return read_word_document(file_path)[0]
+
+# 讀取 PDF（路徑、bytes 或檔案物件；pages 例如 "1-5,8"，頁數多時分頁平行擷取，見 pdf_ingest）
+def read_pdf_file(file_path, pages=None):
+    return read_pdf_document(file_path, pages)[0]
\ No newline at end of file
@@ -0,0 +1,112 @@
+# common/word_insert.py
+# 把摘要插入 Word 書籤位置
+#   - 書籤以一次 XPath（w:bookmarkStart）找，不再逐段序列化 XML 做字串比對；表格、頁首 / 頁尾內的書籤也找得到
+#   - 字體 / 字級 / 行距放在兩個共用段落樣式（標題、內文），每段只掛樣式，不再逐 run 設 rFonts、逐字判斷中英文
+#   - 書籤沒找到時，沿用舊行為：找含書籤名稱文字的段落（範本直接打 AI_SUMMARY_HERE 的情況），再不行就附加在文件最後
+SUMMARY_TITLE = "【產生報告總結及建議】"
+TITLE_STYLE = "AI Summary Title"
+BODY_STYLE = "AI Summary Body"
+
+CJK_FONT = '標楷體'
+LATIN_FONT = 'Times New Roman'
+
+def _add_style(doc, name, size, ascii_font, east_asia_font, bold=False, space_after=None):
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.shared import Pt
+    from docx.oxml.ns import qn
+    
+    # 範本已經有同名樣式（例如先前產生過）就直接用
+    try:
+        return doc.styles[name]
+    except KeyError:
+        pass
+        
+    style = doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+    style.quick_style = False
+    style.font.size = Pt(size)
+    if bold:
+        style.font.bold = True
+    style.font.name = ascii_font                      # w:ascii + w:hAnsi
+    style.element.rPr.rFonts.set(qn('w:eastAsia'), east_asia_font)
+    style.paragraph_format.line_spacing = 1.5
+    if space_after is not None:
+        style.paragraph_format.space_after = Pt(space_after)
+    return style
+
+# 標題三種字體都是標楷體；內文中文標楷體、英數 Times New Roman（與舊版逐 run 設定的結果相同）
+def ensure_summary_styles(doc):
+    title = _add_style(doc, TITLE_STYLE, 16, CJK_FONT, CJK_FONT, bold=True)
+    body = _add_style(doc, BODY_STYLE, 12, LATIN_FONT, CJK_FONT, space_after=6)
+    return title, body
+
+# 要搜尋的部分：本文 + 各節的頁首頁尾（只看有自己定義的，避免連結到上一節的重複）
+def _search_roots(doc):
+    roots = [(doc.element.body, doc._body)]
+    seen = set()
+    for section in doc.sections:
+        for part in (section.header, section.first_page_header, section.even_page_header,
+                     section.footer, section.first_page_footer, section.even_page_footer):
+            if part.is_linked_to_previous:
+                continue
+            element = part._element
+            if id(element) not in seen:
+                seen.add(id(element))
+                roots.append((element, part))
+    return roots
+
+def _xpath_literal(value):
+    if '"' not in value:
+        return f'"{value}"'
+    return "concat(" + ", '\"', ".join(f'"{piece}"' for piece in value.split('"')) + ")"
+
+# 回傳 (w:p 元素, 所屬容器)；找不到回傳 (None, None)
+def find_bookmark_paragraph(doc, bookmark_name):
+    literal = _xpath_literal(bookmark_name)
+    roots = _search_roots(doc)
+    
+    # 書籤在段落內取該段落；在段落之間（表格列、本文層）取下一個段落（聯集依文件順序，段落本身在前）
+    start = f'(.//w:bookmarkStart[@w:name={literal}])[1]'
+    query = f'{start}/ancestor::w:p[1] | {start}/following::w:p[1]'
+    for root, parent in roots:
+        paragraphs = root.xpath(query)
+        if paragraphs:
+            return paragraphs[0], parent
+            
+    # 舊範本：直接打書籤名稱當佔位文字
+    for root, parent in roots:
+        paragraphs = root.xpath(f'.//w:p[contains(string(.), {literal})]')
+        if paragraphs:
+            return paragraphs[0], parent
+    return None, None
+
+def _summary_lines(summary_text):
+    return [line.strip() for line in summary_text.split('\n') if line.strip()]
+
+# word_path / output_path 可以是檔案路徑，也可以是檔案物件（BytesIO、SpooledTemporaryFile）
+def insert_summary_at_bookmark(word_path, summary_text, bookmark_name="AI_SUMMARY_HERE", output_path=None):
+    # python-docx 只在需要產生 Word 時才載入
+    from docx import Document
+    from docx.text.paragraph import Paragraph
+    
+    doc = Document(word_path)
+    title_style, body_style = ensure_summary_styles(doc)
+    
+    p_element, parent = find_bookmark_paragraph(doc, bookmark_name)
+    if p_element is not None:
+        paragraph = Paragraph(p_element, parent)
+        # 清掉佔位文字，但保留 bookmarkStart / bookmarkEnd，之後還能再定位
+        for r in p_element.xpath('./w:r | ./w:hyperlink'):
+            p_element.remove(r)
+            
+        paragraph.insert_paragraph_before(SUMMARY_TITLE, title_style)
+        for line in _summary_lines(summary_text):
+            paragraph.insert_paragraph_before(line, body_style)
+    else:
+        # === fallback：書籤沒找到，加到最後 ===
+        doc.add_page_break()
+        doc.add_paragraph(SUMMARY_TITLE, title_style)
+        for line in _summary_lines(summary_text):
+            doc.add_paragraph(line, body_style)
+            
+    doc.save(output_path or word_path)
+    return output_path or word_path